@@ -0,0 +1,85 @@
+import ipaddress
+
+IPV4_MAPPED = int(ipaddress.IPv6Address('::ffff:0:0'))
+
+
+def to_number(address):
+    if address.version == 4:
+        return IPV4_MAPPED + int(address)
+    return int(address)
+
+
+def to_key(number):
+    return f'{number:032x}'
+
+
+def normalize_ip(ip):
+    """The canonical text of an address, other host names only stripped.
+
+    An address written in several ways (upper case, leading zeros in IPv6
+    groups, IPv4 mapped to IPv6) is stored as one text, so the unique
+    ip of source work loads holds for addresses and not only for texts.
+    """
+    if not isinstance(ip, str):
+        return ip
+    ip = ip.strip()
+    try:
+        address = ipaddress.ip_address(ip)
+    except ValueError:
+        return ip
+    if address.version == 6 and address.ipv4_mapped:
+        address = address.ipv4_mapped
+    return str(address)
+
+
+def ip_key(ip):
+    try:
+        address = ipaddress.ip_address(ip.strip())
+    except (AttributeError, ValueError):
+        return None
+    return to_key(to_number(address))
+
+
+def network_range(cidr):
+    network = ipaddress.ip_network(cidr.strip(), strict=False)
+    return (
+        to_key(to_number(network.network_address)),
+        to_key(to_number(network.broadcast_address))
+    )
+
+
+def octet_ranges(prefix):
+    values = [
+        value for value in range(256) if str(value).startswith(prefix)
+    ]
+    ranges = []
+    for value in values:
+        if ranges and ranges[-1][1] == value - 1:
+            ranges[-1][1] = value
+        else:
+            ranges.append([value, value])
+    return ranges
+
+
+def prefix_ranges(prefix):
+    octets = prefix.split('.')
+    complete, partial = octets[:-1], octets[-1]
+    if len(octets) > 4 or not all(
+        octet.isdigit() and int(octet) < 256 for octet in complete
+    ) or (partial and not partial.isdigit()):
+        return None
+    if not partial and not complete:
+        return None
+    ranges = octet_ranges(partial) if partial else [[0, 255]]
+    if not ranges:
+        return None
+    free_bits = 8 * (3 - len(complete))
+    base = 0
+    for octet in complete:
+        base = base * 256 + int(octet)
+    result = []
+    for first, last in ranges:
+        start = ((base * 256 + first) << free_bits) + IPV4_MAPPED
+        end = ((base * 256 + last + 1) << free_bits) - 1 + IPV4_MAPPED
+        result.append((to_key(start), to_key(end)))
+    return result
@@ -0,0 +1,462 @@
+import json
+import math
+import subprocess
+import threading
+import uuid
+from time import perf_counter
+
+from django.db import connection
+from django.test import Client
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+
+RESOURCES = (
+    'credentials',
+    'mount_points',
+    'work_loads',
+    'migration_targets',
+    'migrations'
+)
+
+
+def percentile(values, percent):
+    if not values:
+        return None
+    values = sorted(values)
+    return values[max(math.ceil(percent / 100 * len(values)) - 1, 0)]
+
+
+def git_commit():
+    try:
+        return subprocess.run(
+            ['git', 'rev-parse', '--short', 'HEAD'],
+            capture_output=True,
+            text=True,
+            check=True
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def parse_body(content):
+    try:
+        return json.loads(content)
+    except ValueError:
+        return None
+
+
+class InProcessTransport:
+    """Sends requests through the Django test client in this process."""
+
+    def __init__(self):
+        self.local = threading.local()
+
+    def request(self, method, path, data=None, json_data=None, token=None):
+        client = getattr(self.local, 'client', None)
+        if client is None:
+            client = self.local.client = Client()
+        headers = {'HTTP_AUTHORIZATION': f'Bearer {token}'} if token else {}
+        kwargs = {}
+        if json_data is not None:
+            kwargs = {
+                'data': json.dumps(json_data),
+                'content_type': 'application/json'
+            }
+        elif data is not None:
+            kwargs = {'data': data}
+        with CaptureQueriesContext(connection) as queries:
+            response = getattr(client, method.lower())(
+                path,
+                **kwargs,
+                **headers
+            )
+            content = (
+                b''.join(response.streaming_content) if response.streaming
+                else response.content
+            )
+        return response.status_code, parse_body(content), len(queries)
+
+    def close(self):
+        connection.close()
+
+
+class HttpTransport:
+    """Sends requests to a running server, queries are not counted."""
+
+    def __init__(self, url):
+        import requests
+
+        self.requests = requests
+        self.url = url.rstrip('/')
+        self.local = threading.local()
+
+    def request(self, method, path, data=None, json_data=None, token=None):
+        session = getattr(self.local, 'session', None)
+        if session is None:
+            session = self.local.session = self.requests.Session()
+        headers = {'Authorization': f'Bearer {token}'} if token else {}
+        response = session.request(
+            method,
+            f'{self.url}{path}',
+            data=data,
+            json=json_data,
+            headers=headers
+        )
+        return response.status_code, parse_body(response.content), None
+
+    def close(self):
+        session = getattr(self.local, 'session', None)
+        if session is not None:
+            session.close()
+
+
+class Route:
+
+    def __init__(self, name, method, make, expected=(200,)):
+        self.name = name
+        self.method = method
+        self.make = make
+        self.expected = expected
+
+
+class Fixture:
+    """Objects the routes read and write, created through the API."""
+
+    def __init__(self, transport, username=None, password=None):
+        self.transport = transport
+        self.username = username
+        self.password = password
+        self.token = None
+        self.created = {resource: [] for resource in RESOURCES}
+        self.fresh = {}
+        self.batches = []
+        self.lock = threading.Lock()
+
+    def call(self, method, path, expected=(200, 201), **kwargs):
+        status, body, queries = self.transport.request(
+            method,
+            path,
+            token=self.token,
+            **kwargs
+        )
+        if status not in expected:
+            raise RuntimeError(f'{method} {path} returned {status}: {body}')
+        return body
+
+    def create(self, resource, data):
+        body = self.call('POST', f'/api/v1/{resource}/', data=data)
+        self.remember(resource, body['id'])
+        return body['id']
+
+    def remember(self, resource, pk):
+        with self.lock:
+            self.created[resource].append(pk)
+
+    def credentials_data(self):
+        return {
+            'username': uuid.uuid4().hex,
+            'password': uuid.uuid4().hex,
+            'domain': uuid.uuid4().hex
+        }
+
+    def mount_point_data(self):
+        return {
+            'mount_point_name': uuid.uuid4().hex,
+            'total_size_of_the_volume': 1
+        }
+
+    def work_load_data(self):
+        return {
+            'ip': uuid.uuid4().hex,
+            'credentials': self.credentials,
+            'storage': self.mount_points
+        }
+
+    def migration_target_data(self):
+        return {
+            'cloud_type': 'aws',
+            'cloud_credentials': self.credentials,
+            'target_vm': self.work_load
+        }
+
+    def migration_data(self):
+        return {
+            'selected_mount_points': self.mount_points[:1],
+            'source_of_type': self.work_load,
+            'migration_target': self.migration_target
+        }
+
+    def set_up(self, fresh_migrations):
+        if self.username is None:
+            self.username = f'bench-{uuid.uuid4().hex}'
+            self.password = uuid.uuid4().hex
+            self.call('POST', '/api/v1/auth/', data={
+                'username': self.username,
+                'password': self.password
+            })
+        self.token = self.call('POST', '/api/v1/token/', data={
+            'username': self.username,
+            'password': self.password
+        })['access']
+        self.credentials = self.create(
+            'credentials',
+            self.credentials_data()
+        )
+        self.mount_points = [
+            self.create('mount_points', self.mount_point_data())
+            for number in range(2)
+        ]
+        self.work_load = self.create('work_loads', self.work_load_data())
+        self.migration_target = self.create(
+            'migration_targets',
+            self.migration_target_data()
+        )
+        self.migration = self.create('migrations', self.migration_data())
+        self.ids = {
+            'credentials': self.credentials,
+            'mount_points': self.mount_points[0],
+            'work_loads': self.work_load,
+            'migration_targets': self.migration_target,
+            'migrations': self.migration
+        }
+        for name, count in fresh_migrations.items():
+            self.fresh[name] = [
+                self.create('migrations', self.migration_data())
+                for number in range(count)
+            ]
+
+    def batch(self):
+        with self.lock:
+            if not self.batches:
+                self.batches.append(self.call(
+                    'POST',
+                    '/api/v1/migrations/run/',
+                    expected=(202,),
+                    data={'ids': self.fresh['batch'].pop(), 'concurrency': 1}
+                )['batch id'])
+            return self.batches[-1]
+
+    def tear_down(self):
+        for resource in reversed(RESOURCES):
+            for pk in self.created[resource]:
+                self.call(
+                    'DELETE',
+                    f'/api/v1/{resource}/{pk}/',
+                    expected=(204, 404)
+                )
+
+
+def default_routes(fixture):
+    routes = [
+        Route('token', 'POST', lambda number: ('/api/v1/token/', {
+            'data': {
+                'username': fixture.username,
+                'password': fixture.password
+            }
+        })),
+    ]
+    makers = {
+        'credentials': fixture.credentials_data,
+        'mount_points': fixture.mount_point_data,
+        'work_loads': fixture.work_load_data,
+        'migration_targets': fixture.migration_target_data,
+        'migrations': fixture.migration_data,
+    }
+    for resource in RESOURCES:
+        routes += [
+            Route(
+                f'{resource}:list',
+                'GET',
+                lambda number, resource=resource: (
+                    f'/api/v1/{resource}/', {}
+                )
+            ),
+            Route(
+                f'{resource}:detail',
+                'GET',
+                lambda number, resource=resource: (
+                    f'/api/v1/{resource}/{fixture.ids[resource]}/', {}
+                )
+            ),
+            Route(
+                f'{resource}:create',
+                'POST',
+                lambda number, resource=resource: (
+                    f'/api/v1/{resource}/',
+                    {'data': makers[resource]()}
+                ),
+                expected=(201,)
+            ),
+            Route(
+                f'{resource}:export',
+                'GET',
+                lambda number, resource=resource: (
+                    f'/api/v1/{resource}/export.ndjson', {}
+                )
+            ),
+        ]
+    routes += [
+        Route('mount_points:bulk', 'POST', lambda number: (
+            '/api/v1/mount_points/bulk/',
+            {'json_data': [fixture.mount_point_data() for item in range(10)]}
+        )),
+        Route('work_loads:bulk', 'POST', lambda number: (
+            '/api/v1/work_loads/bulk/',
+            {'json_data': [fixture.work_load_data() for item in range(10)]}
+        )),
+        Route('migrations:run', 'GET', lambda number: (
+            f'/api/v1/migrations/{fixture.fresh["run"][number]}/run/', {}
+        ), expected=(202,)),
+        Route('migrations:state', 'GET', lambda number: (
+            f'/api/v1/migrations/{fixture.migration}/state/', {}
+        )),
+        Route('migrations:states', 'GET', lambda number: (
+            '/api/v1/migrations/state/',
+            {'data': {'ids': ','.join(
+                str(pk) for pk in fixture.created['migrations'][:100]
+            )}}
+        )),
+        Route('migrations:state cache', 'GET', lambda number: (
+            '/api/v1/migrations/state/cache/', {}
+        )),
+        Route('migrations:poll', 'GET', lambda number: (
+            '/api/v1/migrations/state/poll/',
+            {'data': {'ids': fixture.migration, 'timeout': 0}}
+        )),
+        Route('migrations:batch run', 'POST', lambda number: (
+            '/api/v1/migrations/run/',
+            {'data': {'ids': fixture.fresh['batch'][number], 'concurrency': 1}}
+        ), expected=(202,)),
+        Route('migrations:batch state', 'GET', lambda number: (
+            f'/api/v1/migrations/batches/{fixture.batch()}/', {}
+        )),
+    ]
+    return routes
+
+
+def summarize(route, timings, queries, errors, elapsed):
+    milliseconds = [timing * 1000 for timing in timings]
+    return {
+        'route': route.name,
+        'method': route.method,
+        'requests': len(timings),
+        'errors': errors,
+        'p50': percentile(milliseconds, 50),
+        'p95': percentile(milliseconds, 95),
+        'p99': percentile(milliseconds, 99),
+        'mean': sum(milliseconds) / len(milliseconds) if timings else None,
+        'throughput': len(timings) / elapsed if elapsed else None,
+        'queries': sum(queries) / len(queries) if queries else None
+    }
+
+
+def run_route(transport, route, fixture, requests, concurrency):
+    timings, queries = [], []
+    state = {'next': 0, 'errors': 0}
+    lock = threading.Lock()
+
+    def work():
+        try:
+            while True:
+                with lock:
+                    number = state['next']
+                    if number >= requests:
+                        return
+                    state['next'] += 1
+                try:
+                    path, kwargs = route.make(number)
+                    started = perf_counter()
+                    status, body, query_count = transport.request(
+                        route.method,
+                        path,
+                        token=fixture.token,
+                        **kwargs
+                    )
+                except Exception:
+                    # A refused connection or a broken fixture is an error
+                    # of the request, the other requests still run.
+                    with lock:
+                        state['errors'] += 1
+                    continue
+                timing = perf_counter() - started
+                with lock:
+                    timings.append(timing)
+                    if query_count is not None:
+                        queries.append(query_count)
+                    if status not in route.expected:
+                        state['errors'] += 1
+                if route.method == 'POST' and isinstance(body, dict):
+                    resource = route.name.split(':')[0]
+                    if route.name.endswith(':create') and 'id' in body:
+                        fixture.remember(resource, body['id'])
+                    elif route.name.endswith(':bulk'):
+                        for result in body.get('results', []):
+                            fixture.remember(resource, result['id'])
+        finally:
+            transport.close()
+
+    threads = [
+        threading.Thread(target=work, name=f'bench-{number}')
+        for number in range(concurrency)
+    ]
+    started = perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return summarize(
+        route,
+        timings,
+        queries,
+        state['errors'],
+        perf_counter() - started
+    )
+
+
+def run_benchmark(transport, requests, concurrency, names=None,
+                  username=None, password=None, keep=False, on_route=None):
+    fixture = Fixture(transport, username, password)
+    fixture.set_up({'run': requests, 'batch': requests + 1})
+    try:
+        routes = [
+            route for route in default_routes(fixture)
+            if not names or route.name in names
+        ]
+        results = []
+        for route in routes:
+            result = run_route(
+                transport,
+                route,
+                fixture,
+                requests,
+                concurrency
+            )
+            results.append(result)
+            if on_route:
+                on_route(result)
+    finally:
+        if not keep:
+            fixture.tear_down()
+        transport.close()
+    return {
+        'commit': git_commit(),
+        'created': timezone.now().isoformat(),
+        'requests': requests,
+        'concurrency': concurrency,
+        'routes': results
+    }
+
+
+def compare(results, baseline):
+    old = {route['route']: route for route in baseline['routes']}
+    changes = []
+    for route in results['routes']:
+        previous = old.get(route['route'])
+        if previous and previous['p95'] and route['p95'] is not None:
+            changes.append((
+                route['route'],
+                previous['p95'],
+                route['p95'],
+                (route['p95'] - previous['p95']) / previous['p95'] * 100
+            ))
+    return changes
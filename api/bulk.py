@@ -0,0 +1,300 @@
+from django.db import IntegrityError, transaction
+
+from . import versions
+from .addresses import ip_key
+from .models import Credentials, MountPoint, WorkLoad
+from .serializers import (IdentityMap, MountPointSerializer,
+                          WorkLoadSerializer, to_pk)
+
+BATCH_SIZE = 500
+
+
+def chunks(items, size=BATCH_SIZE):
+    for start in range(0, len(items), size):
+        yield items[start:start + size]
+
+
+def as_list(value):
+    if value is None:
+        return []
+    if isinstance(value, (list, tuple)):
+        return list(value)
+    return [value]
+
+
+def as_ids(value):
+    """The ids of a list of ids or of a single id, None for anything else."""
+    ids = as_list(value)
+    if all(isinstance(pk, (int, str)) for pk in ids):
+        return ids
+    return None
+
+
+def fetch_by_key(queryset, key, values):
+    objects = {}
+    for chunk in chunks(list(values)):
+        for real_object in queryset.filter(**{f'{key}__in': chunk}):
+            objects.setdefault(getattr(real_object, key), real_object)
+    return objects
+
+
+def validate_items(serializer_class, items, key=None):
+    valid, errors, keys = {}, {}, set()
+    for index, item in enumerate(items):
+        serializer = serializer_class(data=item)
+        if not serializer.is_valid():
+            errors[index] = serializer.errors
+        elif key is None:
+            valid[index] = serializer.validated_data
+        elif serializer.validated_data[key] in keys:
+            errors[index] = {key: [f'Duplicate {key} in the request.']}
+        else:
+            keys.add(serializer.validated_data[key])
+            valid[index] = serializer.validated_data
+    return valid, errors
+
+
+def bulk_save(model, key, created, updated, fields, **filters):
+    model.objects.bulk_create(created, batch_size=BATCH_SIZE)
+    model.objects.bulk_update(updated, fields, batch_size=BATCH_SIZE)
+    missing = [
+        real_object for real_object in created if real_object.pk is None
+    ]
+    if not missing:
+        return
+    if key is None:
+        # Without RETURNING or a unique key the created rows are taken as
+        # the newest ones, so such upserts must not run side by side there.
+        pks = model.objects.order_by('-pk').values_list(
+            'pk',
+            flat=True
+        )[:len(missing)]
+        for real_object, pk in zip(missing, reversed(list(pks))):
+            real_object.pk = pk
+        return
+    saved = fetch_by_key(
+        model.objects.order_by('-pk').filter(**filters),
+        key,
+        [getattr(real_object, key) for real_object in missing]
+    )
+    for real_object in missing:
+        real_object.pk = saved[getattr(real_object, key)].pk
+
+
+def save_objects(model, key, created, updated, fields, **filters):
+    """Saves the objects, returns the errors of those that broke a constraint.
+
+    A batch that breaks a constraint, for example by a row created by a
+    concurrent request, is saved again one object at a time so that only
+    the offending objects fail.
+    """
+    versions.bump(model)
+    try:
+        with transaction.atomic():
+            bulk_save(model, key, created, updated, fields, **filters)
+        return {}
+    except IntegrityError:
+        pass
+    errors = {}
+    for real_object in created:
+        real_object.pk = None
+    for real_object in created + updated:
+        try:
+            with transaction.atomic():
+                if real_object.pk is None:
+                    real_object.save(force_insert=True)
+                else:
+                    real_object.save(update_fields=fields)
+        except IntegrityError:
+            conflict = f'conflicts with another {model._meta.verbose_name}.'
+            if key is None:
+                errors[id(real_object)] = {
+                    'non_field_errors': [f'The item {conflict}']
+                }
+            else:
+                errors[id(real_object)] = {
+                    key: [f'{getattr(real_object, key)} {conflict}']
+                }
+    return errors
+
+
+def drop_failed(objects, created, updated, errors, failed):
+    for index, real_object in list(objects.items()):
+        if id(real_object) in failed:
+            errors[index] = failed[id(real_object)]
+            del objects[index]
+    for saved in (created, updated):
+        saved[:] = [
+            real_object for real_object in saved
+            if id(real_object) not in failed
+        ]
+
+
+def bulk_result(objects, created, errors):
+    created = {id(real_object) for real_object in created}
+    return {
+        'created': len(created),
+        'updated': len(objects) - len(created),
+        'results': [
+            {
+                'index': index,
+                'id': real_object.pk,
+                'status': (
+                    'created' if id(real_object) in created else 'updated'
+                )
+            }
+            for index, real_object in sorted(objects.items())
+        ],
+        'errors': [
+            {'index': index, 'errors': error}
+            for index, error in sorted(errors.items())
+        ]
+    }
+
+
+def upsert_mount_points(items):
+    """Creates the items without an id and updates the ones with an id.
+
+    Work loads share mount point names (every one has its c:), so only the
+    id tells which mount point an item updates.
+    """
+    valid, errors = validate_items(MountPointSerializer, items)
+    pks = {
+        index: to_pk(items[index]['id'])
+        for index in valid if items[index].get('id') not in (None, '')
+    }
+    existing = fetch_by_key(
+        MountPoint.objects.all(),
+        'pk',
+        [pk for pk in pks.values() if pk is not None]
+    )
+    seen = set()
+    for index, pk in pks.items():
+        if pk not in existing:
+            errors[index] = {
+                'id': [f'{items[index]["id"]} mount point does not exist']
+            }
+            del valid[index]
+        elif pk in seen:
+            errors[index] = {'id': ['Duplicate id in the request.']}
+            del valid[index]
+        else:
+            seen.add(pk)
+    objects, created, updated = {}, [], []
+    for index, data in valid.items():
+        if index in pks:
+            mount_point = existing[pks[index]]
+            mount_point.mount_point_name = data['mount_point_name']
+            mount_point.total_size_of_the_volume = (
+                data['total_size_of_the_volume']
+            )
+            updated.append(mount_point)
+        else:
+            mount_point = MountPoint(**data)
+            created.append(mount_point)
+        objects[index] = mount_point
+    drop_failed(objects, created, updated, errors, save_objects(
+        MountPoint,
+        None,
+        created,
+        updated,
+        ['mount_point_name', 'total_size_of_the_volume']
+    ))
+    return bulk_result(objects, created, errors)
+
+
+def check_related(items, valid, errors, identity_map):
+    credentials = identity_map.get_many(Credentials, [
+        to_pk(items[index].get('credentials')) for index in valid
+    ])
+    storages = {
+        index: as_ids(items[index].get('storage')) for index in valid
+    }
+    mount_points = identity_map.get_many(MountPoint, [
+        to_pk(pk)
+        for storage in storages.values() if storage
+        for pk in storage
+    ])
+    related = {}
+    for index in list(valid):
+        item = items[index]
+        item_errors = {}
+        credentials_pk = item.get('credentials')
+        if not credentials_pk:
+            item_errors['credentials'] = ['This field is required.']
+        elif to_pk(credentials_pk) not in credentials:
+            item_errors['credentials'] = [
+                f'{credentials_pk} credentials does not exist'
+            ]
+        storage = storages[index]
+        if storage is None:
+            item_errors['storage'] = ['Expected a list of mount point ids.']
+            storage = []
+        elif not storage:
+            item_errors['storage'] = ['This field is required.']
+        storage = list(dict.fromkeys(storage))
+        missing = [pk for pk in storage if to_pk(pk) not in mount_points]
+        if missing:
+            item_errors['storage'] = [
+                f'{pk} storage does not exist' for pk in missing
+            ]
+        if item_errors:
+            errors[index] = item_errors
+            del valid[index]
+        else:
+            related[index] = (
+                credentials[to_pk(credentials_pk)],
+                [to_pk(pk) for pk in storage]
+            )
+    return related
+
+
+def upsert_work_loads(items, identity_map=None):
+    valid, errors = validate_items(WorkLoadSerializer, items, 'ip')
+    related = check_related(
+        items,
+        valid,
+        errors,
+        identity_map or IdentityMap()
+    )
+    existing = fetch_by_key(
+        WorkLoad.objects.filter(migrated_from__isnull=True),
+        'ip',
+        [data['ip'] for data in valid.values()]
+    )
+    objects, created, updated = {}, [], []
+    for index, data in valid.items():
+        credentials, storage = related[index]
+        work_load = existing.get(data['ip'])
+        if work_load is None:
+            work_load = WorkLoad(
+                ip=data['ip'],
+                ip_key=ip_key(data['ip']),
+                credentials=credentials
+            )
+            created.append(work_load)
+        else:
+            work_load.credentials = credentials
+            updated.append(work_load)
+        objects[index] = work_load
+    through = WorkLoad.storage.through
+    with transaction.atomic():
+        drop_failed(objects, created, updated, errors, save_objects(
+            WorkLoad,
+            'ip',
+            created,
+            updated,
+            ['credentials'],
+            migrated_from__isnull=True
+        ))
+        for chunk in chunks([work_load.pk for work_load in updated]):
+            through.objects.filter(workload_id__in=chunk).delete()
+        through.objects.bulk_create(
+            [
+                through(workload_id=objects[index].pk, mountpoint_id=pk)
+                for index in objects
+                for pk in related[index][1]
+            ],
+            batch_size=BATCH_SIZE
+        )
+    return bulk_result(objects, created, errors)
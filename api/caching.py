@@ -0,0 +1,81 @@
+import hashlib
+import threading
+from collections import OrderedDict
+
+from django.conf import settings
+from django.utils.http import parse_etags
+from rest_framework.response import Response
+
+from .versions import get_versions
+
+
+class ResponseCache:
+
+    def __init__(self):
+        self.entries = OrderedDict()
+        self.lock = threading.Lock()
+
+    def get(self, key):
+        with self.lock:
+            if key not in self.entries:
+                return None
+            self.entries.move_to_end(key)
+            return self.entries[key]
+
+    def set(self, key, data):
+        with self.lock:
+            self.entries[key] = data
+            self.entries.move_to_end(key)
+            while len(self.entries) > settings.API_RESPONSE_CACHE_SIZE:
+                self.entries.popitem(last=False)
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+
+    def __len__(self):
+        return len(self.entries)
+
+
+responses = ResponseCache()
+
+
+def make_etag(request, versions):
+    key = '|'.join([
+        request.build_absolute_uri(),
+        request.accepted_renderer.format,
+        ','.join(str(version) for version in versions)
+    ])
+    return '"%s"' % hashlib.sha1(key.encode()).hexdigest()
+
+
+def etag_matches(request, etag):
+    etags = parse_etags(request.headers.get('If-None-Match', ''))
+    return '*' in etags or etag in etags
+
+
+class ConditionalGetMixin:
+    version_models = ()
+
+    def cached_response(self, handler, request, *args, **kwargs):
+        etag = make_etag(request, get_versions(self.version_models))
+        if etag_matches(request, etag):
+            return Response(status=304, headers={'ETag': etag})
+        data = responses.get(etag)
+        if data is None:
+            response = handler(request, *args, **kwargs)
+            if response.status_code != 200:
+                return response
+            responses.set(etag, response.data)
+        else:
+            response = Response(data)
+        response['ETag'] = etag
+        return response
+
+    def list(self, request, *args, **kwargs):
+        return self.cached_response(super().list, request, *args, **kwargs)
+
+    def retrieve(self, request, *args, **kwargs):
+        return self.cached_response(
+            super().retrieve, request, *args, **kwargs
+        )
@@ -0,0 +1,75 @@
+import hashlib
+import threading
+
+from django.conf import settings
+from django.db import transaction
+
+from . import state_cache
+
+_condition = threading.Condition()
+_version = 0
+
+
+def version():
+    return _version
+
+
+def publish():
+    global _version
+    with _condition:
+        _version += 1
+        _condition.notify_all()
+
+
+def state_changed(migration_ids):
+    migration_ids = list(migration_ids)
+    state_cache.invalidate(migration_ids)
+
+    def committed():
+        state_cache.invalidate(migration_ids)
+        publish()
+
+    transaction.on_commit(committed)
+
+
+def wait(seen_version, timeout):
+    with _condition:
+        _condition.wait_for(lambda: _version != seen_version, timeout)
+        return _version
+
+
+def parse_ids(ids=None, batch=None):
+    """The ids of ids=1,2,3 and of the batch, ValueError if any is invalid."""
+    from .models import Migration
+    from .serializers import to_pk
+
+    migration_ids = set()
+    for value in ids or []:
+        for pk in str(value).split(','):
+            if pk.strip():
+                if to_pk(pk) is None:
+                    raise ValueError(f'{pk.strip()} is not a valid id')
+                migration_ids.add(to_pk(pk))
+    if batch:
+        if to_pk(batch) is None:
+            raise ValueError(f'{batch} is not a valid batch id')
+        migration_ids.update(Migration.objects.filter(
+            batch=to_pk(batch)
+        ).values_list('pk', flat=True))
+    if not migration_ids:
+        raise ValueError('ids or batch is required')
+    if len(migration_ids) > settings.MIGRATION_STREAM_MAX_IDS:
+        raise ValueError(
+            f'at most {settings.MIGRATION_STREAM_MAX_IDS} migrations'
+        )
+    return sorted(migration_ids)
+
+
+def get_states(migration_ids):
+    """Reads the database, so changes of other processes show at next poll."""
+    return state_cache.load_states(migration_ids)
+
+
+def states_token(states):
+    states = ','.join(f'{pk}:{state}' for pk, state in sorted(states.items()))
+    return hashlib.sha1(states.encode()).hexdigest()[:16]
@@ -0,0 +1,109 @@
+import logging
+import threading
+from concurrent.futures import Future, ThreadPoolExecutor
+
+from django.conf import settings
+from django.db import connection
+
+logger = logging.getLogger(__name__)
+
+_executor = None
+_batch_executor = None
+_executor_lock = threading.Lock()
+_pending = 0
+
+
+def get_executor():
+    global _executor
+    with _executor_lock:
+        if _executor is None:
+            _executor = ThreadPoolExecutor(
+                max_workers=settings.MIGRATION_EXECUTOR_WORKERS,
+                thread_name_prefix='migration'
+            )
+        return _executor
+
+
+def get_batch_executor():
+    global _batch_executor
+    with _executor_lock:
+        if _batch_executor is None:
+            _batch_executor = ThreadPoolExecutor(
+                max_workers=settings.MIGRATION_BATCH_SCHEDULERS,
+                thread_name_prefix='migration-batch'
+            )
+        return _batch_executor
+
+
+def pending_jobs():
+    return _pending
+
+
+def _run_migration(migration_id):
+    from .worker import MigrationWorker
+
+    try:
+        return MigrationWorker().run(migration_id)
+    except Exception:
+        logger.exception('migration %s failed', migration_id)
+        raise
+
+
+def _run_migration_in_thread(migration_id):
+    try:
+        return _run_migration(migration_id)
+    finally:
+        connection.close()
+
+
+def _job_done(future):
+    global _pending
+    with _executor_lock:
+        _pending -= 1
+
+
+def submit_migration(migration_id):
+    global _pending
+    if not settings.MIGRATION_EXECUTOR_WORKERS:
+        return None
+    if settings.MIGRATION_EXECUTOR_EAGER:
+        future = Future()
+        try:
+            future.set_result(_run_migration(migration_id))
+        except Exception as e:
+            future.set_exception(e)
+        return future
+    executor = get_executor()
+    with _executor_lock:
+        _pending += 1
+    future = executor.submit(_run_migration_in_thread, migration_id)
+    future.add_done_callback(_job_done)
+    return future
+
+
+def _run_batch(batch_id):
+    from .scheduler import run_batch
+
+    try:
+        return run_batch(batch_id)
+    except Exception:
+        logger.exception('migration batch %s failed', batch_id)
+        raise
+
+
+def _run_batch_in_thread(batch_id):
+    try:
+        return _run_batch(batch_id)
+    finally:
+        connection.close()
+
+
+def submit_batch(batch_id):
+    if settings.MIGRATION_EXECUTOR_EAGER:
+        future = Future()
+        try:
+            future.set_result(_run_batch(batch_id))
+        except Exception as e:
+            future.set_exception(e)
+        return future
+    return get_batch_executor().submit(_run_batch_in_thread, batch_id)
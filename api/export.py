@@ -0,0 +1,69 @@
+from asgiref.sync import async_to_sync, sync_to_async
+from asgiref.wsgi import WsgiToAsgi
+from django.conf import settings
+from django.http import StreamingHttpResponse
+from rest_framework.utils.encoders import JSONEncoder
+
+EXPORT_SUFFIX = '/export.ndjson'
+
+
+def keyset_chunks(queryset, chunk_size):
+    queryset = queryset.order_by('pk')
+    last_pk = None
+    while True:
+        chunk = queryset if last_pk is None else queryset.filter(
+            pk__gt=last_pk
+        )
+        chunk = list(chunk[:chunk_size])
+        if not chunk:
+            return
+        yield chunk
+        last_pk = chunk[-1].pk
+
+
+def ndjson_rows(queryset, serializer_class, context, chunk_size):
+    encoder = JSONEncoder(ensure_ascii=False)
+    for chunk in keyset_chunks(queryset, chunk_size):
+        rows = serializer_class(chunk, many=True, context=context).data
+        yield ''.join(f'{encoder.encode(row)}\n' for row in rows).encode()
+
+
+class ExportMixin:
+
+    def perform_content_negotiation(self, request, force=False):
+        return super().perform_content_negotiation(
+            request,
+            force=force or self.action == 'export'
+        )
+
+    def export(self, request, *args, **kwargs):
+        queryset = self.filter_queryset(self.get_queryset())
+        response = StreamingHttpResponse(
+            ndjson_rows(
+                queryset,
+                self.get_serializer_class(),
+                self.get_serializer_context(),
+                settings.API_EXPORT_CHUNK_SIZE
+            ),
+            content_type='application/x-ndjson'
+        )
+        response['Content-Disposition'] = (
+            f'attachment; filename="{queryset.model._meta.model_name}'
+            '.ndjson"'
+        )
+        return response
+
+
+class ExportApplication(WsgiToAsgi):
+    """Runs exports through the WSGI handler, each in a thread of its own.
+
+    Not thread sensitive: an export holds its thread until the last row,
+    and on the shared sync thread it would block every other sync view.
+    The WSGI handler runs in the thread that awaits the instance.
+    """
+
+    async def __call__(self, scope, receive, send):
+        await sync_to_async(
+            async_to_sync(super().__call__),
+            thread_sensitive=False
+        )(scope, receive, send)
@@ -0,0 +1,408 @@
+import csv
+import ipaddress
+import json
+from time import monotonic
+
+from django.db import connection, transaction
+from django.db.backends.base.operations import BaseDatabaseOperations
+
+from . import migration_counts, versions
+from .addresses import ip_key, normalize_ip
+from .bulk import chunks
+from .models import (Credentials, MountPoint, WorkLoad, MigrationTarget,
+                     Migration, CloudType)
+
+RECORD_TYPES = (
+    'credentials',
+    'mount_point',
+    'work_load',
+    'migration_target',
+    'migration'
+)
+LIST_SEPARATOR = ';'
+# The largest PositiveIntegerField every database backend can store.
+MAX_SIZE = BaseDatabaseOperations.integer_field_ranges[
+    'PositiveIntegerField'
+][1]
+
+
+class InventoryError(ValueError):
+    pass
+
+
+def parse_ndjson(lines):
+    for line_number, line in enumerate(lines, 1):
+        if not line.strip():
+            continue
+        try:
+            record = json.loads(line)
+        except ValueError as e:
+            yield line_number, InventoryError(f'invalid json: {e}')
+            continue
+        if not isinstance(record, dict):
+            yield line_number, InventoryError('expected a json object')
+            continue
+        yield line_number, record
+
+
+def parse_csv(lines):
+    reader = csv.DictReader(lines)
+    for record in reader:
+        yield reader.line_num, {
+            field: value for field, value in record.items()
+            if field and value not in (None, '')
+        }
+
+
+def parse_records(lines, format):
+    if format == 'csv':
+        return parse_csv(lines)
+    return parse_ndjson(lines)
+
+
+def synthetic_records(work_loads, mount_points_per_work_load, migrations,
+                      start_ip='10.0.0.1'):
+    first_ip = ipaddress.ip_address(start_ip)
+    cloud_types = CloudType.values
+    selected = max(mount_points_per_work_load // 2, 1)
+
+    def records():
+        for number in range(work_loads):
+            yield {
+                'type': 'credentials',
+                'id': f'c{number}',
+                'username': f'user{number}',
+                'password': f'password{number}',
+                'domain': f'domain{number}'
+            }
+            for mount_point in range(mount_points_per_work_load):
+                yield {
+                    'type': 'mount_point',
+                    'id': f'm{number}-{mount_point}',
+                    'mount_point_name': f'/mnt/disk{mount_point}',
+                    'total_size_of_the_volume': (mount_point + 1) * 1024
+                }
+            yield {
+                'type': 'work_load',
+                'id': f'w{number}',
+                'ip': str(first_ip + number),
+                'credentials': f'c{number}',
+                'storage': [
+                    f'm{number}-{mount_point}'
+                    for mount_point in range(mount_points_per_work_load)
+                ]
+            }
+        for number in range(migrations):
+            work_load = number % work_loads
+            yield {
+                'type': 'migration_target',
+                'id': f't{number}',
+                'cloud_type': cloud_types[number % len(cloud_types)],
+                'cloud_credentials': f'c{work_load}'
+            }
+            yield {
+                'type': 'migration',
+                'id': f'g{number}',
+                'source_of_type': f'w{work_load}',
+                'migration_target': f't{number}',
+                'selected_mount_points': [
+                    f'm{work_load}-{mount_point}'
+                    for mount_point in range(selected)
+                ]
+            }
+
+    return enumerate(records(), 1)
+
+
+def required(record, field):
+    value = record.get(field)
+    if value in (None, ''):
+        raise InventoryError(f'{field} is required')
+    return value
+
+
+def as_refs(value):
+    if value in (None, ''):
+        return []
+    if isinstance(value, str):
+        return [ref for ref in value.split(LIST_SEPARATOR) if ref]
+    if isinstance(value, (list, tuple)):
+        return list(value)
+    return [value]
+
+
+def as_size(value):
+    try:
+        size = int(value)
+    except (TypeError, ValueError):
+        raise InventoryError(f'{value} is not a valid size')
+    if not 0 <= size <= MAX_SIZE:
+        raise InventoryError(f'{value} is not a valid size')
+    return size
+
+
+class InventoryImporter:
+    """Bulk loads inventory records, batch_size records per transaction.
+
+    Records reference each other by their "id" field, which is mapped to
+    the primary key of the created row and can be used by later records.
+    Only work loads are matched to existing rows, by ip; the other records
+    have no natural key and are created again, so importing a file twice
+    duplicates its credentials, mount points, targets and migrations.
+    """
+
+    def __init__(self, batch_size=1000, on_error=None, on_progress=None):
+        self.batch_size = batch_size
+        self.on_error = on_error or (lambda line_number, error: None)
+        self.on_progress = on_progress or (lambda importer: None)
+        self.ids = {record_type: {} for record_type in RECORD_TYPES}
+        self.pending = {record_type: [] for record_type in RECORD_TYPES}
+        self.created = {record_type: 0 for record_type in RECORD_TYPES}
+        self.existing = 0
+        self.errors = 0
+        self.rows = 0
+        self.started = monotonic()
+
+    def rate(self):
+        elapsed = monotonic() - self.started
+        return self.rows / elapsed if elapsed else 0
+
+    def error(self, line_number, error):
+        self.errors += 1
+        self.on_error(line_number, error)
+
+    def run(self, records):
+        buffered = 0
+        for line_number, record in records:
+            self.rows += 1
+            if isinstance(record, Exception):
+                self.error(line_number, record)
+                continue
+            record_type = record.get('type')
+            if record_type not in self.pending:
+                self.error(
+                    line_number,
+                    InventoryError(f'unknown record type {record_type}')
+                )
+                continue
+            self.pending[record_type].append((line_number, record))
+            buffered += 1
+            if buffered >= self.batch_size:
+                self.flush()
+                buffered = 0
+        self.flush()
+        return self
+
+    def flush(self):
+        if not any(self.pending.values()):
+            return
+        with transaction.atomic():
+            self.save_credentials(self.take('credentials'))
+            self.save_mount_points(self.take('mount_point'))
+            self.save_work_loads(self.take('work_load'))
+            self.save_migration_targets(self.take('migration_target'))
+            self.save_migrations(self.take('migration'))
+        self.on_progress(self)
+
+    def take(self, record_type):
+        records, self.pending[record_type] = self.pending[record_type], []
+        return records
+
+    def resolve(self, record_type, ref, field):
+        try:
+            return self.ids[record_type][str(ref)]
+        except KeyError:
+            raise InventoryError(f'{field} {ref} was not imported')
+
+    def resolve_optional(self, record_type, record, field):
+        ref = record.get(field)
+        if ref in (None, ''):
+            return None
+        return self.resolve(record_type, ref, field)
+
+    def build(self, records, make):
+        objects = []
+        for line_number, record in records:
+            try:
+                objects.append((line_number, record, make(record)))
+            except InventoryError as e:
+                self.error(line_number, e)
+        return objects
+
+    def insert(self, record_type, model, objects):
+        created = [real_object for _, record, real_object in objects]
+        for chunk in chunks(created):
+            model.objects.bulk_create(chunk)
+            if not connection.features.can_return_rows_from_bulk_insert:
+                # Without RETURNING the rows of the chunk are taken as the
+                # newest ones, so imports must not run side by side there.
+                pks = model.objects.order_by('-pk').values_list(
+                    'pk',
+                    flat=True
+                )[:len(chunk)]
+                for real_object, pk in zip(chunk, reversed(list(pks))):
+                    real_object.pk = pk
+        for _, record, real_object in objects:
+            if 'id' in record:
+                self.ids[record_type][str(record['id'])] = real_object.pk
+        self.created[record_type] += len(created)
+        if created:
+            versions.bump(model)
+
+    def insert_through(self, through, rows):
+        for chunk in chunks(rows):
+            through.objects.bulk_create(chunk)
+
+    def save_credentials(self, records):
+        self.insert('credentials', Credentials, self.build(
+            records,
+            lambda record: Credentials(
+                username=required(record, 'username'),
+                password=required(record, 'password'),
+                domain=required(record, 'domain')
+            )
+        ))
+
+    def save_mount_points(self, records):
+        self.insert('mount_point', MountPoint, self.build(
+            records,
+            lambda record: MountPoint(
+                mount_point_name=required(record, 'mount_point_name'),
+                total_size_of_the_volume=as_size(
+                    required(record, 'total_size_of_the_volume')
+                )
+            )
+        ))
+
+    def work_load(self, record):
+        ip = normalize_ip(required(record, 'ip'))
+        return WorkLoad(
+            ip=ip,
+            ip_key=ip_key(ip),
+            credentials_id=self.resolve(
+                'credentials',
+                required(record, 'credentials'),
+                'credentials'
+            )
+        ), [
+            self.resolve('mount_point', ref, 'storage')
+            for ref in as_refs(required(record, 'storage'))
+        ]
+
+    def save_work_loads(self, records):
+        objects = self.build(records, self.work_load)
+        existing = dict(WorkLoad.objects.filter(
+            migrated_from__isnull=True,
+            ip__in=[work_load.ip for _, _, (work_load, _) in objects]
+        ).values_list('ip', 'pk'))
+        created, storage, ips = [], {}, set()
+        for line_number, record, (work_load, mount_points) in objects:
+            if work_load.ip in ips:
+                self.error(
+                    line_number,
+                    InventoryError(f'duplicate ip {work_load.ip}')
+                )
+            elif work_load.ip in existing:
+                self.existing += 1
+                if 'id' in record:
+                    self.ids['work_load'][str(record['id'])] = (
+                        existing[work_load.ip]
+                    )
+            else:
+                ips.add(work_load.ip)
+                created.append((line_number, record, work_load))
+                storage[id(work_load)] = mount_points
+        self.insert('work_load', WorkLoad, created)
+        through = WorkLoad.storage.through
+        self.insert_through(through, [
+            through(workload_id=work_load.pk, mountpoint_id=pk)
+            for _, record, work_load in created
+            for pk in dict.fromkeys(storage[id(work_load)])
+        ])
+
+    def migration_target(self, record):
+        cloud_type = record.get('cloud_type') or CloudType.AWS
+        if cloud_type not in CloudType.values:
+            raise InventoryError(f'{cloud_type} is not a valid cloud_type')
+        return MigrationTarget(
+            cloud_type=cloud_type,
+            cloud_credentials_id=self.resolve(
+                'credentials',
+                required(record, 'cloud_credentials'),
+                'cloud_credentials'
+            ),
+            target_vm_id=self.resolve_optional(
+                'work_load',
+                record,
+                'target_vm'
+            )
+        )
+
+    def save_migration_targets(self, records):
+        self.insert(
+            'migration_target',
+            MigrationTarget,
+            self.build(records, self.migration_target)
+        )
+
+    def migration(self, record):
+        return Migration(
+            source_of_type_id=self.resolve(
+                'work_load',
+                required(record, 'source_of_type'),
+                'source_of_type'
+            ),
+            migration_target_id=self.resolve(
+                'migration_target',
+                required(record, 'migration_target'),
+                'migration_target'
+            )
+        ), [
+            self.resolve('mount_point', ref, 'selected_mount_points')
+            for ref in as_refs(required(record, 'selected_mount_points'))
+        ]
+
+    def save_migrations(self, records):
+        objects = self.build(records, self.migration)
+        self.insert('migration', Migration, [
+            (line_number, record, migration)
+            for line_number, record, (migration, _) in objects
+        ])
+        pks = [migration.pk for _, record, (migration, _) in objects]
+        for chunk in chunks(pks):
+            migration_counts.add_migrations(
+                Migration.objects.filter(pk__in=chunk)
+            )
+        through = Migration.selected_mount_points.through
+        self.insert_through(through, [
+            through(migration_id=migration.pk, mountpoint_id=pk)
+            for _, record, (migration, mount_points) in objects
+            for pk in dict.fromkeys(mount_points)
+        ])
+
+
+def generate_inventory(work_loads, mount_points_per_work_load, migrations,
+                       start_ip='10.0.0.1', batch_size=5000):
+    """Imports a synthetic inventory into an unused range of addresses.
+
+    The importer would reuse existing work loads of the range, but give
+    their migrations the newly generated mount points, which are not in the
+    storage of those work loads, so such a range is refused.
+    """
+    first_ip = ipaddress.ip_address(start_ip)
+    last_ip = first_ip + (work_loads - 1)
+    if WorkLoad.objects.filter(
+        migrated_from__isnull=True,
+        ip_key__gte=ip_key(str(first_ip)),
+        ip_key__lte=ip_key(str(last_ip))
+    ).exists():
+        raise InventoryError(
+            f'work loads from {first_ip} to {last_ip} already exist, '
+            'choose another start ip'
+        )
+    return InventoryImporter(batch_size=batch_size).run(synthetic_records(
+        work_loads,
+        mount_points_per_work_load,
+        migrations,
+        start_ip
+    ))
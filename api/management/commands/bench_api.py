@@ -0,0 +1,120 @@
+import json
+
+from django.core.management.base import BaseCommand, CommandError
+from django.test.utils import override_settings
+
+from api.benchmark import (HttpTransport, InProcessTransport, compare,
+                           run_benchmark)
+
+
+def number(value, spec):
+    """Formats a measurement, "-" when nothing was measured."""
+    return '-' if value is None else format(value, spec)
+
+
+class Command(BaseCommand):
+    help = (
+        'Drives concurrent load against the API routes and reports '
+        'latency percentiles, throughput and queries per request.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--url',
+            help='Base url of a running server, by default requests are '
+                 'sent in process.'
+        )
+        parser.add_argument(
+            '--requests',
+            type=int,
+            default=100,
+            help='Requests sent to every route.'
+        )
+        parser.add_argument(
+            '--concurrency',
+            type=int,
+            default=4,
+            help='Number of clients sending requests at the same time.'
+        )
+        parser.add_argument(
+            '--routes',
+            help='Comma separated route names, for example '
+                 '"migrations:list,migrations:run"; all routes by default.'
+        )
+        parser.add_argument(
+            '--username',
+            help='User to authenticate as, a new user is registered '
+                 'by default.'
+        )
+        parser.add_argument('--password')
+        parser.add_argument(
+            '--output',
+            help='File the JSON results are written to.'
+        )
+        parser.add_argument(
+            '--compare',
+            help='JSON results of an earlier run to compare p95 with.'
+        )
+        parser.add_argument(
+            '--keep',
+            action='store_true',
+            help='Keep the objects created by the benchmark.'
+        )
+
+    def handle(self, *args, **options):
+        if options['requests'] < 1 or options['concurrency'] < 1:
+            raise CommandError(
+                '--requests and --concurrency must be positive'
+            )
+        if bool(options['username']) != bool(options['password']):
+            raise CommandError('--username needs --password')
+        baseline = None
+        if options['compare']:
+            with open(options['compare']) as file:
+                baseline = json.load(file)
+        names = (
+            set(options['routes'].split(',')) if options['routes'] else None
+        )
+        if options['url']:
+            transport = HttpTransport(options['url'])
+            results = self.run(transport, names, options)
+        else:
+            # Queued migrations are left to migration workers, so the run
+            # routes measure the request and not the migration itself.
+            with override_settings(MIGRATION_EXECUTOR_WORKERS=0):
+                results = self.run(InProcessTransport(), names, options)
+        results['url'] = options['url']
+        if options['output']:
+            with open(options['output'], 'w') as file:
+                json.dump(results, file, indent=2)
+        if baseline:
+            for route, old, new, change in compare(results, baseline):
+                self.stdout.write(
+                    f'{route:<32} p95 {old:9.2f} -> {new:9.2f} ms '
+                    f'{change:+7.1f}%'
+                )
+
+    def run(self, transport, names, options):
+        self.stdout.write(
+            f'{"route":<32}{"p50":>9}{"p95":>9}{"p99":>9}'
+            f'{"req/s":>9}{"queries":>9}{"errors":>8}'
+        )
+        return run_benchmark(
+            transport,
+            options['requests'],
+            options['concurrency'],
+            names=names,
+            username=options['username'],
+            password=options['password'],
+            keep=options['keep'],
+            on_route=self.write_route
+        )
+
+    def write_route(self, result):
+        self.stdout.write(
+            f'{result["route"]:<32}{number(result["p50"], ".2f"):>9}'
+            f'{number(result["p95"], ".2f"):>9}'
+            f'{number(result["p99"], ".2f"):>9}'
+            f'{number(result["throughput"], ".1f"):>9}'
+            f'{number(result["queries"], ".1f"):>9}{result["errors"]:8}'
+        )
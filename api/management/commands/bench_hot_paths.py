@@ -0,0 +1,126 @@
+import json
+import os
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+from api.microbenchmarks import find_regressions, run_hot_paths
+
+
+class Command(BaseCommand):
+    help = (
+        'Times check_mount_point, check_object, '
+        'Migration.check_mount_point, the nested serializers and '
+        'run_migration and compares them with a stored baseline.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--workloads', type=int, default=1000)
+        parser.add_argument(
+            '--mount-points-per-workload',
+            type=int,
+            default=4
+        )
+        parser.add_argument('--migrations', type=int, default=1000)
+        parser.add_argument(
+            '--repeat',
+            type=int,
+            default=50,
+            help='Number of timed calls of every hot path.'
+        )
+        parser.add_argument(
+            '--paths',
+            help='Comma separated hot path names, all by default.'
+        )
+        parser.add_argument(
+            '--baseline',
+            default=settings.BENCHMARK_BASELINE,
+            help='JSON file with the baseline timings.'
+        )
+        parser.add_argument(
+            '--save-baseline',
+            action='store_true',
+            help='Store the timings of this run as the baseline.'
+        )
+        parser.add_argument(
+            '--threshold',
+            type=float,
+            default=20,
+            help='Slowdown of the fastest call in percent reported as '
+                 'a regression.'
+        )
+
+    def handle(self, *args, **options):
+        if options['repeat'] < 1 or options['workloads'] < 1:
+            raise CommandError('--repeat and --workloads must be positive')
+        if options['migrations'] < 1:
+            raise CommandError('--migrations must be positive')
+        inventory = {
+            'workloads': options['workloads'],
+            'mount_points_per_workload': (
+                options['mount_points_per_workload']
+            ),
+            'migrations': options['migrations']
+        }
+        try:
+            results = run_hot_paths(
+                inventory['workloads'],
+                inventory['mount_points_per_workload'],
+                inventory['migrations'],
+                options['repeat'],
+                names=(
+                    set(options['paths'].split(',')) if options['paths']
+                    else None
+                )
+            )
+        except ValueError as e:
+            raise CommandError(e)
+        baseline = self.load_baseline(options['baseline'], inventory)
+        regressions = find_regressions(
+            results,
+            baseline,
+            options['threshold']
+        )
+        self.stdout.write(
+            f'{"hot path":<30}{"median us":>12}{"min us":>12}'
+            f'{"baseline min":>14}'
+        )
+        for name, result in results.items():
+            previous = baseline.get(name, {}).get('min')
+            self.stdout.write(
+                f'{name:<30}{result["median"]:12.1f}{result["min"]:12.1f}'
+                + (f'{previous:14.1f}' if previous else f'{"-":>14}')
+                + (
+                    f'  REGRESSION +{regressions[name]:.1f}%'
+                    if name in regressions else ''
+                )
+            )
+        if options['save_baseline']:
+            directory = os.path.dirname(options['baseline'])
+            if directory:
+                os.makedirs(directory, exist_ok=True)
+            with open(options['baseline'], 'w') as file:
+                json.dump(
+                    {'inventory': inventory, 'hot paths': results},
+                    file,
+                    indent=2
+                )
+            self.stdout.write(f'baseline saved to {options["baseline"]}')
+        elif regressions:
+            raise CommandError(
+                f'{len(regressions)} hot paths are slower than the baseline'
+            )
+
+    def load_baseline(self, path, inventory):
+        if not os.path.exists(path):
+            self.stdout.write(f'no baseline in {path}')
+            return {}
+        with open(path) as file:
+            baseline = json.load(file)
+        if baseline['inventory'] != inventory:
+            self.stdout.write(
+                'the baseline was measured on a different inventory: '
+                f'{baseline["inventory"]}'
+            )
+            return {}
+        return baseline['hot paths']
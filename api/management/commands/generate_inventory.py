@@ -0,0 +1,65 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from api.importer import generate_inventory
+
+
+class Command(BaseCommand):
+    help = 'Fills the database with a synthetic migration inventory.'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--workloads',
+            type=int,
+            default=1000,
+            help='Number of work loads, each with its own credentials.'
+        )
+        parser.add_argument(
+            '--mount-points-per-workload',
+            type=int,
+            default=4,
+            help='Number of mount points in the storage of a work load.'
+        )
+        parser.add_argument(
+            '--migrations',
+            type=int,
+            default=1000,
+            help='Number of migrations, each with its own target.'
+        )
+        parser.add_argument(
+            '--start-ip',
+            default='10.0.0.1',
+            help='Ip of the first work load, the next ones follow it.'
+        )
+        parser.add_argument(
+            '--batch-size',
+            type=int,
+            default=5000,
+            help='Records saved in one transaction.'
+        )
+
+    def handle(self, *args, **options):
+        if options['workloads'] < 1 or options['batch_size'] < 1:
+            raise CommandError('--workloads and --batch-size must be positive')
+        if options['mount_points_per_workload'] < 1:
+            raise CommandError('a work load needs at least one mount point')
+        if options['migrations'] < 0:
+            raise CommandError('--migrations must not be negative')
+        try:
+            importer = generate_inventory(
+                options['workloads'],
+                options['mount_points_per_workload'],
+                options['migrations'],
+                options['start_ip'],
+                options['batch_size']
+            )
+        except ValueError as e:
+            raise CommandError(e)
+        created = ', '.join(
+            f'{count} {record_type}'
+            for record_type, count in importer.created.items()
+        )
+        self.stdout.write(
+            f'generated {importer.rows} rows in '
+            f'{importer.rate():.0f} rows/s: {created}; '
+            f'{importer.existing} existing work loads'
+        )
@@ -0,0 +1,76 @@
+import sys
+
+from django.core.management.base import BaseCommand, CommandError
+
+from api.importer import InventoryImporter, parse_records
+
+
+class Command(BaseCommand):
+    help = (
+        'Imports credentials, mount points, work loads, migration targets '
+        'and migrations from an NDJSON or CSV file.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            'file',
+            help='Path to the file, "-" reads the standard input.'
+        )
+        parser.add_argument(
+            '--format',
+            choices=['ndjson', 'csv'],
+            help='File format, guessed from the extension by default.'
+        )
+        parser.add_argument(
+            '--batch-size',
+            type=int,
+            default=1000,
+            help='Records saved in one transaction.'
+        )
+        parser.add_argument(
+            '--max-errors',
+            type=int,
+            default=100,
+            help='Number of errors printed, the rest are only counted.'
+        )
+
+    def handle(self, *args, **options):
+        format = options['format'] or (
+            'csv' if options['file'].endswith('.csv') else 'ndjson'
+        )
+        if options['batch_size'] < 1:
+            raise CommandError('--batch-size must be positive')
+
+        def on_error(line_number, error):
+            if importer.errors <= options['max_errors']:
+                self.stderr.write(f'line {line_number}: {error}')
+
+        def on_progress(importer):
+            self.stdout.write(
+                f'{importer.rows} rows, {importer.rate():.0f} rows/s'
+            )
+
+        importer = InventoryImporter(
+            batch_size=options['batch_size'],
+            on_error=on_error,
+            on_progress=on_progress if options['verbosity'] > 1 else None
+        )
+        if options['file'] == '-':
+            importer.run(parse_records(sys.stdin, format))
+        else:
+            try:
+                file = open(options['file'], newline='', encoding='utf-8')
+            except OSError as e:
+                raise CommandError(e)
+            with file:
+                importer.run(parse_records(file, format))
+        created = ', '.join(
+            f'{count} {record_type}'
+            for record_type, count in importer.created.items()
+        )
+        self.stdout.write(
+            f'imported {importer.rows} rows in '
+            f'{importer.rate():.0f} rows/s: {created}; '
+            f'{importer.existing} existing work loads, '
+            f'{importer.errors} errors'
+        )
@@ -0,0 +1,70 @@
+import signal
+import threading
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+from api.worker import MigrationWorker, default_worker_name
+
+
+class Command(BaseCommand):
+    help = 'Claims queued migrations from the database and runs them.'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--name',
+            default=default_worker_name(),
+            help='Worker name recorded as the lease owner.'
+        )
+        parser.add_argument(
+            '--concurrency',
+            type=int,
+            default=1,
+            help='Number of migrations run at the same time.'
+        )
+        parser.add_argument(
+            '--lease-seconds',
+            type=int,
+            default=settings.MIGRATION_LEASE_SECONDS,
+            help='Lease time after which a silent worker loses a migration.'
+        )
+        parser.add_argument(
+            '--poll-interval',
+            type=float,
+            default=settings.MIGRATION_WORKER_POLL_INTERVAL,
+            help='Seconds to wait when there is nothing to claim.'
+        )
+        parser.add_argument(
+            '--burst',
+            action='store_true',
+            help='Exit as soon as the queue is empty.'
+        )
+
+    def handle(self, *args, **options):
+        stopped = threading.Event()
+
+        def stop(signum, frame):
+            self.stdout.write('stopping after the current migrations')
+            stopped.set()
+
+        signal.signal(signal.SIGINT, stop)
+        signal.signal(signal.SIGTERM, stop)
+        worker = MigrationWorker(
+            name=options['name'],
+            lease_seconds=options['lease_seconds']
+        )
+        threads = [
+            threading.Thread(
+                target=worker.run_forever,
+                args=(stopped, options['poll_interval'], options['burst']),
+                name=f'migration-worker-{number}'
+            )
+            for number in range(options['concurrency'])
+        ]
+        self.stdout.write(
+            f'{worker.name} started with {len(threads)} threads'
+        )
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
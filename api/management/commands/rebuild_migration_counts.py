@@ -0,0 +1,19 @@
+from django.core.management.base import BaseCommand
+
+from api.migration_counts import get_counts, rebuild
+
+
+class Command(BaseCommand):
+    help = (
+        'Recounts the migrations per state and cloud type behind the '
+        'api_migrations gauge.'
+    )
+
+    def handle(self, *args, **options):
+        rebuild()
+        for (migration_state, cloud_type), count in sorted(
+            get_counts().items()
+        ):
+            self.stdout.write(
+                f'{migration_state:<12}{cloud_type or "-":<8}{count:>10}'
+            )
@@ -0,0 +1,69 @@
+import os
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+from api.slow_queries import read_log, top_queries
+
+
+class Command(BaseCommand):
+    help = 'Shows the slowest query fingerprints from the slow query log.'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--log',
+            default=settings.SLOW_QUERY_LOG,
+            help='Slow query log, SLOW_QUERY_LOG by default.'
+        )
+        parser.add_argument(
+            '--top',
+            type=int,
+            default=20,
+            help='Number of fingerprints shown.'
+        )
+        parser.add_argument(
+            '--order',
+            choices=['total', 'count', 'max', 'mean'],
+            default='total',
+            help='Sort by total, mean or max time or by the count.'
+        )
+        parser.add_argument(
+            '--plans',
+            action='store_true',
+            help='Print the EXPLAIN plan of every fingerprint.'
+        )
+        parser.add_argument(
+            '--clear',
+            action='store_true',
+            help='Empty the log after the report.'
+        )
+
+    def handle(self, *args, **options):
+        if not options['log']:
+            raise CommandError('SLOW_QUERY_LOG is not set, pass --log')
+        if not os.path.exists(options['log']):
+            raise CommandError(f'no slow query log in {options["log"]}')
+        stats = top_queries(
+            read_log(options['log']),
+            options['top'],
+            options['order']
+        )
+        for stat in stats:
+            views = ', '.join(
+                f'{view} ({count})' for view, count in sorted(
+                    stat['views'].items(),
+                    key=lambda item: -item[1]
+                )
+            )
+            self.stdout.write(
+                f'{stat["fingerprint"]} count={stat["count"]} '
+                f'total_ms={stat["total_ms"]:.1f} '
+                f'mean_ms={stat["mean_ms"]:.1f} max_ms={stat["max_ms"]:.1f}'
+            )
+            self.stdout.write(f'  views: {views}')
+            self.stdout.write(f'  sql: {stat["sql"]}')
+            if options['plans'] and stat['plan']:
+                for line in stat['plan'].splitlines():
+                    self.stdout.write(f'  plan: {line}')
+        if options['clear']:
+            open(options['log'], 'w').close()
@@ -0,0 +1,257 @@
+import threading
+from bisect import bisect_left
+
+from django.conf import settings
+
+CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+
+DURATION_BUCKETS = (
+    0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0
+)
+QUERY_BUCKETS = (1, 2, 3, 5, 10, 20, 50, 100, 200, 500)
+RUN_BUCKETS = (1.0, 5.0, 10.0, 30.0, 60.0, 300.0, 900.0, 3600.0, 14400.0)
+
+
+def escape(value):
+    return (
+        str(value).replace('\\', r'\\').replace('\n', r'\n')
+        .replace('"', r'\"')
+    )
+
+
+def format_labels(names, values):
+    if not names:
+        return ''
+    labels = ','.join(
+        f'{name}="{escape(value)}"' for name, value in zip(names, values)
+    )
+    return f'{{{labels}}}'
+
+
+def format_value(value):
+    if value == float('inf'):
+        return '+Inf'
+    if isinstance(value, float) and value.is_integer():
+        return str(int(value))
+    return repr(value) if isinstance(value, float) else str(value)
+
+
+class Metric:
+    kind = None
+
+    def __init__(self, name, documentation, labels=()):
+        self.name = name
+        self.documentation = documentation
+        self.labels = tuple(labels)
+        self.lock = threading.Lock()
+        self.values = {}
+
+    def key(self, labels):
+        return tuple(str(labels[name]) for name in self.labels)
+
+    def clear(self):
+        with self.lock:
+            self.values.clear()
+
+    def header(self):
+        return [
+            f'# HELP {self.name} {self.documentation}',
+            f'# TYPE {self.name} {self.kind}'
+        ]
+
+    def expose(self):
+        with self.lock:
+            return self.header() + [
+                line
+                for key, value in sorted(self.values.items())
+                for line in self.lines(key, value)
+            ]
+
+
+class Counter(Metric):
+    kind = 'counter'
+
+    def inc(self, amount=1, **labels):
+        key = self.key(labels)
+        with self.lock:
+            self.values[key] = self.values.get(key, 0) + amount
+
+    def lines(self, key, value):
+        return [
+            f'{self.name}{format_labels(self.labels, key)} '
+            f'{format_value(value)}'
+        ]
+
+
+class Histogram(Metric):
+    kind = 'histogram'
+
+    def __init__(self, name, documentation, labels=(), buckets=()):
+        super().__init__(name, documentation, labels)
+        self.buckets = tuple(buckets)
+
+    def observe(self, value, **labels):
+        key = self.key(labels)
+        with self.lock:
+            counts, total = self.values.get(
+                key,
+                ([0] * (len(self.buckets) + 1), 0)
+            )
+            counts[bisect_left(self.buckets, value)] += 1
+            self.values[key] = (counts, total + value)
+
+    def lines(self, key, value):
+        counts, total = value
+        lines = []
+        cumulative = 0
+        names = self.labels + ('le',)
+        for bound, count in zip(self.buckets + (float('inf'),), counts):
+            cumulative += count
+            lines.append(
+                f'{self.name}_bucket'
+                f'{format_labels(names, key + (format_value(bound),))} '
+                f'{cumulative}'
+            )
+        labels = format_labels(self.labels, key)
+        return lines + [
+            f'{self.name}_sum{labels} {format_value(total)}',
+            f'{self.name}_count{labels} {cumulative}'
+        ]
+
+
+class Gauge(Metric):
+    """Gauge whose samples are read by a function on every scrape."""
+
+    kind = 'gauge'
+
+    def __init__(self, name, documentation, labels=(), collect=None):
+        super().__init__(name, documentation, labels)
+        self.collect = collect
+
+    def expose(self):
+        samples = sorted(self.collect().items())
+        return self.header() + [
+            f'{self.name}{format_labels(self.labels, key)} '
+            f'{format_value(value)}'
+            for key, value in samples
+        ]
+
+
+def count_migrations():
+    from . import migration_counts
+    from .models import CloudType, MigrationState
+
+    counts = {
+        (migration_state, cloud_type): 0
+        for migration_state in MigrationState.values
+        for cloud_type in CloudType.values
+    }
+    counts.update(migration_counts.get_counts())
+    return counts
+
+
+def count_pending_jobs():
+    from .executor import pending_jobs
+
+    return {(): pending_jobs()}
+
+
+requests_total = Counter(
+    'api_requests_total',
+    'Requests by route, method and status.',
+    ('route', 'method', 'status')
+)
+request_duration = Histogram(
+    'api_request_duration_seconds',
+    'Wall time of requests.',
+    ('route', 'method'),
+    DURATION_BUCKETS
+)
+request_queries = Histogram(
+    'api_request_db_queries',
+    'Database queries per request.',
+    ('route', 'method'),
+    QUERY_BUCKETS
+)
+request_db_duration = Histogram(
+    'api_request_db_duration_seconds',
+    'Database time per request.',
+    ('route', 'method'),
+    DURATION_BUCKETS
+)
+migrations = Gauge(
+    'api_migrations',
+    'Migrations by state and cloud type of the target.',
+    ('state', 'cloud_type'),
+    count_migrations
+)
+migration_run_duration = Histogram(
+    'api_migration_run_duration_seconds',
+    'Wall time of Migration.run_migration by outcome.',
+    ('outcome',),
+    RUN_BUCKETS
+)
+migration_transfer_bytes = Counter(
+    'api_migration_transfer_bytes_total',
+    'Bytes moved by the transfer drivers.',
+    ('driver',)
+)
+executor_pending_jobs = Gauge(
+    'api_executor_pending_jobs',
+    'Migrations submitted to the executor and not finished yet.',
+    (),
+    count_pending_jobs
+)
+
+REGISTRY = (
+    requests_total,
+    request_duration,
+    request_queries,
+    request_db_duration,
+    migrations,
+    migration_run_duration,
+    migration_transfer_bytes,
+    executor_pending_jobs,
+)
+
+
+def route(request):
+    match = getattr(request, 'resolver_match', None)
+    if match is None:
+        return 'unmatched'
+    return '/' + match.route.rstrip('$')
+
+
+def observe_request(request, response, timer, total):
+    if not settings.METRICS_ENABLED:
+        return
+    name = route(request)
+    requests_total.inc(
+        route=name,
+        method=request.method,
+        status=response.status_code
+    )
+    request_duration.observe(total, route=name, method=request.method)
+    request_queries.observe(timer.queries, route=name, method=request.method)
+    request_db_duration.observe(
+        timer.db_time,
+        route=name,
+        method=request.method
+    )
+
+
+def observe_run(duration, outcome):
+    if settings.METRICS_ENABLED:
+        migration_run_duration.observe(duration, outcome=outcome)
+
+
+def observe_transfer(driver, transferred):
+    if settings.METRICS_ENABLED:
+        migration_transfer_bytes.inc(transferred, driver=driver)
+
+
+def exposition():
+    lines = []
+    for metric in REGISTRY:
+        lines += metric.expose()
+    return '\n'.join(lines) + '\n'
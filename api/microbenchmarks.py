@@ -0,0 +1,112 @@
+import statistics
+from time import perf_counter
+
+from django.db import transaction
+from django.test.utils import override_settings
+
+from .importer import generate_inventory
+from .models import Migration, MigrationState, WorkLoad
+from .serializers import (MigrationSerializer, WorkLoadSerializer,
+                          check_mount_point, check_object)
+from .views import MigrationViewSet, WorkLoadViewSet
+
+
+def measure(function, repeat, setup=None):
+    function(*(setup() if setup else ()))
+    timings = []
+    for number in range(repeat):
+        arguments = setup() if setup else ()
+        started = perf_counter()
+        function(*arguments)
+        timings.append((perf_counter() - started) * 1e6)
+    return {
+        'median': statistics.median(timings),
+        'min': min(timings),
+        'repeat': repeat
+    }
+
+
+def hot_paths(importer, page_size):
+    mount_point_ids = [
+        str(pk) for pk in list(importer.ids['mount_point'].values())[:100]
+    ]
+    work_load_id = str(next(iter(importer.ids['work_load'].values())))
+    migration = Migration.objects.get(
+        pk=next(iter(importer.ids['migration'].values()))
+    )
+    source = migration.source_of_type
+
+    def reset_migration():
+        Migration.transition(
+            migration.pk,
+            (MigrationState.SUCCESS, MigrationState.ERROR),
+            MigrationState.NOT_STARTED
+        )
+        return ()
+
+    return {
+        'check_mount_point': (
+            lambda: check_mount_point(mount_point_ids),
+            None
+        ),
+        'check_object': (
+            lambda: check_object(work_load_id, WorkLoad, 'work load'),
+            None
+        ),
+        'Migration.check_mount_point': (
+            lambda: migration.check_mount_point(
+                source.storage.all(),
+                migration.selected_mount_points.all()
+            ),
+            None
+        ),
+        'WorkLoadSerializer': (
+            lambda: WorkLoadSerializer(
+                WorkLoadViewSet.queryset.all()[:page_size],
+                many=True
+            ).data,
+            None
+        ),
+        'MigrationSerializer': (
+            lambda: MigrationSerializer(
+                MigrationViewSet.queryset.all()[:page_size],
+                many=True
+            ).data,
+            None
+        ),
+        'run_migration': (
+            lambda: Migration(pk=migration.pk).run_migration(),
+            reset_migration
+        ),
+    }
+
+
+def run_hot_paths(work_loads, mount_points_per_work_load, migrations,
+                  repeat, page_size=100, names=None):
+    """Times the hot paths on a generated inventory that is rolled back."""
+    results = {}
+    with transaction.atomic(), override_settings(MIGRATION_RUN_DELAY=0):
+        importer = generate_inventory(
+            work_loads,
+            mount_points_per_work_load,
+            migrations,
+            start_ip='100.64.0.1'
+        )
+        for name, (function, setup) in hot_paths(importer, page_size).items():
+            if not names or name in names:
+                results[name] = measure(function, repeat, setup)
+        transaction.set_rollback(True)
+    return results
+
+
+def find_regressions(results, baseline, threshold):
+    """Compares the fastest calls, which are the least noisy."""
+    regressions = {}
+    for name, result in results.items():
+        previous = baseline.get(name)
+        if previous is None:
+            continue
+        change = (result['min'] - previous['min']) / previous['min']
+        if change * 100 > threshold:
+            regressions[name] = change * 100
+    return regressions
@@ -0,0 +1,133 @@
+from collections import Counter
+
+from django.db import IntegrityError, transaction
+from django.db.models import Count, F
+
+
+def count_key(migration_state, cloud_type):
+    return migration_state, cloud_type or ''
+
+
+def grouped(migrations):
+    return {
+        count_key(
+            row['migration_state'],
+            row['migration_target__cloud_type']
+        ): row['count']
+        for row in migrations.order_by().values(
+            'migration_state',
+            'migration_target__cloud_type'
+        ).annotate(count=Count('pk'))
+    }
+
+
+def get_counts():
+    from .models import MigrationCount
+
+    return {
+        (migration_state, cloud_type): count
+        for migration_state, cloud_type, count in (
+            MigrationCount.objects.values_list(
+                'migration_state',
+                'cloud_type',
+                'count'
+            )
+        )
+    }
+
+
+def rebuild():
+    from .models import Migration, MigrationCount
+
+    with transaction.atomic():
+        MigrationCount.objects.all().delete()
+        MigrationCount.objects.bulk_create([
+            MigrationCount(
+                migration_state=migration_state,
+                cloud_type=cloud_type,
+                count=count
+            )
+            for (migration_state, cloud_type), count in grouped(
+                Migration.objects.all()
+            ).items()
+        ])
+
+
+def add(deltas):
+    """Adds the deltas of (state, cloud type) keys to the counts.
+
+    Called in the transaction of the change it counts. The keys are
+    written in one order, so concurrent changes can't deadlock.
+    """
+    from .models import MigrationCount
+
+    for (migration_state, cloud_type), delta in sorted(deltas.items()):
+        if not delta:
+            continue
+        counts = MigrationCount.objects.filter(
+            migration_state=migration_state,
+            cloud_type=cloud_type
+        )
+        if counts.update(count=F('count') + delta):
+            continue
+        try:
+            with transaction.atomic():
+                MigrationCount.objects.create(
+                    migration_state=migration_state,
+                    cloud_type=cloud_type,
+                    count=delta
+                )
+        except IntegrityError:
+            counts.update(count=F('count') + delta)
+
+
+def add_migrations(migrations, sign=1):
+    """Counts the migrations in, or out with sign -1."""
+    add({key: sign * count for key, count in grouped(migrations).items()})
+
+
+def move_cloud_type(migrations, cloud_type):
+    """Moves the counts of the migrations to cloud_type.
+
+    Called before the migrations change target, or their target changes
+    cloud type, so they are still counted under the old one.
+    """
+    deltas = Counter()
+    for (migration_state, old_cloud_type), count in grouped(
+        migrations
+    ).items():
+        deltas[(migration_state, old_cloud_type)] -= count
+        deltas[count_key(migration_state, cloud_type)] += count
+    add(deltas)
+
+
+def update_states(migrations, to_state, **fields):
+    """Moves the migrations to to_state, returns the number changed.
+
+    The migrations are updated in groups of one state and cloud type,
+    each a compare-and-set on the state, so the counts move by exactly
+    the migrations every group changed.
+    """
+    groups = {}
+    for pk, migration_state, cloud_type in migrations.values_list(
+        'pk',
+        'migration_state',
+        'migration_target__cloud_type'
+    ):
+        groups.setdefault(
+            count_key(migration_state, cloud_type),
+            []
+        ).append(pk)
+    changed = 0
+    deltas = Counter()
+    with transaction.atomic():
+        for (migration_state, cloud_type), pks in groups.items():
+            moved = migrations.filter(
+                pk__in=pks,
+                migration_state=migration_state
+            ).update(migration_state=to_state, **fields)
+            changed += moved
+            deltas[(migration_state, cloud_type)] -= moved
+            deltas[(to_state, cloud_type)] += moved
+        add(deltas)
+    return changed
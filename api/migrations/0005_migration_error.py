@@ -0,0 +1,18 @@
+# Generated by Django 3.1.3 on 2026-10-18 08:38
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0004_auto_20201212_2248'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='migration',
+            name='migration_error',
+            field=models.TextField(blank=True, default=''),
+        ),
+    ]
@@ -0,0 +1,37 @@
+# Generated by Django 3.1.3 on 2026-10-18 08:40
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0005_migration_error'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='migration',
+            name='heartbeat_at',
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='migration',
+            name='lease_expires_at',
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='migration',
+            name='lease_owner',
+            field=models.CharField(blank=True, default='', max_length=100),
+        ),
+        migrations.AlterField(
+            model_name='migration',
+            name='migration_state',
+            field=models.CharField(choices=[('not_started', 'Not Started'), ('queued', 'Queued'), ('running', 'Running'), ('error', 'Error'), ('success', 'Success')], default='not_started', max_length=11),
+        ),
+        migrations.AddIndex(
+            model_name='migration',
+            index=models.Index(fields=['migration_state', 'lease_expires_at'], name='api_migrati_migrati_c7a272_idx'),
+        ),
+    ]
@@ -0,0 +1,17 @@
+# Generated by Django 3.1.3 on 2026-10-18 08:45
+
+from django.db import migrations
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0007_migration_batch'),
+    ]
+
+    operations = [
+        migrations.AlterModelOptions(
+            name='mountpoint',
+            options={'ordering': ['pk']},
+        ),
+    ]
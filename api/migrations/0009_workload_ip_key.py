@@ -0,0 +1,47 @@
+# Generated by Django 3.1.3 on 2026-10-18 08:47
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+from api.addresses import ip_key
+
+
+def fill_ip_key(apps, schema_editor):
+    WorkLoad = apps.get_model('api', 'WorkLoad')
+    # Runs used to copy the source ip to the destination work load, so
+    # the first work load with an ip is the source of the later ones.
+    sources = {}
+    for work_load in WorkLoad.objects.order_by('pk').iterator():
+        work_load.ip_key = ip_key(work_load.ip)
+        work_load.migrated_from_id = sources.setdefault(
+            work_load.ip,
+            work_load.pk
+        )
+        if work_load.migrated_from_id == work_load.pk:
+            work_load.migrated_from_id = None
+        work_load.save(update_fields=['ip_key', 'migrated_from'])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0008_mount_point_ordering'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='workload',
+            name='ip_key',
+            field=models.CharField(blank=True, db_index=True, editable=False, max_length=32, null=True),
+        ),
+        migrations.AddField(
+            model_name='workload',
+            name='migrated_from',
+            field=models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='migrated_to', to='api.workload'),
+        ),
+        migrations.RunPython(fill_ip_key, migrations.RunPython.noop),
+        migrations.AddConstraint(
+            model_name='workload',
+            constraint=models.UniqueConstraint(condition=models.Q(migrated_from__isnull=True), fields=('ip',), name='unique_source_ip'),
+        ),
+    ]
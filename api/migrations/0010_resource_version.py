@@ -0,0 +1,24 @@
+# Generated by Django 3.1.3 on 2026-10-18 08:53
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0009_workload_ip_key'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ResourceVersion',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('name', models.CharField(max_length=100, unique=True)),
+                ('version', models.CharField(blank=True, max_length=32)),
+            ],
+            options={
+                'ordering': ['pk'],
+            },
+        ),
+    ]
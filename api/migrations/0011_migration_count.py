@@ -0,0 +1,47 @@
+# Generated by Django 3.1.3 on 2026-10-18 09:06
+
+from django.db import migrations, models
+from django.db.models import Count
+
+
+def fill_migration_counts(apps, schema_editor):
+    Migration = apps.get_model('api', 'Migration')
+    MigrationCount = apps.get_model('api', 'MigrationCount')
+    MigrationCount.objects.bulk_create([
+        MigrationCount(
+            migration_state=row['migration_state'],
+            cloud_type=row['migration_target__cloud_type'] or '',
+            count=row['count']
+        )
+        for row in Migration.objects.order_by().values(
+            'migration_state',
+            'migration_target__cloud_type'
+        ).annotate(count=Count('pk'))
+    ])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0010_resource_version'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='MigrationCount',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('migration_state', models.CharField(choices=[('not_started', 'Not Started'), ('queued', 'Queued'), ('running', 'Running'), ('error', 'Error'), ('success', 'Success')], max_length=11)),
+                ('cloud_type', models.CharField(blank=True, max_length=7)),
+                ('count', models.BigIntegerField(default=0)),
+            ],
+            options={
+                'ordering': ['pk'],
+            },
+        ),
+        migrations.AddConstraint(
+            model_name='migrationcount',
+            constraint=models.UniqueConstraint(fields=('migration_state', 'cloud_type'), name='unique_migration_count'),
+        ),
+        migrations.RunPython(fill_migration_counts, migrations.RunPython.noop),
+    ]
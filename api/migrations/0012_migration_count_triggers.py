@@ -0,0 +1,186 @@
+# The counts of api_migrationcount were kept by these triggers until
+# 0019 dropped them for counts kept by the models. The SQL is frozen here,
+# migrations 0013 and 0016 and the reverse of 0019 use it.
+from django.db import migrations
+from django.db.models import Count
+
+
+def cloud_type(row):
+    return (
+        'COALESCE((SELECT cloud_type FROM api_migrationtarget '
+        f"WHERE id = {row}.migration_target_id), '')"
+    )
+
+
+def add_counts(rows):
+    # The keys are summed first, so a row moved within a key is a no-op,
+    # and locked in one order, so concurrent moves can't deadlock.
+    return f'''
+        INSERT INTO api_migrationcount (migration_state, cloud_type, count)
+        SELECT migration_state, cloud_type, SUM(delta) FROM ({rows}) AS moved
+        WHERE true
+        GROUP BY migration_state, cloud_type
+        HAVING SUM(delta) != 0
+        ORDER BY migration_state, cloud_type
+        ON CONFLICT (migration_state, cloud_type)
+        DO UPDATE SET count = api_migrationcount.count + excluded.count;
+    '''
+
+
+def migration_row(row, delta):
+    return (
+        f'SELECT {row}.migration_state AS migration_state, '
+        f'{cloud_type(row)} AS cloud_type, {delta} AS delta'
+    )
+
+
+INSERTED = add_counts(migration_row('NEW', 1))
+DELETED = add_counts(migration_row('OLD', -1))
+UPDATED = add_counts(
+    f"{migration_row('OLD', -1)} UNION ALL {migration_row('NEW', 1)}"
+)
+TARGET_UPDATED = add_counts(
+    'SELECT migration_state, OLD.cloud_type AS cloud_type, -1 AS delta '
+    'FROM api_migration WHERE migration_target_id = NEW.id '
+    'UNION ALL '
+    'SELECT migration_state, NEW.cloud_type, 1 '
+    'FROM api_migration WHERE migration_target_id = NEW.id'
+)
+MIGRATION_CHANGED = (
+    'OLD.migration_state IS NOT NEW.migration_state '
+    'OR OLD.migration_target_id IS NOT NEW.migration_target_id'
+)
+
+TRIGGERS = {
+    'sqlite': [
+        f'''
+        CREATE TRIGGER api_migration_count_insert
+        AFTER INSERT ON api_migration
+        BEGIN {INSERTED} END
+        ''',
+        f'''
+        CREATE TRIGGER api_migration_count_delete
+        AFTER DELETE ON api_migration
+        BEGIN {DELETED} END
+        ''',
+        f'''
+        CREATE TRIGGER api_migration_count_update
+        AFTER UPDATE OF migration_state, migration_target_id
+        ON api_migration
+        WHEN {MIGRATION_CHANGED}
+        BEGIN {UPDATED} END
+        ''',
+        f'''
+        CREATE TRIGGER api_migrationtarget_count_update
+        AFTER UPDATE OF cloud_type ON api_migrationtarget
+        WHEN OLD.cloud_type IS NOT NEW.cloud_type
+        BEGIN {TARGET_UPDATED} END
+        ''',
+    ],
+    'postgresql': [
+        f'''
+        CREATE FUNCTION api_migration_count() RETURNS trigger AS $$
+        BEGIN
+            IF TG_OP = 'INSERT' THEN {INSERTED}
+            ELSIF TG_OP = 'DELETE' THEN {DELETED}
+            ELSE {UPDATED}
+            END IF;
+            RETURN NULL;
+        END;
+        $$ LANGUAGE plpgsql
+        ''',
+        f'''
+        CREATE FUNCTION api_migrationtarget_count() RETURNS trigger AS $$
+        BEGIN {TARGET_UPDATED} RETURN NULL; END;
+        $$ LANGUAGE plpgsql
+        ''',
+        '''
+        CREATE TRIGGER api_migration_count_insert
+        AFTER INSERT OR DELETE ON api_migration
+        FOR EACH ROW EXECUTE PROCEDURE api_migration_count()
+        ''',
+        f'''
+        CREATE TRIGGER api_migration_count_update
+        AFTER UPDATE OF migration_state, migration_target_id
+        ON api_migration
+        FOR EACH ROW
+        WHEN ({MIGRATION_CHANGED.replace('IS NOT', 'IS DISTINCT FROM')})
+        EXECUTE PROCEDURE api_migration_count()
+        ''',
+        '''
+        CREATE TRIGGER api_migrationtarget_count_update
+        AFTER UPDATE OF cloud_type ON api_migrationtarget
+        FOR EACH ROW
+        WHEN (OLD.cloud_type IS DISTINCT FROM NEW.cloud_type)
+        EXECUTE PROCEDURE api_migrationtarget_count()
+        ''',
+    ],
+}
+
+DROP_TRIGGERS = {
+    'sqlite': [
+        'DROP TRIGGER IF EXISTS api_migration_count_insert',
+        'DROP TRIGGER IF EXISTS api_migration_count_delete',
+        'DROP TRIGGER IF EXISTS api_migration_count_update',
+        'DROP TRIGGER IF EXISTS api_migrationtarget_count_update',
+    ],
+    'postgresql': [
+        'DROP TRIGGER IF EXISTS api_migration_count_insert ON api_migration',
+        'DROP TRIGGER IF EXISTS api_migration_count_update ON api_migration',
+        'DROP TRIGGER IF EXISTS api_migrationtarget_count_update '
+        'ON api_migrationtarget',
+        'DROP FUNCTION IF EXISTS api_migration_count()',
+        'DROP FUNCTION IF EXISTS api_migrationtarget_count()',
+    ],
+}
+
+
+def create_triggers(apps, schema_editor):
+    """Creates the triggers and recounts the migrations."""
+    for sql in TRIGGERS.get(schema_editor.connection.vendor, ()):
+        schema_editor.execute(sql)
+    Migration = apps.get_model('api', 'Migration')
+    MigrationCount = apps.get_model('api', 'MigrationCount')
+    MigrationCount.objects.all().delete()
+    MigrationCount.objects.bulk_create([
+        MigrationCount(
+            migration_state=row['migration_state'],
+            cloud_type=row['migration_target__cloud_type'] or '',
+            count=row['count']
+        )
+        for row in Migration.objects.order_by().values(
+            'migration_state',
+            'migration_target__cloud_type'
+        ).annotate(count=Count('pk'))
+    ])
+
+
+def drop_triggers(apps, schema_editor):
+    for sql in DROP_TRIGGERS.get(schema_editor.connection.vendor, ()):
+        schema_editor.execute(sql)
+
+
+def without_triggers(*operations):
+    """Runs migration operations with the count triggers dropped.
+
+    SQLite alters a table by copying it to a new one, which fails while
+    the triggers refer to api_migration and api_migrationtarget, so the
+    migrations that alter either table before 0019 drops the triggers wrap
+    their operations in this.
+    """
+    return [
+        migrations.RunPython(drop_triggers, create_triggers),
+        *operations,
+        migrations.RunPython(create_triggers, drop_triggers),
+    ]
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0011_migration_count'),
+    ]
+
+    operations = [
+        migrations.RunPython(create_triggers, drop_triggers),
+    ]
@@ -0,0 +1,42 @@
+# Generated by Django 3.1.3 on 2026-10-18 09:12
+
+from importlib import import_module
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+without_triggers = import_module(
+    'api.migrations.0012_migration_count_triggers'
+).without_triggers
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0012_migration_count_triggers'),
+    ]
+
+    operations = without_triggers(
+        migrations.AddField(
+            model_name='migration',
+            name='profile',
+            field=models.CharField(blank=True, choices=[('phases', 'Phases'), ('cprofile', 'Cprofile'), ('tracemalloc', 'Tracemalloc')], default='', max_length=11),
+        ),
+    ) + [
+        migrations.CreateModel(
+            name='MigrationRunProfile',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('mode', models.CharField(choices=[('phases', 'Phases'), ('cprofile', 'Cprofile'), ('tracemalloc', 'Tracemalloc')], max_length=11)),
+                ('outcome', models.CharField(max_length=7)),
+                ('created', models.DateTimeField(auto_now_add=True)),
+                ('duration', models.FloatField()),
+                ('phases', models.JSONField(default=list)),
+                ('stats', models.TextField(blank=True, default='')),
+                ('migration', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='run_profiles', to='api.migration')),
+            ],
+            options={
+                'ordering': ['pk'],
+            },
+        ),
+    ]
@@ -0,0 +1,33 @@
+# Generated by Django 3.1.3 on 2026-10-18 09:27
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0013_migration_run_profile'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='TransferManifest',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('mount_point_name', models.TextField()),
+                ('destination', models.TextField()),
+                ('block_size', models.PositiveBigIntegerField()),
+                ('files', models.JSONField(default=dict)),
+                ('updated', models.DateTimeField(auto_now=True)),
+                ('migration', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='transfer_manifests', to='api.migration')),
+            ],
+            options={
+                'ordering': ['pk'],
+            },
+        ),
+        migrations.AddConstraint(
+            model_name='transfermanifest',
+            constraint=models.UniqueConstraint(fields=('migration', 'mount_point_name'), name='unique_transfer_manifest'),
+        ),
+    ]
@@ -0,0 +1,34 @@
+# Generated by Django 3.1.3 on 2026-10-18 09:30
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0014_transfer_manifest'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='TransferCheckpoint',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('mount_point_name', models.TextField()),
+                ('total_bytes', models.PositiveBigIntegerField(default=0)),
+                ('done_bytes', models.PositiveBigIntegerField(default=0)),
+                ('transferred_bytes', models.PositiveBigIntegerField(default=0)),
+                ('completed', models.BooleanField(default=False)),
+                ('updated', models.DateTimeField(auto_now=True)),
+                ('migration', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='checkpoints', to='api.migration')),
+            ],
+            options={
+                'ordering': ['pk'],
+            },
+        ),
+        migrations.AddConstraint(
+            model_name='transfercheckpoint',
+            constraint=models.UniqueConstraint(fields=('migration', 'mount_point_name'), name='unique_transfer_checkpoint'),
+        ),
+    ]
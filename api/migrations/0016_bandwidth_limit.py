@@ -0,0 +1,36 @@
+# Generated by Django 3.1.3 on 2026-10-18 09:32
+
+from importlib import import_module
+
+from django.db import migrations, models
+
+without_triggers = import_module(
+    'api.migrations.0012_migration_count_triggers'
+).without_triggers
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0015_transfer_checkpoint'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='BandwidthLimit',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('cloud_type', models.CharField(blank=True, choices=[('aws', 'Aws'), ('azure', 'Azure'), ('vsphere', 'Vsphere'), ('vcloud', 'Vcloud')], max_length=7, unique=True)),
+                ('rate', models.PositiveBigIntegerField(blank=True, null=True)),
+            ],
+            options={
+                'ordering': ['pk'],
+            },
+        ),
+    ] + without_triggers(
+        migrations.AddField(
+            model_name='migrationtarget',
+            name='bandwidth_limit',
+            field=models.PositiveBigIntegerField(blank=True, null=True),
+        ),
+    )
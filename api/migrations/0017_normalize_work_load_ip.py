@@ -0,0 +1,40 @@
+# Generated by Django 3.1.3 on 2026-10-18 10:02
+
+from django.db import migrations
+
+from api.addresses import ip_key, normalize_ip
+
+
+def normalize_work_load_ips(apps, schema_editor):
+    WorkLoad = apps.get_model('api', 'WorkLoad')
+    source_ips = set(WorkLoad.objects.filter(
+        migrated_from__isnull=True
+    ).values_list('ip', flat=True))
+    for work_load in WorkLoad.objects.order_by('pk').iterator():
+        ip = normalize_ip(work_load.ip)
+        if ip == work_load.ip:
+            continue
+        if work_load.migrated_from_id is None:
+            # Another source already has the address, the later one keeps
+            # its text rather than being merged into it.
+            if ip in source_ips:
+                continue
+            source_ips.discard(work_load.ip)
+            source_ips.add(ip)
+        work_load.ip = ip
+        work_load.ip_key = ip_key(ip)
+        work_load.save(update_fields=['ip', 'ip_key'])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0016_bandwidth_limit'),
+    ]
+
+    operations = [
+        migrations.RunPython(
+            normalize_work_load_ips,
+            migrations.RunPython.noop
+        ),
+    ]
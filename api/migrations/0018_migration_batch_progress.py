@@ -0,0 +1,41 @@
+# Generated by Django 3.1.3 on 2026-10-18 10:16
+
+from django.db import migrations, models
+from django.db.models import Max
+
+
+def set_queued_through(apps, schema_editor):
+    MigrationBatch = apps.get_model('api', 'MigrationBatch')
+    # Migrations of the waves already queued have left not_started and
+    # error, the next wave starts after the last of them.
+    for batch in MigrationBatch.objects.annotate(
+        last_queued=Max('migrations__pk', filter=~models.Q(
+            migrations__migration_state__in=['not_started', 'error']
+        ))
+    ).filter(last_queued__isnull=False):
+        batch.queued_through = batch.last_queued
+        batch.save(update_fields=['queued_through'])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0017_normalize_work_load_ip'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='migrationbatch',
+            name='finished',
+            field=models.BooleanField(default=False),
+        ),
+        migrations.AddField(
+            model_name='migrationbatch',
+            name='queued_through',
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.RunPython(
+            set_queued_through,
+            migrations.RunPython.noop
+        ),
+    ]
@@ -0,0 +1,22 @@
+# Generated by Django 3.1.3 on 2026-10-18 11:05
+
+from importlib import import_module
+
+from django.db import migrations
+
+triggers = import_module('api.migrations.0012_migration_count_triggers')
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0018_migration_batch_progress'),
+    ]
+
+    # The models keep api_migrationcount from now on.
+    operations = [
+        migrations.RunPython(
+            triggers.drop_triggers,
+            triggers.create_triggers
+        ),
+    ]
@@ -0,0 +1,70 @@
+# Generated by Django 3.1.3 on 2026-10-18 10:34
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+def split_files(apps, schema_editor):
+    TransferManifest = apps.get_model('api', 'TransferManifest')
+    TransferFile = apps.get_model('api', 'TransferFile')
+    for manifest in TransferManifest.objects.iterator():
+        TransferFile.objects.bulk_create(
+            [
+                TransferFile(
+                    manifest=manifest,
+                    path=path,
+                    size=entry['size'],
+                    mtime_ns=entry['mtime_ns'],
+                    blocks=entry['blocks']
+                )
+                for path, entry in manifest.files.items()
+            ],
+            batch_size=500
+        )
+
+
+def join_files(apps, schema_editor):
+    TransferManifest = apps.get_model('api', 'TransferManifest')
+    for manifest in TransferManifest.objects.prefetch_related('entries'):
+        manifest.files = {
+            file.path: {
+                'size': file.size,
+                'mtime_ns': file.mtime_ns,
+                'blocks': file.blocks
+            }
+            for file in manifest.entries.all()
+        }
+        manifest.save(update_fields=['files'])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0019_drop_migration_count_triggers'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='TransferFile',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('path', models.TextField()),
+                ('size', models.PositiveBigIntegerField()),
+                ('mtime_ns', models.BigIntegerField(null=True)),
+                ('blocks', models.JSONField(default=list)),
+                ('manifest', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='entries', to='api.transfermanifest')),
+            ],
+            options={
+                'ordering': ['pk'],
+            },
+        ),
+        migrations.AddConstraint(
+            model_name='transferfile',
+            constraint=models.UniqueConstraint(fields=('manifest', 'path'), name='unique_transfer_file'),
+        ),
+        migrations.RunPython(split_files, join_files),
+        migrations.RemoveField(
+            model_name='transfermanifest',
+            name='files',
+        ),
+    ]
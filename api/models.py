@@ -1,8 +1,14 @@
-from time import sleep
+from datetime import timedelta
+from time import perf_counter
 
-from django.db import models
+from django.db import models, transaction
+from django.db.models import Q, Sum
+from django.utils import timezone
 from rest_framework.generics import get_object_or_404
 
+from . import events, metrics, migration_counts, profiling, transfer, versions
+from .addresses import ip_key, normalize_ip
+
 
 class Credentials(models.Model):
     username = models.TextField(
@@ -40,6 +46,9 @@ class MountPoint(models.Model):
         null=False
     )
 
+    class Meta:
+        ordering = ["pk"]
+
 
 class WorkLoad(models.Model):
     ip = models.TextField(
@@ -47,6 +56,20 @@ class WorkLoad(models.Model):
         blank=False,
         null=False
     )
+    ip_key = models.CharField(
+        max_length=32,
+        db_index=True,
+        editable=False,
+        blank=True,
+        null=True
+    )
+    migrated_from = models.ForeignKey(
+        'self',
+        related_name="migrated_to",
+        on_delete=models.SET_NULL,
+        blank=True,
+        null=True
+    )
     credentials = models.ForeignKey(
         Credentials,
         related_name="workloads",
@@ -61,10 +84,22 @@ class WorkLoad(models.Model):
 
     class Meta:
         ordering = ["pk"]
+        constraints = [
+            models.UniqueConstraint(
+                fields=['ip'],
+                condition=Q(migrated_from__isnull=True),
+                name='unique_source_ip'
+            ),
+        ]
 
     def __str__(self):
         return f'{self.pk} {self.ip}'
 
+    def save(self, *args, **kwargs):
+        self.ip = normalize_ip(self.ip)
+        self.ip_key = ip_key(self.ip)
+        super().save(*args, **kwargs)
+
 
 class CloudType(models.TextChoices):
     AWS = 'aws'
@@ -93,6 +128,10 @@ class MigrationTarget(models.Model):
         blank=True,
         null=True
     )
+    bandwidth_limit = models.PositiveBigIntegerField(
+        blank=True,
+        null=True
+    )
 
     class Meta:
         ordering = ["pk"]
@@ -100,14 +139,59 @@ class MigrationTarget(models.Model):
     def __str__(self):
         return f'{self.pk} {self.cloud_type}'
 
+    def save(self, *args, **kwargs):
+        update_fields = kwargs.get('update_fields')
+        if self._state.adding or (
+            update_fields is not None and 'cloud_type' not in update_fields
+        ):
+            return super().save(*args, **kwargs)
+        with transaction.atomic():
+            migration_counts.move_cloud_type(
+                self.migrations.all(),
+                self.cloud_type
+            )
+            super().save(*args, **kwargs)
+
 
 class MigrationState(models.TextChoices):
     NOT_STARTED = 'not_started'
+    QUEUED = 'queued'
     RUNNING = 'running'
     ERROR = 'error'
     SUCCESS = 'success'
 
 
+RUNNABLE_STATES = (MigrationState.NOT_STARTED, MigrationState.ERROR)
+ACTIVE_STATES = (MigrationState.QUEUED, MigrationState.RUNNING)
+TRANSITION_FIELDS = (
+    'migration_state',
+    'migration_error',
+    'lease_owner',
+    'lease_expires_at',
+    'heartbeat_at',
+    'batch'
+)
+
+
+class ProfileMode(models.TextChoices):
+    PHASES = profiling.PHASES
+    CPROFILE = profiling.CPROFILE
+    TRACEMALLOC = profiling.TRACEMALLOC
+
+
+class MigrationBatch(models.Model):
+    concurrency = models.PositiveIntegerField()
+    created = models.DateTimeField(auto_now_add=True)
+    queued_through = models.PositiveIntegerField(default=0)
+    finished = models.BooleanField(default=False)
+
+    class Meta:
+        ordering = ["pk"]
+
+    def __str__(self):
+        return f'{self.pk} {self.concurrency}'
+
+
 class Migration(models.Model):
     selected_mount_points = models.ManyToManyField(
         MountPoint,
@@ -132,55 +216,486 @@ class Migration(models.Model):
         choices=MigrationState.choices,
         default=MigrationState.NOT_STARTED
     )
+    migration_error = models.TextField(
+        blank=True,
+        default=''
+    )
+    lease_owner = models.CharField(
+        max_length=100,
+        blank=True,
+        default=''
+    )
+    lease_expires_at = models.DateTimeField(
+        blank=True,
+        null=True
+    )
+    heartbeat_at = models.DateTimeField(
+        blank=True,
+        null=True
+    )
+    batch = models.ForeignKey(
+        MigrationBatch,
+        related_name="migrations",
+        on_delete=models.SET_NULL,
+        blank=True,
+        null=True
+    )
+    profile = models.CharField(
+        max_length=11,
+        choices=ProfileMode.choices,
+        blank=True,
+        default=''
+    )
 
     class Meta:
         ordering = ["pk"]
+        indexes = [
+            models.Index(fields=['migration_state', 'lease_expires_at']),
+        ]
 
     def __str__(self):
         return f'{self.pk} {self.migration_target} {self.migration_state}'
 
-    def run_migration(self):
-        migration = get_object_or_404(Migration, pk=self.pk)
-        migration.migration_state = MigrationState.RUNNING
-        migration.save()
-        sleep(10)
-        migration_target = migration.migration_target
-        source = migration.source_of_type
-        if source.storage.all() == migration.selected_mount_points.all():
-            try:
-                migration_target.target_vm = source
-                migration_target.save()
-            except Exception as e:
-                migration.migration_state = MigrationState.ERROR
-                migration.save()
-                return e
+    def save(self, *args, **kwargs):
+        """Saves a migration, an existing one without its state and lease.
+
+        The state, error, lease and batch change only through transition
+        and the lease methods, so saving an instance read before one of
+        them doesn't write the old values back. The counts of the
+        migrations are kept in the same transaction.
+        """
+        with transaction.atomic():
+            if self._state.adding:
+                super().save(*args, **kwargs)
+                migration_counts.add_migrations(
+                    Migration.objects.filter(pk=self.pk)
+                )
+                return
+            if kwargs.get('update_fields') is None:
+                kwargs['update_fields'] = [
+                    field.name for field in self._meta.concrete_fields
+                    if not field.primary_key
+                    and field.name not in TRANSITION_FIELDS
+                ]
+            if 'migration_target' in kwargs['update_fields']:
+                migration_counts.move_cloud_type(
+                    Migration.objects.filter(pk=self.pk),
+                    self.migration_target.cloud_type
+                    if self.migration_target_id else ''
+                )
+            super().save(*args, **kwargs)
+
+    @classmethod
+    def transition(cls, pk, from_states, to_state, condition=None,
+                   **fields):
+        return cls.transition_many(
+            [pk],
+            from_states,
+            to_state,
+            condition,
+            **fields
+        ) == 1
+
+    @classmethod
+    def transition_many(cls, pks, from_states, to_state, condition=None,
+                        **fields):
+        migrations = cls.objects.filter(
+            pk__in=pks,
+            migration_state__in=from_states
+        )
+        if condition is not None:
+            migrations = migrations.filter(condition)
+        changed = migration_counts.update_states(
+            migrations,
+            to_state,
+            **fields
+        )
+        if changed:
+            events.state_changed(pks)
+            versions.bump(cls)
+        return changed
+
+    @classmethod
+    def claim(cls, owner, lease_seconds, pk=None):
+        now = timezone.now()
+        claimable = (
+            Q(migration_state=MigrationState.QUEUED)
+            | Q(lease_expires_at__lt=now)
+        )
+        from_states = (MigrationState.QUEUED, MigrationState.RUNNING)
+        candidates = cls.objects.filter(
+            claimable,
+            migration_state__in=from_states
+        ).order_by('pk')
+        if pk is not None:
+            candidates = candidates.filter(pk=pk)
+        for candidate in candidates.values_list('pk', flat=True)[:10]:
+            claimed = cls.transition(
+                candidate,
+                from_states,
+                MigrationState.RUNNING,
+                claimable,
+                lease_owner=owner,
+                lease_expires_at=now + timedelta(seconds=lease_seconds),
+                heartbeat_at=now
+            )
+            if claimed:
+                return candidate
+        return None
+
+    @classmethod
+    def heartbeat(cls, pk, owner, lease_seconds):
+        now = timezone.now()
+        renewed = cls.objects.filter(
+            pk=pk,
+            lease_owner=owner,
+            migration_state=MigrationState.RUNNING
+        ).update(
+            lease_expires_at=now + timedelta(seconds=lease_seconds),
+            heartbeat_at=now
+        )
+        if renewed:
+            versions.bump(cls)
+        return renewed
+
+    @classmethod
+    def release_lease(cls, pk, owner):
+        released = cls.objects.filter(pk=pk, lease_owner=owner).update(
+            lease_owner='',
+            lease_expires_at=None
+        )
+        if released:
+            versions.bump(cls)
+        return released
+
+    @classmethod
+    def resume(cls, pk):
+        """Queues a runnable migration or a running one whose lease expired.
+
+        A running migration is resumed only after its worker stopped
+        renewing the lease, the checkpoints of the transfer let the new run
+        skip the work done.
+        """
+        return cls.transition(
+            pk,
+            RUNNABLE_STATES + (MigrationState.RUNNING,),
+            MigrationState.QUEUED,
+            ~Q(migration_state=MigrationState.RUNNING)
+            | Q(lease_expires_at__lt=timezone.now()),
+            lease_owner='',
+            lease_expires_at=None
+        )
+
+    @classmethod
+    def resync(cls, pk):
+        """Queues a successful migration to copy what changed since its run.
+
+        The run copies only the changed blocks and updates the destination
+        work load created by the first run instead of creating another one.
+        """
+        return cls.transition(
+            pk,
+            (MigrationState.SUCCESS,),
+            MigrationState.QUEUED,
+            lease_owner='',
+            lease_expires_at=None
+        )
+
+    def progress(self):
+        """Percent of the bytes of the transfer done and bytes copied."""
+        totals = self.checkpoints.aggregate(
+            total=Sum('total_bytes'),
+            done=Sum('done_bytes'),
+            transferred=Sum('transferred_bytes')
+        )
+        if totals['total']:
+            percent = round(totals['done'] / totals['total'] * 100, 2)
+        elif self.migration_state == MigrationState.SUCCESS:
+            percent = 100.0
+        else:
+            percent = 0.0
+        return percent, totals['transferred'] or 0
+
+    def fail(self, error, condition=None):
+        Migration.transition(
+            self.pk,
+            (MigrationState.RUNNING,),
+            MigrationState.ERROR,
+            condition,
+            migration_error=str(error)
+        )
+        return error
+
+    def run_migration(self, lease_owner=None):
+        started_at = perf_counter()
+        if lease_owner is None:
+            owned = None
+            started = Migration.transition(
+                self.pk,
+                RUNNABLE_STATES + (MigrationState.QUEUED,),
+                MigrationState.RUNNING,
+                migration_error=''
+            )
         else:
-            destination_storages = migration.check_mount_point(
-                source.storage.all(),
-                migration.selected_mount_points.all()
+            owned = Q(lease_owner=lease_owner)
+            started = Migration.transition(
+                self.pk,
+                (MigrationState.RUNNING,),
+                MigrationState.RUNNING,
+                owned,
+                migration_error=''
             )
-            if not destination_storages:
-                migration.migration_state = MigrationState.ERROR
-                migration.save()
-                return 'selected_mount_points not in source'
+        if not started:
+            return '''migration can't run'''
+        marked_at = perf_counter()
+        migration = get_object_or_404(Migration, pk=self.pk)
+        profiler = profiling.RunProfiler(migration, started=started_at)
+        profiler.record('mark_running', marked_at - started_at)
+        profiler.record('fetch', perf_counter() - marked_at)
+        with profiler:
+            error = migration.migrate(owned, profiler)
+        outcome = 'success' if error is None else 'error'
+        profiler.save(outcome)
+        metrics.observe_run(perf_counter() - marked_at, outcome)
+        return error
+
+    def migrate(self, owned, profiler):
+        with profiler.phase('fetch'):
+            migration_target = self.migration_target
+            source = self.source_of_type
+        with profiler.phase('compare_storage'):
+            if source.storage.all() == self.selected_mount_points.all():
+                destination_storages = None
             else:
-                try:
-                    destination_source = WorkLoad.objects.create(
-                        ip=source.ip,
-                        credentials=source.credentials
-                    )
-                    destination_source.storage.set(destination_storages)
+                destination_storages = self.check_mount_point(
+                    source.storage.all(),
+                    self.selected_mount_points.all()
+                )
+        if destination_storages == []:
+            return self.fail('selected_mount_points not in source', owned)
+        driver = transfer.get_driver()
+        try:
+            with profiler.phase('transfer'):
+                transferred = driver.transfer(
+                    self,
+                    source.storage.all() if destination_storages is None
+                    else destination_storages
+                )
+        except (transfer.TransferError, OSError) as e:
+            return self.fail(e, owned)
+        metrics.observe_transfer(type(driver).__name__, transferred)
+        try:
+            with transaction.atomic():
+                with profiler.phase('mark_success'):
+                    if not Migration.transition(
+                        self.pk,
+                        (MigrationState.RUNNING,),
+                        MigrationState.SUCCESS,
+                        owned
+                    ):
+                        return '''migration lost its lease'''
+                if destination_storages is None:
+                    migration_target.target_vm = source
+                else:
+                    with profiler.phase('create_destination'):
+                        destination_source = self.destination(
+                            migration_target,
+                            source
+                        )
+                    with profiler.phase('set_storage'):
+                        destination_source.storage.set(destination_storages)
                     migration_target.target_vm = destination_source
-                    migration_target.save()
-                    migration.migration_state = MigrationState.SUCCESS
-                    migration.save()
-                except Exception as e:
-                    migration.migration_state = MigrationState.ERROR
-                    migration.save()
-                    return e
+                with profiler.phase('save_target'):
+                    migration_target.save(update_fields=['target_vm'])
+        except Exception as e:
+            return self.fail(e, owned)
+
+    def destination(self, migration_target, source):
+        """The work load made by an earlier run of the target, or a new one."""
+        target_vm = migration_target.target_vm
+        if target_vm is not None and target_vm.migrated_from_id == source.pk:
+            return target_vm
+        return WorkLoad.objects.create(
+            ip=source.ip,
+            credentials=source.credentials,
+            migrated_from=source
+        )
 
     def check_mount_point(self, source_mount_points, selected_mount_points):
         destination_mount_points = set(
             source_mount_points
         ).intersection(set(selected_mount_points))
         return list(destination_mount_points)
+
+
+class ResourceVersion(models.Model):
+    name = models.CharField(
+        max_length=100,
+        unique=True
+    )
+    version = models.CharField(
+        max_length=32,
+        blank=True
+    )
+
+    class Meta:
+        ordering = ["pk"]
+
+    def __str__(self):
+        return f'{self.name} {self.version}'
+
+
+class MigrationCount(models.Model):
+    migration_state = models.CharField(
+        max_length=11,
+        choices=MigrationState.choices
+    )
+    cloud_type = models.CharField(
+        max_length=7,
+        blank=True
+    )
+    count = models.BigIntegerField(default=0)
+
+    class Meta:
+        ordering = ["pk"]
+        constraints = [
+            models.UniqueConstraint(
+                fields=['migration_state', 'cloud_type'],
+                name='unique_migration_count'
+            ),
+        ]
+
+    def __str__(self):
+        return f'{self.migration_state} {self.cloud_type} {self.count}'
+
+
+class MigrationRunProfile(models.Model):
+    migration = models.ForeignKey(
+        Migration,
+        related_name="run_profiles",
+        on_delete=models.CASCADE
+    )
+    mode = models.CharField(
+        max_length=11,
+        choices=ProfileMode.choices
+    )
+    outcome = models.CharField(max_length=7)
+    created = models.DateTimeField(auto_now_add=True)
+    duration = models.FloatField()
+    phases = models.JSONField(default=list)
+    stats = models.TextField(
+        blank=True,
+        default=''
+    )
+
+    class Meta:
+        ordering = ["pk"]
+
+    def __str__(self):
+        return f'{self.pk} {self.migration_id} {self.mode} {self.duration}'
+
+
+class TransferManifest(models.Model):
+    migration = models.ForeignKey(
+        Migration,
+        related_name="transfer_manifests",
+        on_delete=models.CASCADE
+    )
+    mount_point_name = models.TextField()
+    destination = models.TextField()
+    block_size = models.PositiveBigIntegerField()
+    updated = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        ordering = ["pk"]
+        constraints = [
+            models.UniqueConstraint(
+                fields=['migration', 'mount_point_name'],
+                name='unique_transfer_manifest'
+            ),
+        ]
+
+    def __str__(self):
+        return f'{self.migration_id} {self.mount_point_name}'
+
+
+class TransferFile(models.Model):
+    """A file of a manifest, mtime_ns is None until it is fully copied."""
+    manifest = models.ForeignKey(
+        TransferManifest,
+        related_name="entries",
+        on_delete=models.CASCADE
+    )
+    path = models.TextField()
+    size = models.PositiveBigIntegerField()
+    mtime_ns = models.BigIntegerField(null=True)
+    blocks = models.JSONField(default=list)
+
+    class Meta:
+        ordering = ["pk"]
+        constraints = [
+            models.UniqueConstraint(
+                fields=['manifest', 'path'],
+                name='unique_transfer_file'
+            ),
+        ]
+
+    def __str__(self):
+        return f'{self.manifest_id} {self.path}'
+
+    def entry(self):
+        return {
+            'size': self.size,
+            'mtime_ns': self.mtime_ns,
+            'blocks': self.blocks
+        }
+
+
+class TransferCheckpoint(models.Model):
+    migration = models.ForeignKey(
+        Migration,
+        related_name="checkpoints",
+        on_delete=models.CASCADE
+    )
+    mount_point_name = models.TextField()
+    total_bytes = models.PositiveBigIntegerField(default=0)
+    done_bytes = models.PositiveBigIntegerField(default=0)
+    transferred_bytes = models.PositiveBigIntegerField(default=0)
+    completed = models.BooleanField(default=False)
+    updated = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        ordering = ["pk"]
+        constraints = [
+            models.UniqueConstraint(
+                fields=['migration', 'mount_point_name'],
+                name='unique_transfer_checkpoint'
+            ),
+        ]
+
+    def __str__(self):
+        return (
+            f'{self.migration_id} {self.mount_point_name} '
+            f'{self.done_bytes}/{self.total_bytes}'
+        )
+
+
+class BandwidthLimit(models.Model):
+    """Transfer rate in bytes per second of a cloud type, '' for all."""
+
+    cloud_type = models.CharField(
+        max_length=7,
+        choices=CloudType.choices,
+        blank=True,
+        unique=True
+    )
+    rate = models.PositiveBigIntegerField(
+        blank=True,
+        null=True
+    )
+
+    class Meta:
+        ordering = ["pk"]
+
+    def __str__(self):
+        return f'{self.cloud_type or "global"} {self.rate}'
@@ -0,0 +1,8 @@
+from django.conf import settings
+from rest_framework.pagination import CursorPagination
+
+
+class PkCursorPagination(CursorPagination):
+    ordering = 'pk'
+    page_size_query_param = 'page_size'
+    max_page_size = settings.API_MAX_PAGE_SIZE
@@ -0,0 +1,191 @@
+import cProfile
+import io
+import logging
+import pstats
+import random
+import threading
+import tracemalloc
+from contextlib import ExitStack, contextmanager, nullcontext
+from functools import lru_cache
+from time import perf_counter
+
+from django.conf import settings
+from django.utils.module_loading import import_string
+
+logger = logging.getLogger(__name__)
+
+PHASES = 'phases'
+CPROFILE = 'cprofile'
+TRACEMALLOC = 'tracemalloc'
+
+_lock = threading.Lock()
+_traced_runs = 0
+_traced_generation = 0
+_started_tracing = False
+
+
+@lru_cache(maxsize=None)
+def load_hooks(paths):
+    return tuple(import_string(path) for path in paths)
+
+
+def phase_hooks():
+    """Context manager factories called with (migration, phase name)."""
+    return load_hooks(tuple(settings.MIGRATION_PHASE_HOOKS))
+
+
+def profile_mode(migration):
+    if migration.profile:
+        return migration.profile
+    rate = settings.MIGRATION_PROFILE_SAMPLE_RATE
+    if rate and random.random() < rate:
+        return settings.MIGRATION_PROFILE_SAMPLE_MODE
+    return ''
+
+
+def start_tracing():
+    """Starts tracemalloc for a run unless other traced runs did already."""
+    global _traced_runs, _traced_generation, _started_tracing
+    with _lock:
+        if not _traced_runs and not tracemalloc.is_tracing():
+            tracemalloc.start()
+            _started_tracing = True
+        _traced_runs += 1
+        _traced_generation += 1
+
+
+def stop_tracing():
+    """Stops tracemalloc when the last traced run that needed it ends."""
+    global _traced_runs, _started_tracing
+    with _lock:
+        _traced_runs -= 1
+        if not _traced_runs and _started_tracing:
+            tracemalloc.stop()
+            _started_tracing = False
+
+
+def begin_traced_phase():
+    """(generation, traced bytes) when a single run is traced, else None.
+
+    tracemalloc counts the allocations of the whole process, so they are
+    given to a phase only when no other traced run overlaps it.
+    """
+    with _lock:
+        if _traced_runs != 1:
+            return None
+        tracemalloc.reset_peak()
+        return _traced_generation, tracemalloc.get_traced_memory()[0]
+
+
+def end_traced_phase(generation):
+    """(traced bytes, peak) if the run was traced alone since generation."""
+    with _lock:
+        if _traced_runs != 1 or _traced_generation != generation:
+            return None
+        return tracemalloc.get_traced_memory()
+
+
+class RunProfiler:
+    """Times the phases of a run and stores them as a MigrationRunProfile.
+
+    With the profile mode off only the phase hooks are called.
+    """
+
+    def __init__(self, migration, mode=None, started=None):
+        self.migration = migration
+        self.mode = profile_mode(migration) if mode is None else mode
+        self.hooks = phase_hooks()
+        self.phases = {}
+        self.started = perf_counter() if started is None else started
+        self.profiler = None
+        self.tracing = False
+        self.stats = ''
+
+    def __enter__(self):
+        if self.mode == CPROFILE:
+            self.profiler = cProfile.Profile()
+            try:
+                self.profiler.enable()
+            except ValueError:
+                # Another profiler is active in this thread.
+                logger.warning(
+                    'cProfile is busy, migration %s is timed only',
+                    self.migration.pk
+                )
+                self.profiler = None
+        elif self.mode == TRACEMALLOC:
+            start_tracing()
+            self.tracing = True
+        return self
+
+    def __exit__(self, *exc_info):
+        if self.profiler is not None:
+            self.profiler.disable()
+            stream = io.StringIO()
+            pstats.Stats(self.profiler, stream=stream).sort_stats(
+                'cumulative'
+            ).print_stats(settings.MIGRATION_PROFILE_STATS_LIMIT)
+            self.stats = stream.getvalue()
+        if self.tracing:
+            stop_tracing()
+            self.tracing = False
+
+    def record(self, name, duration, allocated=None, peak=None):
+        phase = self.phases.setdefault(name, {
+            'name': name,
+            'duration': 0.0,
+            'calls': 0
+        })
+        phase['duration'] += duration
+        phase['calls'] += 1
+        if allocated is not None:
+            phase['allocated'] = phase.get('allocated', 0) + allocated
+            phase['peak'] = max(phase.get('peak', 0), peak)
+
+    def phase(self, name):
+        if not self.mode and not self.hooks:
+            return nullcontext()
+        return self.timed_phase(name)
+
+    @contextmanager
+    def timed_phase(self, name):
+        with ExitStack() as stack:
+            for hook in self.hooks:
+                stack.enter_context(hook(self.migration, name))
+            if not self.mode:
+                yield
+                return
+            traced = begin_traced_phase() if self.tracing else None
+            started = perf_counter()
+            try:
+                yield
+            finally:
+                duration = perf_counter() - started
+                memory = None
+                if traced is not None:
+                    generation, before = traced
+                    memory = end_traced_phase(generation)
+                if memory is not None:
+                    current, peak = memory
+                    self.record(
+                        name,
+                        duration,
+                        current - before,
+                        peak - before
+                    )
+                else:
+                    self.record(name, duration)
+
+    def save(self, outcome):
+        if not self.mode:
+            return None
+        from .models import MigrationRunProfile
+
+        return MigrationRunProfile.objects.create(
+            migration_id=self.migration.pk,
+            mode=self.mode,
+            outcome=outcome,
+            duration=perf_counter() - self.started,
+            phases=list(self.phases.values()),
+            stats=self.stats
+        )
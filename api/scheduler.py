@@ -0,0 +1,92 @@
+import logging
+import time
+
+from django.conf import settings
+from django.db import transaction
+from django.db.models import Q
+
+from .executor import submit_migration
+from .models import (Migration, MigrationBatch, MigrationState,
+                     ACTIVE_STATES, RUNNABLE_STATES)
+
+logger = logging.getLogger(__name__)
+
+
+def queue_wave(batch, wave):
+    Migration.transition_many(
+        wave,
+        RUNNABLE_STATES,
+        MigrationState.QUEUED,
+        Q(batch=batch)
+    )
+    return list(Migration.objects.filter(
+        pk__in=wave,
+        batch=batch,
+        migration_state=MigrationState.QUEUED
+    ).values_list('pk', flat=True))
+
+
+def advance_batch(batch_id):
+    """Queues the next wave of a batch once the queued ones finished.
+
+    The last migration queued is kept in queued_through, so the batch is
+    carried on by whichever process gets there first: the one that took
+    the request or, once it is gone, a migration_worker. Returns the ids
+    queued, None once the batch is finished.
+    """
+    batch = MigrationBatch.objects.get(pk=batch_id)
+    if batch.finished:
+        return None
+    migrations = batch.migrations.order_by('pk')
+    if migrations.filter(
+        pk__lte=batch.queued_through,
+        migration_state__in=ACTIVE_STATES
+    ).exists():
+        return []
+    wave = list(migrations.filter(
+        pk__gt=batch.queued_through
+    ).values_list('pk', flat=True)[:batch.concurrency])
+    with transaction.atomic():
+        advanced = MigrationBatch.objects.filter(
+            pk=batch.pk,
+            queued_through=batch.queued_through,
+            finished=False
+        ).update(
+            queued_through=wave[-1] if wave else batch.queued_through,
+            finished=not wave
+        )
+        if not advanced:
+            return []
+        if not wave:
+            return None
+        return queue_wave(batch, wave)
+
+
+def advance_batches():
+    """Advances every unfinished batch, returns the number of runs queued."""
+    queued = 0
+    for batch_id in MigrationBatch.objects.filter(
+        finished=False
+    ).values_list('pk', flat=True):
+        queued += len(advance_batch(batch_id) or [])
+    return queued
+
+
+def run_batch(batch_id):
+    number = 0
+    while True:
+        queued = advance_batch(batch_id)
+        if queued is None:
+            return
+        if not queued:
+            time.sleep(settings.MIGRATION_BATCH_POLL_INTERVAL)
+            continue
+        logger.info(
+            'batch %s wave %s: %s migrations queued',
+            batch_id,
+            number,
+            len(queued)
+        )
+        number += 1
+        for migration_id in queued:
+            submit_migration(migration_id)
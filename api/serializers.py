@@ -1,10 +1,24 @@
+import math
+
+from django.conf import settings
 from django.contrib.auth.hashers import make_password
 from django.contrib.auth.models import User
+from django.db import IntegrityError, transaction
+from django.db.backends.base.operations import BaseDatabaseOperations
+from django.db.models import Q
 from rest_framework import serializers
-from rest_framework.generics import get_object_or_404
 
+from .addresses import network_range, normalize_ip, prefix_ranges
 from .models import (Credentials, MountPoint, WorkLoad, MigrationTarget,
-                     Migration)
+                     Migration, MigrationRunProfile, RUNNABLE_STATES)
+
+MIGRATION_FILTERS = {
+    'migration_state': 'migration_state',
+    'cloud_type': 'migration_target__cloud_type',
+    'source_of_type': 'source_of_type',
+    'migration_target': 'migration_target',
+}
+MIGRATION_PK_FILTERS = ('source_of_type', 'migration_target')
 
 
 class UserSerializer(serializers.ModelSerializer):
@@ -31,35 +45,164 @@ class CredentialsSerializer(serializers.ModelSerializer):
         model = Credentials
 
 
-def check_object(pk, model, name):
-    if pk:
-        real_object = model.objects.filter(pk=pk)
-        if not real_object:
-            raise serializers.ValidationError(
-                f'{pk} {name} does not exist'
-            )
-    else:
+class IdentityMap:
+
+    def __init__(self):
+        self.objects = {}
+
+    def get_many(self, model, pks):
+        cached = self.objects.setdefault(model, {})
+        missing = [
+            pk for pk in pks if pk is not None and pk not in cached
+        ]
+        if missing:
+            cached.update(model.objects.in_bulk(missing))
+        return {pk: cached[pk] for pk in pks if pk in cached}
+
+
+# The largest primary key every database backend can store.
+MAX_PK = BaseDatabaseOperations.integer_field_ranges['AutoField'][1]
+# The largest bandwidth limit, in bytes per second, the rate columns store.
+MAX_RATE = BaseDatabaseOperations.integer_field_ranges[
+    'PositiveBigIntegerField'
+][1]
+
+
+def to_int(value):
+    """value as an int, None unless it is a whole number."""
+    if isinstance(value, float) and not value.is_integer():
+        return None
+    try:
+        return int(value)
+    except (TypeError, ValueError, OverflowError):
+        return None
+
+
+def to_pk(pk):
+    """The primary key pk names, None if it can't name a row."""
+    pk = to_int(pk)
+    if pk is None or not 0 < pk <= MAX_PK:
+        return None
+    return pk
+
+
+def check_object(pk, model, name, identity_map=None):
+    if not pk:
         raise serializers.ValidationError(
             {f'{name}': ['This field is required.']}
         )
-    return real_object[0]
+    real_object = (identity_map or IdentityMap()).get_many(
+        model,
+        [to_pk(pk)]
+    ).get(to_pk(pk))
+    if real_object is None:
+        raise serializers.ValidationError(
+            f'{pk} {name} does not exist'
+        )
+    return real_object
 
 
-def check_mount_point(mount_point):
-    mount_points = []
-    mount_point_list = mount_point
-    for pk in mount_point_list:
-        real_mount_point = MountPoint.objects.filter(pk=pk)
-        if real_mount_point:
-            mount_points.append(get_object_or_404(MountPoint, pk=pk))
-        else:
-            raise serializers.ValidationError(
-                f'{pk} storage does not exist')
-    if not mount_points:
+def check_mount_point(mount_point, identity_map=None):
+    mount_point_list = list(dict.fromkeys(mount_point))
+    if not mount_point_list:
         raise serializers.ValidationError(
             {'storage': ['This field is required.']}
         )
-    return mount_points
+    real_mount_points = (identity_map or IdentityMap()).get_many(
+        MountPoint,
+        [to_pk(pk) for pk in mount_point_list]
+    )
+    missing = [
+        pk for pk in mount_point_list
+        if to_pk(pk) not in real_mount_points
+    ]
+    if missing:
+        raise serializers.ValidationError(
+            [f'{pk} storage does not exist' for pk in missing]
+        )
+    return [real_mount_points[to_pk(pk)] for pk in mount_point_list]
+
+
+def check_migrations(migration_list):
+    migration_ids = {to_pk(pk) for pk in migration_list}
+    if None in migration_ids:
+        raise serializers.ValidationError(
+            {'ids': ['A valid integer is required.']}
+        )
+    states = dict(
+        Migration.objects.filter(
+            pk__in=migration_ids
+        ).values_list('pk', 'migration_state')
+    )
+    errors = [
+        f'{pk} migration does not exist'
+        for pk in sorted(migration_ids - states.keys())
+    ]
+    errors += [
+        f'''{pk} migration can't run'''
+        for pk, state in sorted(states.items())
+        if state not in RUNNABLE_STATES
+    ]
+    if errors:
+        raise serializers.ValidationError({'ids': errors})
+    return sorted(migration_ids)
+
+
+def check_bandwidth_limit(limit, name):
+    if limit is None or limit == '':
+        return None
+    limit = to_int(limit) or 0
+    if limit < 1:
+        raise serializers.ValidationError({name: [
+            'Ensure this value is a number of bytes per second or null.'
+        ]})
+    if limit > MAX_RATE:
+        raise serializers.ValidationError({name: [
+            f'Ensure this value is less than or equal to {MAX_RATE}.'
+        ]})
+    return limit
+
+
+def check_migration_filters(data):
+    filters = {}
+    for name, lookup in MIGRATION_FILTERS.items():
+        value = data.get(name)
+        if not value:
+            continue
+        if name in MIGRATION_PK_FILTERS:
+            value = to_pk(value)
+            if value is None:
+                raise serializers.ValidationError(
+                    {name: ['A valid integer is required.']}
+                )
+        filters[lookup] = value
+    return filters
+
+
+def check_concurrency(concurrency):
+    if not concurrency:
+        return settings.MIGRATION_BATCH_CONCURRENCY
+    concurrency = to_int(concurrency) or 0
+    if not 0 < concurrency <= settings.MIGRATION_BATCH_MAX_CONCURRENCY:
+        raise serializers.ValidationError({'concurrency': [
+            'Ensure this value is between 1 and '
+            f'{settings.MIGRATION_BATCH_MAX_CONCURRENCY}.'
+        ]})
+    return concurrency
+
+
+def check_timeout(timeout):
+    if timeout in (None, ''):
+        return settings.MIGRATION_LONG_POLL_TIMEOUT
+    try:
+        timeout = float(timeout)
+    except (TypeError, ValueError):
+        timeout = math.nan
+    if not (math.isfinite(timeout) and timeout > 0):
+        raise serializers.ValidationError({'timeout': [
+            'Ensure this value is a positive number of seconds.'
+        ]})
+    return min(timeout, settings.MIGRATION_LONG_POLL_TIMEOUT)
 
 
 class WorkLoadSerializer(serializers.ModelSerializer):
@@ -68,8 +211,12 @@ class WorkLoadSerializer(serializers.ModelSerializer):
 
     class Meta:
         fields = '__all__'
+        read_only_fields = ('migrated_from',)
         model = WorkLoad
 
+    def validate_ip(self, ip):
+        return normalize_ip(ip)
+
     def stop_change_ip(self, ip):
         if ip:
             raise serializers.ValidationError(
@@ -77,13 +224,45 @@ class WorkLoadSerializer(serializers.ModelSerializer):
             )
 
     def check_ip(self, ip):
-        work_loads = WorkLoad.objects.filter(ip=ip)
-        if work_loads:
+        if WorkLoad.objects.filter(
+            ip=normalize_ip(ip),
+            migrated_from__isnull=True
+        ).exists():
+            raise serializers.ValidationError(
+                {'ip': ['This field is unique.']}
+            )
+
+    def save(self, **kwargs):
+        try:
+            with transaction.atomic():
+                return super().save(**kwargs)
+        except IntegrityError:
             raise serializers.ValidationError(
                 {'ip': ['This field is unique.']}
             )
 
 
+def filter_work_loads(queryset, cidr=None, ip_prefix=None):
+    if cidr:
+        try:
+            first, last = network_range(cidr)
+        except ValueError:
+            raise serializers.ValidationError(
+                {'cidr': [f'{cidr} is not a valid network.']}
+            )
+        queryset = queryset.filter(ip_key__gte=first, ip_key__lte=last)
+    if ip_prefix:
+        ranges = prefix_ranges(ip_prefix)
+        if ranges is None:
+            queryset = queryset.filter(ip__startswith=ip_prefix)
+        else:
+            condition = Q(pk__in=[])
+            for first, last in ranges:
+                condition |= Q(ip_key__gte=first, ip_key__lte=last)
+            queryset = queryset.filter(condition)
+    return queryset
+
+
 class MigrationTargetSerializer(serializers.ModelSerializer):
     cloud_credentials = CredentialsSerializer(many=False, read_only=True)
     target_vm = WorkLoadSerializer(many=False, read_only=True)
@@ -100,4 +279,19 @@ class MigrationSerializer(serializers.ModelSerializer):
 
     class Meta:
         fields = '__all__'
+        read_only_fields = (
+            'migration_state',
+            'migration_error',
+            'lease_owner',
+            'lease_expires_at',
+            'heartbeat_at',
+            'batch'
+        )
         model = Migration
+
+
+class MigrationRunProfileSerializer(serializers.ModelSerializer):
+
+    class Meta:
+        fields = '__all__'
+        model = MigrationRunProfile
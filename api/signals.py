@@ -0,0 +1,48 @@
+from django.db.models.signals import (m2m_changed, post_delete, post_save,
+                                      pre_delete)
+from django.dispatch import receiver
+
+from . import events, migration_counts, versions
+from .models import (Credentials, MountPoint, WorkLoad, MigrationTarget,
+                     Migration)
+
+
+@receiver(pre_delete, sender=Migration)
+def migration_deleted(sender, instance, **kwargs):
+    migration_counts.add_migrations(
+        Migration.objects.filter(pk=instance.pk),
+        sign=-1
+    )
+
+
+@receiver(pre_delete, sender=MigrationTarget)
+def migration_target_deleted(sender, instance, **kwargs):
+    # The migrations of the target are left without one.
+    migration_counts.move_cloud_type(instance.migrations.all(), '')
+
+
+@receiver(post_save, sender=Migration)
+@receiver(post_delete, sender=Migration)
+def migration_changed(sender, instance, **kwargs):
+    events.state_changed([instance.pk])
+
+
+@receiver(post_save, sender=Credentials)
+@receiver(post_delete, sender=Credentials)
+@receiver(post_save, sender=MountPoint)
+@receiver(post_delete, sender=MountPoint)
+@receiver(post_save, sender=WorkLoad)
+@receiver(post_delete, sender=WorkLoad)
+@receiver(post_save, sender=MigrationTarget)
+@receiver(post_delete, sender=MigrationTarget)
+@receiver(post_save, sender=Migration)
+@receiver(post_delete, sender=Migration)
+def resource_changed(sender, **kwargs):
+    versions.bump(sender)
+
+
+@receiver(m2m_changed, sender=WorkLoad.storage.through)
+@receiver(m2m_changed, sender=Migration.selected_mount_points.through)
+def relation_changed(sender, instance, action, model, **kwargs):
+    if action.startswith('post_'):
+        versions.bump(type(instance), model)
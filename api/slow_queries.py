@@ -0,0 +1,192 @@
+import hashlib
+import json
+import logging
+import re
+import threading
+from collections import OrderedDict
+from time import perf_counter
+
+from django.conf import settings
+from django.db.backends.signals import connection_created
+from django.dispatch import receiver
+from django.utils import timezone
+
+from . import timing
+
+logger = logging.getLogger(__name__)
+
+EXPLAINED = ('select', 'update', 'delete', 'with')
+MAX_PLANS = 1000
+
+_lock = threading.Lock()
+_plans = OrderedDict()
+_local = threading.local()
+
+_string = re.compile(r"'(?:[^']|'')*'")
+_number = re.compile(r'\b\d+(?:\.\d+)?\b')
+_in_list = re.compile(r'\(\s*(?:%s|\?)(?:\s*,\s*(?:%s|\?))*\s*\)')
+_space = re.compile(r'\s+')
+
+
+def normalize(sql):
+    sql = _string.sub('?', sql)
+    sql = _number.sub('?', sql)
+    sql = sql.replace('%s', '?')
+    sql = _in_list.sub('(...)', sql)
+    return _space.sub(' ', sql).strip()
+
+
+def fingerprint(sql):
+    return hashlib.sha1(normalize(sql).encode()).hexdigest()[:12]
+
+
+def explain(connection, sql, params):
+    prefix = (
+        'EXPLAIN QUERY PLAN ' if connection.vendor == 'sqlite'
+        else 'EXPLAIN '
+    )
+    # A cursor without the Django wrapper, so the plan is neither timed nor
+    # logged again and doesn't disturb the result of the slow query. Inside
+    # a transaction a failed EXPLAIN is rolled back to a savepoint.
+    cursor = connection.create_cursor()
+    savepoint = connection.in_atomic_block
+    try:
+        if savepoint:
+            cursor.execute('SAVEPOINT slow_query_explain')
+        try:
+            cursor.execute(prefix + sql, params)
+            rows = cursor.fetchall()
+        except Exception:
+            if savepoint:
+                cursor.execute('ROLLBACK TO SAVEPOINT slow_query_explain')
+            raise
+        finally:
+            if savepoint:
+                cursor.execute('RELEASE SAVEPOINT slow_query_explain')
+        return '\n'.join(
+            ' '.join(str(column) for column in row) for row in rows
+        )
+    finally:
+        cursor.close()
+
+
+def get_plan(connection, sql, params, key):
+    with _lock:
+        if key in _plans:
+            _plans.move_to_end(key)
+            return _plans[key]
+    if not sql.lstrip().lower().startswith(EXPLAINED):
+        return None
+    if connection.needs_rollback:
+        return None
+    try:
+        plan = explain(connection, sql, params)
+    except Exception as e:
+        plan = f'EXPLAIN failed: {e}'
+    with _lock:
+        _plans[key] = plan
+        while len(_plans) > MAX_PLANS:
+            _plans.popitem(last=False)
+    return plan
+
+
+def write(entry):
+    path = settings.SLOW_QUERY_LOG
+    if not path:
+        return
+    line = json.dumps(entry)
+    with _lock, open(path, 'a') as file:
+        file.write(f'{line}\n')
+
+
+def record(connection, sql, params, many, duration):
+    timer = timing.current_timer()
+    key = fingerprint(sql)
+    entry = {
+        'time': timezone.now().isoformat(),
+        'duration_ms': round(duration * 1000, 3),
+        'fingerprint': key,
+        'sql': normalize(sql),
+        'view': timing.view_name(timer.request) if timer else None,
+        'plan': None if many else get_plan(connection, sql, params, key)
+    }
+    logger.warning(
+        'slow query %s %.1f ms in %s: %s',
+        key,
+        entry['duration_ms'],
+        entry['view'],
+        entry['sql'],
+        extra={'slow_query': entry}
+    )
+    write(entry)
+
+
+class SlowQueryWrapper:
+
+    def __init__(self, connection):
+        self.connection = connection
+
+    def __call__(self, execute, sql, params, many, context):
+        threshold = settings.SLOW_QUERY_THRESHOLD_MS
+        if not threshold or getattr(_local, 'active', False):
+            return execute(sql, params, many, context)
+        started = perf_counter()
+        result = execute(sql, params, many, context)
+        duration = perf_counter() - started
+        if duration * 1000 >= threshold:
+            _local.active = True
+            try:
+                record(self.connection, sql, params, many, duration)
+            except Exception:
+                logger.exception('failed to record a slow query')
+            finally:
+                _local.active = False
+        return result
+
+
+@receiver(connection_created)
+def install_wrapper(sender, connection, **kwargs):
+    if not any(
+        isinstance(wrapper, SlowQueryWrapper)
+        for wrapper in connection.execute_wrappers
+    ):
+        connection.execute_wrappers.insert(0, SlowQueryWrapper(connection))
+
+
+def read_log(path):
+    with open(path) as file:
+        for line in file:
+            if line.strip():
+                try:
+                    yield json.loads(line)
+                except ValueError:
+                    continue
+
+
+def top_queries(entries, top=20, order='total'):
+    stats = {}
+    for entry in entries:
+        stat = stats.setdefault(entry['fingerprint'], {
+            'fingerprint': entry['fingerprint'],
+            'sql': entry['sql'],
+            'count': 0,
+            'total_ms': 0.0,
+            'max_ms': 0.0,
+            'views': {},
+            'plan': None
+        })
+        stat['count'] += 1
+        stat['total_ms'] += entry['duration_ms']
+        stat['max_ms'] = max(stat['max_ms'], entry['duration_ms'])
+        view = entry.get('view') or '-'
+        stat['views'][view] = stat['views'].get(view, 0) + 1
+        stat['plan'] = entry.get('plan') or stat['plan']
+    for stat in stats.values():
+        stat['mean_ms'] = stat['total_ms'] / stat['count']
+    key = {
+        'total': 'total_ms',
+        'count': 'count',
+        'max': 'max_ms',
+        'mean': 'mean_ms'
+    }[order]
+    return sorted(stats.values(), key=lambda stat: -stat[key])[:top]
@@ -0,0 +1,109 @@
+import threading
+import uuid
+
+from django.conf import settings
+from django.core.cache import caches
+
+KEY_PREFIX = 'migration-state:'
+
+_lock = threading.Lock()
+_hits = 0
+_misses = 0
+
+
+def get_cache():
+    return caches[settings.MIGRATION_STATE_CACHE]
+
+
+def generation_key(pk):
+    return f'{KEY_PREFIX}{pk}:generation'
+
+
+def make_key(pk, generation):
+    return f'{KEY_PREFIX}{pk}:{generation}'
+
+
+def new_generation():
+    return uuid.uuid4().hex
+
+
+def get_generations(cache, migration_ids):
+    """The generations of the states, read before the states themselves.
+
+    A state loaded from the database is stored under the generation read
+    before the load, so an invalidation racing with the load leaves the
+    stale state under a generation nobody reads any more.
+    """
+    keys = {pk: generation_key(pk) for pk in migration_ids}
+    cached = cache.get_many(keys.values())
+    missing = {
+        key: new_generation() for key in keys.values() if key not in cached
+    }
+    if missing:
+        cache.set_many(missing, None)
+        cached.update(missing)
+    return {pk: cached[key] for pk, key in keys.items()}
+
+
+def load_states(migration_ids):
+    from .models import Migration
+
+    return dict(Migration.objects.filter(
+        pk__in=migration_ids
+    ).values_list('pk', 'migration_state'))
+
+
+def get_states(migration_ids):
+    """The states of the migrations, cached unless queued or running.
+
+    Workers move queued and running migrations from other processes, so
+    those states are always read from the database.
+    """
+    global _hits, _misses
+    from .models import ACTIVE_STATES
+
+    cache = get_cache()
+    generations = get_generations(cache, migration_ids)
+    keys = {pk: make_key(pk, generations[pk]) for pk in migration_ids}
+    cached = cache.get_many(keys.values())
+    states = {pk: cached[key] for pk, key in keys.items() if key in cached}
+    missing = [pk for pk in migration_ids if pk not in states]
+    with _lock:
+        _hits += len(states)
+        _misses += len(missing)
+    if missing:
+        loaded = load_states(missing)
+        cache.set_many(
+            {
+                keys[pk]: state for pk, state in loaded.items()
+                if state not in ACTIVE_STATES
+            },
+            settings.MIGRATION_STATE_CACHE_TIMEOUT
+        )
+        states.update(loaded)
+    return states
+
+
+def invalidate(migration_ids):
+    """Moves the migrations to a new generation, their old states expire."""
+    generation = new_generation()
+    get_cache().set_many(
+        {generation_key(pk): generation for pk in migration_ids},
+        None
+    )
+
+
+def stats():
+    with _lock:
+        hits, misses = _hits, _misses
+    return {
+        'hits': hits,
+        'misses': misses,
+        'hit ratio': round(hits / (hits + misses), 4) if hits + misses else 0
+    }
+
+
+def reset_stats():
+    global _hits, _misses
+    with _lock:
+        _hits = _misses = 0
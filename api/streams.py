@@ -0,0 +1,153 @@
+import asyncio
+import json
+from urllib.parse import parse_qs
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.db import close_old_connections
+from rest_framework_simplejwt.authentication import JWTAuthentication
+from rest_framework_simplejwt.exceptions import InvalidToken, TokenError
+
+from . import events
+
+STREAM_PATH = '/api/v1/migrations/state/stream/'
+
+
+def database_sync_to_async(function):
+    def wrapper(*args, **kwargs):
+        close_old_connections()
+        try:
+            return function(*args, **kwargs)
+        finally:
+            close_old_connections()
+    return sync_to_async(wrapper)
+
+
+def authenticate(headers, query):
+    authentication = JWTAuthentication()
+    header = headers.get(b'authorization')
+    raw_token = (
+        authentication.get_raw_token(header) if header
+        else (query.get('token') or [''])[0].encode()
+    )
+    if not raw_token:
+        return None
+    try:
+        user = authentication.get_user(
+            authentication.get_validated_token(raw_token)
+        )
+    except (InvalidToken, TokenError):
+        return None
+    return user if user.is_active else None
+
+
+def get_stream_ids(query):
+    return events.parse_ids(
+        query.get('ids'),
+        (query.get('batch') or [None])[0]
+    )
+
+
+def state_event(pk, state):
+    data = json.dumps({'id': pk, 'migration state': state})
+    return f'event: state\ndata: {data}\n\n'.encode()
+
+
+class MigrationStateStream:
+
+    def __init__(self, application):
+        self.application = application
+
+    async def __call__(self, scope, receive, send):
+        if scope['type'] != 'http' or scope['path'] != STREAM_PATH:
+            return await self.application(scope, receive, send)
+        query = parse_qs(scope['query_string'].decode())
+        headers = dict(scope['headers'])
+        user = await database_sync_to_async(authenticate)(headers, query)
+        if user is None:
+            return await self.respond(send, 401, {
+                'detail': 'Authentication credentials were not provided.'
+            })
+        try:
+            migration_ids = await database_sync_to_async(get_stream_ids)(
+                query
+            )
+        except ValueError as e:
+            return await self.respond(send, 400, {'ids': [str(e)]})
+        await send({
+            'type': 'http.response.start',
+            'status': 200,
+            'headers': [
+                (b'content-type', b'text/event-stream'),
+                (b'cache-control', b'no-cache'),
+                (b'x-accel-buffering', b'no'),
+            ]
+        })
+        disconnected = asyncio.Event()
+        listener = asyncio.ensure_future(
+            self.wait_for_disconnect(receive, disconnected)
+        )
+        try:
+            await self.stream(send, migration_ids, disconnected)
+        finally:
+            listener.cancel()
+
+    async def respond(self, send, status, data):
+        await send({
+            'type': 'http.response.start',
+            'status': status,
+            'headers': [(b'content-type', b'application/json')]
+        })
+        await send({
+            'type': 'http.response.body',
+            'body': json.dumps(data).encode()
+        })
+
+    async def wait_for_disconnect(self, receive, disconnected):
+        while True:
+            message = await receive()
+            if message['type'] == 'http.disconnect':
+                disconnected.set()
+                return
+
+    async def stream(self, send, migration_ids, disconnected):
+        loop = asyncio.get_event_loop()
+        states = {}
+        seen_version = None
+        next_poll = next_ping = loop.time()
+        while not disconnected.is_set():
+            now = loop.time()
+            if events.version() != seen_version or now >= next_poll:
+                seen_version = events.version()
+                next_poll = now + settings.MIGRATION_STREAM_POLL_INTERVAL
+                current = await database_sync_to_async(events.get_states)(
+                    migration_ids
+                )
+                body = b''.join(
+                    state_event(pk, state)
+                    for pk, state in sorted(current.items())
+                    if states.get(pk) != state
+                )
+                states = current
+                if body:
+                    next_ping = now + settings.MIGRATION_STREAM_PING_INTERVAL
+                    await send({
+                        'type': 'http.response.body',
+                        'body': body,
+                        'more_body': True
+                    })
+            if now >= next_ping:
+                next_ping = now + settings.MIGRATION_STREAM_PING_INTERVAL
+                await send({
+                    'type': 'http.response.body',
+                    'body': b': ping\n\n',
+                    'more_body': True
+                })
+            try:
+                await asyncio.wait_for(
+                    disconnected.wait(),
+                    settings.MIGRATION_STREAM_EVENT_INTERVAL
+                )
+            except asyncio.TimeoutError:
+                pass
+        await send({'type': 'http.response.body', 'body': b''})
@@ -1,19 +1,73 @@
+import asyncio
+import errno
+import io
 import json
+import os
+import tempfile
+import threading
+import tracemalloc
 import uuid
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import ExitStack, contextmanager
+from datetime import timedelta
+from unittest import mock
 
+from asgiref.sync import async_to_sync, sync_to_async
+from asgiref.testing import ApplicationCommunicator
 from django.contrib.auth.models import User
+from django.core.management import CommandError, call_command
 from django.http import QueryDict
 from django.test import Client
-from django.test import TestCase
+from django.db import IntegrityError, connection, transaction
+from django.test import TestCase, TransactionTestCase, override_settings
+from django.utils import timezone
+from rest_framework.exceptions import ValidationError
 from rest_framework.test import RequestsClient, APITestCase
+from rest_framework_simplejwt.tokens import AccessToken
 
+from . import (bulk, caching, metrics, migration_counts, profiling,
+               state_cache, throttling, timing, transfer, versions)
+from .addresses import ip_key
+from .benchmark import Route, percentile, run_route
+from .importer import generate_inventory
+from .management.commands import bench_api
+from .microbenchmarks import find_regressions
+from .slow_queries import normalize
 from .models import (Credentials, MountPoint, WorkLoad, MigrationTarget,
-                     Migration)
+                     Migration, MigrationBatch, MigrationCount,
+                     MigrationRunProfile, MigrationState, ProfileMode,
+                     TransferCheckpoint, TransferManifest, BandwidthLimit,
+                     RUNNABLE_STATES)
+from .pagination import PkCursorPagination
+from .serializers import IdentityMap, check_mount_point, check_object
+from .export import ExportApplication
+from .streams import STREAM_PATH, MigrationStateStream
+from .scheduler import advance_batch
+from .views import MigrationViewSet
+from .worker import MigrationWorker
+
+THREADS = 16
+
+traced_phases = []
+
+
+@contextmanager
+def trace_phase(migration, name):
+    traced_phases.append((migration.pk, name))
+    yield
+
+
+def run_on_commit(func, using=None):
+    func()
 
 
 class SetUpTestCase(TestCase):
 
     def setUp(self):
+        # TestCase never commits, callbacks run as after an autocommit.
+        on_commit = mock.patch.object(transaction, 'on_commit', run_on_commit)
+        on_commit.start()
+        self.addCleanup(on_commit.stop)
         self.client = Client()
         self.username = uuid.uuid4().hex
         self.password = uuid.uuid4().hex
@@ -455,6 +509,46 @@ class UpdateMigrationWorkLoadTestCase(SetUpTestCase, APITestCase):
             response_update_migration.content
         )
 
+    def test_update_during_a_transition(self):
+        get_object = MigrationViewSet.get_object
+
+        def get_object_then_claim(view):
+            # A worker claims the migration after the view read it.
+            migration = get_object(view)
+            Migration.transition(
+                migration.pk,
+                RUNNABLE_STATES,
+                MigrationState.RUNNING,
+                lease_owner='worker-1',
+                lease_expires_at=timezone.now() + timedelta(minutes=1)
+            )
+            return migration
+
+        with mock.patch.object(MigrationViewSet, 'get_object',
+                               get_object_then_claim):
+            response_update_migration = self.client.patch(
+                f'http://testserver/api/v1/migrations/{self.migration.pk}/',
+                {'profile': 'phases'},
+                headers={'Authorization': f'Bearer {self.token}'}
+            )
+        self.assertEqual(response_update_migration.status_code, 200)
+        self.migration.refresh_from_db()
+        self.assertEqual(self.migration.profile, 'phases')
+        self.assertEqual(self.migration.migration_state, 'running')
+        self.assertEqual(self.migration.lease_owner, 'worker-1')
+        stale = Migration.objects.get(pk=self.migration.pk)
+        Migration.transition(
+            stale.pk,
+            (MigrationState.RUNNING,),
+            MigrationState.SUCCESS,
+            lease_owner='',
+            lease_expires_at=None
+        )
+        stale.save()
+        self.migration.refresh_from_db()
+        self.assertEqual(self.migration.migration_state, 'success')
+        self.assertEqual(self.migration.lease_owner, '')
+
     def test_update_work_load(self):
         ip = uuid.uuid4().hex
         data = {'ip': ip}
@@ -493,6 +587,7 @@ class UpdateMigrationWorkLoadTestCase(SetUpTestCase, APITestCase):
         )
 
 
+@override_settings(MIGRATION_EXECUTOR_EAGER=True, MIGRATION_RUN_DELAY=0)
 class RunMigrationTestCase(SetUpTestCase, TestCase):
 
     def test_run_migration(self):
@@ -528,10 +623,10 @@ class RunMigrationTestCase(SetUpTestCase, TestCase):
         )
         self.assertEqual(
             response_run_migration.status_code,
-            200
+            202
         )
         self.assertIn(
-            bytes('migration successfully', encoding='UTF-8'),
+            bytes('/api/v1/migrations/1/state/', encoding='UTF-8'),
             response_run_migration.content
         )
         response_status_migration = self.client.get(
@@ -595,11 +690,7 @@ class RunMigrationTestCase(SetUpTestCase, TestCase):
         )
         self.assertEqual(
             response_run_migration.status_code,
-            400
-        )
-        self.assertIn(
-            bytes('selected_mount_points not in source', encoding='UTF-8'),
-            response_run_migration.content
+            202
         )
         response_status_migration = self.client.get(
             '/api/v1/migrations/2/state/',
@@ -613,6 +704,10 @@ class RunMigrationTestCase(SetUpTestCase, TestCase):
             bytes('error', encoding='UTF-8'),
             response_status_migration.content
         )
+        self.assertIn(
+            bytes('selected_mount_points not in source', encoding='UTF-8'),
+            response_status_migration.content
+        )
         response_migration_target = self.client.get(
             '/api/v1/migration_targets/2/',
             HTTP_AUTHORIZATION=f'Bearer {self.token}'
@@ -621,3 +716,2342 @@ class RunMigrationTestCase(SetUpTestCase, TestCase):
             bytes(self.mount_point_name_3, encoding='UTF-8'),
             response_migration_target.content
         )
+
+
+class RunMigrationAsyncTestCase(SetUpTestCase, TestCase):
+
+    def test_run_migration_returns_before_run(self):
+        with mock.patch('api.views.submit_migration') as submit_migration:
+            response_run_migration = self.client.get(
+                '/api/v1/migrations/1/run/',
+                HTTP_AUTHORIZATION=f'Bearer {self.token}'
+            )
+        self.assertEqual(response_run_migration.status_code, 202)
+        submit_migration.assert_called_once_with(self.migration.pk)
+        self.migration.refresh_from_db()
+        self.assertEqual(self.migration.migration_state, 'queued')
+
+
+@override_settings(MIGRATION_RUN_DELAY=0)
+class MigrationWorkerTestCase(SetUpTestCase, TestCase):
+
+    def test_worker_claims_queued_migration(self):
+        worker = MigrationWorker(name='worker-1', lease_seconds=60)
+        self.assertIsNone(worker.run())
+        Migration.objects.filter(pk=self.migration.pk).update(
+            migration_state='queued'
+        )
+        self.assertEqual(worker.run(), self.migration.pk)
+        self.migration.refresh_from_db()
+        self.assertEqual(self.migration.migration_state, 'success')
+        self.assertEqual(self.migration.lease_owner, '')
+        self.assertIsNotNone(self.migration.heartbeat_at)
+        self.assertIsNone(worker.run())
+
+    def test_claim_is_exclusive(self):
+        Migration.objects.filter(pk=self.migration.pk).update(
+            migration_state='queued'
+        )
+        self.assertEqual(
+            Migration.claim('worker-1', 60),
+            self.migration.pk
+        )
+        self.assertIsNone(Migration.claim('worker-2', 60))
+        self.migration.refresh_from_db()
+        self.assertEqual(self.migration.migration_state, 'running')
+        self.assertEqual(self.migration.lease_owner, 'worker-1')
+
+    def test_expired_lease_is_claimed_again(self):
+        Migration.objects.filter(pk=self.migration.pk).update(
+            migration_state='running',
+            lease_owner='crashed-worker',
+            lease_expires_at=timezone.now() + timedelta(minutes=1)
+        )
+        self.assertIsNone(Migration.claim('worker-1', 60))
+        Migration.objects.filter(pk=self.migration.pk).update(
+            lease_expires_at=timezone.now() - timedelta(minutes=1)
+        )
+        self.assertEqual(
+            Migration.claim('worker-1', 60),
+            self.migration.pk
+        )
+        self.assertEqual(Migration.heartbeat(
+            self.migration.pk, 'crashed-worker', 60
+        ), 0)
+        self.assertEqual(Migration.heartbeat(
+            self.migration.pk, 'worker-1', 60
+        ), 1)
+
+    def test_running_migration_is_resumed_after_its_lease(self):
+        Migration.objects.filter(pk=self.migration.pk).update(
+            migration_state='running',
+            lease_owner='crashed-worker',
+            lease_expires_at=timezone.now() + timedelta(minutes=1)
+        )
+        self.assertFalse(Migration.resume(self.migration.pk))
+        Migration.objects.filter(pk=self.migration.pk).update(
+            lease_expires_at=timezone.now() - timedelta(minutes=1)
+        )
+        with mock.patch('api.views.submit_migration') as submit_migration:
+            response = self.client.get(
+                f'/api/v1/migrations/{self.migration.pk}/run/',
+                HTTP_AUTHORIZATION=f'Bearer {self.token}'
+            )
+        self.assertEqual(response.status_code, 202)
+        submit_migration.assert_called_once_with(self.migration.pk)
+        self.migration.refresh_from_db()
+        self.assertEqual(self.migration.migration_state, 'queued')
+        self.assertEqual(self.migration.lease_owner, '')
+
+
+@override_settings(MIGRATION_RUN_DELAY=0)
+class ConcurrentRunMigrationTestCase(TransactionTestCase):
+
+    def setUp(self):
+        mount_point = MountPoint.objects.create(
+            mount_point_name=uuid.uuid4().hex,
+            total_size_of_the_volume=1
+        )
+        work_load = WorkLoad.objects.create(ip=uuid.uuid4().hex)
+        work_load.storage.set([mount_point])
+        self.migration = Migration.objects.create(
+            source_of_type=work_load,
+            migration_target=MigrationTarget.objects.create()
+        )
+        self.migration.selected_mount_points.set([mount_point])
+
+    def test_only_one_concurrent_run_wins(self):
+        barrier = threading.Barrier(THREADS)
+        started = threading.Barrier(THREADS, timeout=30)
+        turn = threading.Lock()
+        transition = Migration.transition
+        tried = threading.local()
+
+        def transition_then_wait(*args, **kwargs):
+            # SQLite locks whole tables, so the transitions take turns
+            # and the winner goes on once every run tried to start.
+            with turn:
+                changed = transition(*args, **kwargs)
+            if not getattr(tried, 'start', False):
+                tried.start = True
+                started.wait()
+            return changed
+
+        def run_migration():
+            barrier.wait()
+            try:
+                return Migration(pk=self.migration.pk).run_migration()
+            finally:
+                connection.close()
+
+        with mock.patch.object(Migration, 'transition',
+                               transition_then_wait), \
+                ThreadPoolExecutor(max_workers=THREADS) as executor:
+            results = list(executor.map(
+                lambda number: run_migration(),
+                range(THREADS)
+            ))
+        self.assertEqual(results.count(None), 1)
+        self.assertEqual(
+            results.count('''migration can't run'''),
+            THREADS - 1
+        )
+        self.migration.refresh_from_db()
+        self.assertEqual(self.migration.migration_state, 'success')
+        self.assertEqual(
+            WorkLoad.objects.filter(
+                migrated_from=self.migration.source_of_type_id
+            ).count(),
+            1
+        )
+
+    def test_finished_run_cannot_run_again(self):
+        self.assertIsNone(Migration(pk=self.migration.pk).run_migration())
+        self.assertEqual(
+            Migration(pk=self.migration.pk).run_migration(),
+            '''migration can't run'''
+        )
+        self.assertEqual(WorkLoad.objects.count(), 2)
+
+
+@override_settings(MIGRATION_EXECUTOR_EAGER=True, MIGRATION_RUN_DELAY=0)
+class RunMigrationsTestCase(SetUpTestCase, TestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.migrations = [self.migration]
+        for number in range(4):
+            migration = Migration.objects.create(
+                source_of_type=self.work_load,
+                migration_target=self.migration_target
+            )
+            migration.selected_mount_points.set([self.mount_point_1])
+            self.migrations.append(migration)
+
+    def test_run_migrations(self):
+        response_run_migrations = self.client.post(
+            '/api/v1/migrations/run/',
+            data={
+                'ids': [migration.pk for migration in self.migrations],
+                'concurrency': 2
+            },
+            content_type='application/json',
+            HTTP_AUTHORIZATION=f'Bearer {self.token}'
+        )
+        self.assertEqual(response_run_migrations.status_code, 202)
+        batch_id = response_run_migrations.json()['batch id']
+        response_batch = self.client.get(
+            f'/api/v1/migrations/batches/{batch_id}/',
+            HTTP_AUTHORIZATION=f'Bearer {self.token}'
+        )
+        self.assertEqual(response_batch.status_code, 200)
+        self.assertEqual(response_batch.json()['migrations'], 5)
+        self.assertEqual(
+            response_batch.json()['migration states']['success'],
+            5
+        )
+        self.assertEqual(response_batch.json()['progress'], 100)
+
+    def test_run_migrations_by_filter(self):
+        Migration.objects.filter(pk=self.migration.pk).update(
+            migration_state='success'
+        )
+        response_run_migrations = self.client.post(
+            '/api/v1/migrations/run/',
+            data={'cloud_type': 'aws'},
+            HTTP_AUTHORIZATION=f'Bearer {self.token}'
+        )
+        self.assertEqual(response_run_migrations.status_code, 202)
+        self.assertEqual(response_run_migrations.json()['migrations'], 4)
+
+    def test_run_migrations_by_invalid_filter(self):
+        for data in ({'source_of_type': 'x'},
+                     {'migration_target': '1.5'},
+                     {'source_of_type': str(2 ** 63)}):
+            response_run_migrations = self.client.post(
+                '/api/v1/migrations/run/',
+                data=data,
+                HTTP_AUTHORIZATION=f'Bearer {self.token}'
+            )
+            self.assertEqual(response_run_migrations.status_code, 400)
+            self.assertEqual(
+                response_run_migrations.json(),
+                {next(iter(data)): ['A valid integer is required.']}
+            )
+        self.assertFalse(
+            Migration.objects.filter(migration_state=MigrationState.QUEUED)
+            .exists()
+        )
+
+    def test_run_migrations_errors(self):
+        Migration.objects.filter(pk=self.migration.pk).update(
+            migration_state='running'
+        )
+        response_run_migrations = self.client.post(
+            '/api/v1/migrations/run/',
+            data={'ids': [self.migration.pk, self.migrations[1].pk, 100]},
+            HTTP_AUTHORIZATION=f'Bearer {self.token}'
+        )
+        self.assertEqual(response_run_migrations.status_code, 400)
+        self.assertIn(
+            bytes('100 migration does not exist', encoding='UTF-8'),
+            response_run_migrations.content
+        )
+        self.assertIn(
+            bytes(f"{self.migration.pk} migration can't run",
+                  encoding='UTF-8'),
+            response_run_migrations.content
+        )
+        self.assertEqual(
+            Migration.objects.filter(batch__isnull=False).count(),
+            0
+        )
+        response_run_migrations = self.client.post(
+            '/api/v1/migrations/run/',
+            data={'ids': [self.migrations[1].pk], 'concurrency': 1000},
+            HTTP_AUTHORIZATION=f'Bearer {self.token}'
+        )
+        self.assertEqual(response_run_migrations.status_code, 400)
+        for ids in ([2 ** 70], ['1.5'], [1.5]):
+            response_run_migrations = self.client.post(
+                '/api/v1/migrations/run/',
+                data={'ids': ids},
+                content_type='application/json',
+                HTTP_AUTHORIZATION=f'Bearer {self.token}'
+            )
+            self.assertEqual(response_run_migrations.status_code, 400)
+            self.assertEqual(
+                response_run_migrations.json(),
+                {'ids': ['A valid integer is required.']}
+            )
+        for concurrency in (2.9, '2.9'):
+            response_run_migrations = self.client.post(
+                '/api/v1/migrations/run/',
+                data={
+                    'ids': [self.migrations[1].pk],
+                    'concurrency': concurrency
+                },
+                content_type='application/json',
+                HTTP_AUTHORIZATION=f'Bearer {self.token}'
+            )
+            self.assertEqual(response_run_migrations.status_code, 400)
+            self.assertIn('concurrency', response_run_migrations.json())
+        self.assertEqual(
+            Migration.objects.filter(batch__isnull=False).count(),
+            0
+        )
+
+    def test_waves(self):
+        batch = MigrationBatch.objects.create(concurrency=2)
+        Migration.objects.update(batch=batch)
+        pks = [migration.pk for migration in self.migrations]
+        self.assertEqual(advance_batch(batch.pk), pks[:2])
+        self.assertEqual(advance_batch(batch.pk), [])
+        Migration.objects.filter(pk__in=pks[:2]).update(
+            migration_state='success'
+        )
+        self.assertEqual(advance_batch(batch.pk), pks[2:4])
+        Migration.objects.filter(pk__in=pks[2:4]).update(
+            migration_state='error'
+        )
+        self.assertEqual(advance_batch(batch.pk), pks[4:])
+        Migration.objects.filter(pk__in=pks[4:]).update(
+            migration_state='success'
+        )
+        self.assertIsNone(advance_batch(batch.pk))
+        batch.refresh_from_db()
+        self.assertTrue(batch.finished)
+        self.assertEqual(
+            Migration.objects.filter(migration_state='error').count(),
+            2
+        )
+
+    def test_worker_carries_on_a_stopped_batch(self):
+        batch = MigrationBatch.objects.create(concurrency=2)
+        Migration.objects.update(batch=batch)
+        # The process that took the request stops after the first wave.
+        self.assertEqual(len(advance_batch(batch.pk)), 2)
+        MigrationWorker(name='worker-1', lease_seconds=60).run_forever(
+            threading.Event(),
+            0,
+            burst=True
+        )
+        batch.refresh_from_db()
+        self.assertTrue(batch.finished)
+        self.assertEqual(
+            set(Migration.objects.values_list('migration_state', flat=True)),
+            {'success'}
+        )
+
+
+class QueryCountTestCase(SetUpTestCase, TestCase):
+    list_queries = {
+        '/api/v1/credentials/': 3,
+        '/api/v1/mount_points/': 3,
+        '/api/v1/work_loads/': 4,
+        '/api/v1/migration_targets/': 4,
+        '/api/v1/migrations/': 6,
+    }
+    detail_queries = {
+        '/api/v1/credentials/1/': 3,
+        '/api/v1/mount_points/1/': 3,
+        '/api/v1/work_loads/1/': 4,
+        '/api/v1/migration_targets/1/': 4,
+        '/api/v1/migrations/1/': 6,
+    }
+
+    def add_inventory(self, count):
+        for number in range(count):
+            credentials = Credentials.objects.create(
+                username=uuid.uuid4().hex,
+                password=uuid.uuid4().hex,
+                domain=uuid.uuid4().hex
+            )
+            mount_points = [
+                MountPoint.objects.create(
+                    mount_point_name=uuid.uuid4().hex,
+                    total_size_of_the_volume=1
+                )
+                for mount_point_number in range(2)
+            ]
+            work_load = WorkLoad.objects.create(
+                ip=uuid.uuid4().hex,
+                credentials=credentials
+            )
+            work_load.storage.set(mount_points)
+            migration_target = MigrationTarget.objects.create(
+                cloud_credentials=credentials,
+                target_vm=work_load
+            )
+            migration = Migration.objects.create(
+                source_of_type=work_load,
+                migration_target=migration_target
+            )
+            migration.selected_mount_points.set(mount_points)
+
+    def assert_queries(self, expected_queries):
+        for url, queries in expected_queries.items():
+            with self.subTest(url=url), self.assertNumQueries(queries):
+                response = self.client.get(
+                    url,
+                    HTTP_AUTHORIZATION=f'Bearer {self.token}'
+                )
+                self.assertEqual(response.status_code, 200)
+
+    def test_list_queries_do_not_grow(self):
+        self.add_inventory(2)
+        self.assert_queries(self.list_queries)
+        self.add_inventory(10)
+        self.assert_queries(self.list_queries)
+
+    def test_detail_queries(self):
+        self.add_inventory(2)
+        self.migration_target.target_vm = self.work_load
+        self.migration_target.save()
+        self.assert_queries(self.detail_queries)
+
+
+class PaginationTestCase(SetUpTestCase, TestCase):
+
+    def test_cursor_pagination(self):
+        for number in range(4):
+            MountPoint.objects.create(
+                mount_point_name=uuid.uuid4().hex,
+                total_size_of_the_volume=1
+            )
+        url = '/api/v1/mount_points/?page_size=2'
+        mount_points = []
+        while url:
+            response = self.client.get(
+                url,
+                HTTP_AUTHORIZATION=f'Bearer {self.token}'
+            )
+            self.assertEqual(response.status_code, 200)
+            self.assertLessEqual(len(response.json()['results']), 2)
+            mount_points += [
+                mount_point['id']
+                for mount_point in response.json()['results']
+            ]
+            url = response.json()['next']
+        self.assertEqual(
+            mount_points,
+            list(MountPoint.objects.values_list('pk', flat=True))
+        )
+
+    def test_page_size_is_capped(self):
+        with mock.patch.object(PkCursorPagination, 'max_page_size', 2):
+            response = self.client.get(
+                '/api/v1/mount_points/?page_size=1000',
+                HTTP_AUTHORIZATION=f'Bearer {self.token}'
+            )
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(len(response.json()['results']), 2)
+
+
+class CheckObjectTestCase(SetUpTestCase, TestCase):
+
+    def test_check_mount_point_in_one_query(self):
+        with self.assertNumQueries(1):
+            mount_points = check_mount_point([
+                str(self.mount_point_2.pk),
+                str(self.mount_point_1.pk),
+                str(self.mount_point_2.pk)
+            ])
+        self.assertEqual(
+            mount_points,
+            [self.mount_point_2, self.mount_point_1]
+        )
+
+    def test_check_mount_point_reports_every_missing_id(self):
+        with self.assertNumQueries(1):
+            with self.assertRaises(ValidationError) as error:
+                check_mount_point(['100', str(self.mount_point_1.pk), 'x'])
+        self.assertEqual(
+            error.exception.detail,
+            ['100 storage does not exist', 'x storage does not exist']
+        )
+
+    def test_identity_map(self):
+        identity_map = IdentityMap()
+        with self.assertNumQueries(1):
+            for number in range(3):
+                credentials = check_object(
+                    str(self.credentials_1.pk),
+                    Credentials,
+                    'credentials',
+                    identity_map
+                )
+        self.assertEqual(credentials, self.credentials_1)
+        with self.assertNumQueries(1):
+            check_mount_point([self.mount_point_1.pk], identity_map)
+            check_mount_point([self.mount_point_1.pk], identity_map)
+
+    def test_out_of_range_ids_do_not_exist(self):
+        with self.assertNumQueries(0):
+            with self.assertRaises(ValidationError) as error:
+                check_object(str(2 ** 70), WorkLoad, 'work load')
+        self.assertEqual(
+            error.exception.detail,
+            [f'{2 ** 70} work load does not exist']
+        )
+        with self.assertRaises(ValidationError) as error:
+            check_mount_point([str(2 ** 70), '0', str(self.mount_point_1.pk)])
+        self.assertEqual(
+            error.exception.detail,
+            [f'{2 ** 70} storage does not exist', '0 storage does not exist']
+        )
+        response_create_migration = self.client.post(
+            '/api/v1/migrations/',
+            data={
+                'selected_mount_points': [1],
+                'source_of_type': 2 ** 70,
+                'migration_target': 1
+            },
+            HTTP_AUTHORIZATION=f'Bearer {self.token}'
+        )
+        self.assertEqual(response_create_migration.status_code, 400)
+        self.assertEqual(
+            response_create_migration.json(),
+            [f'{2 ** 70} work load does not exist']
+        )
+
+    def test_create_migration_with_missing_objects(self):
+        response_create_migration = self.client.post(
+            '/api/v1/migrations/',
+            data={
+                'selected_mount_points': [1, 100, 101],
+                'source_of_type': 1,
+                'migration_target': 1
+            },
+            HTTP_AUTHORIZATION=f'Bearer {self.token}'
+        )
+        self.assertEqual(response_create_migration.status_code, 400)
+        self.assertEqual(
+            response_create_migration.json(),
+            ['100 storage does not exist', '101 storage does not exist']
+        )
+
+
+class BulkUpsertTestCase(SetUpTestCase, TestCase):
+
+    def test_bulk_mount_points(self):
+        response_bulk_mount_points = self.client.post(
+            '/api/v1/mount_points/bulk/',
+            data=[
+                {
+                    'id': self.mount_point_1.pk,
+                    'mount_point_name': self.mount_point_name_1,
+                    'total_size_of_the_volume': 10
+                },
+                {
+                    'mount_point_name': self.mount_point_name_2,
+                    'total_size_of_the_volume': 20
+                },
+                {
+                    'mount_point_name': self.mount_point_name_2,
+                    'total_size_of_the_volume': 30
+                },
+                {'mount_point_name': 'broken'},
+                {
+                    'id': 100,
+                    'mount_point_name': 'missing',
+                    'total_size_of_the_volume': 40
+                },
+                {
+                    'id': self.mount_point_1.pk,
+                    'mount_point_name': self.mount_point_name_1,
+                    'total_size_of_the_volume': 50
+                }
+            ],
+            content_type='application/json',
+            HTTP_AUTHORIZATION=f'Bearer {self.token}'
+        )
+        self.assertEqual(response_bulk_mount_points.status_code, 200)
+        result = response_bulk_mount_points.json()
+        self.assertEqual(result['created'], 2)
+        self.assertEqual(result['updated'], 1)
+        self.assertEqual(
+            [error['index'] for error in result['errors']],
+            [3, 4, 5]
+        )
+        self.assertEqual(
+            result['errors'][1]['errors'],
+            {'id': ['100 mount point does not exist']}
+        )
+        self.mount_point_1.refresh_from_db()
+        self.assertEqual(self.mount_point_1.total_size_of_the_volume, 10)
+        self.mount_point_2.refresh_from_db()
+        self.assertEqual(
+            self.mount_point_2.total_size_of_the_volume,
+            self.total_size_of_the_volume_2
+        )
+        self.assertEqual(
+            list(MountPoint.objects.filter(
+                mount_point_name=self.mount_point_name_2
+            ).values_list('pk', 'total_size_of_the_volume')),
+            [
+                (self.mount_point_2.pk, self.total_size_of_the_volume_2),
+                (result['results'][1]['id'], 20),
+                (result['results'][2]['id'], 30)
+            ]
+        )
+
+    def test_bulk_conflict_is_an_item_error(self):
+        fetch_by_key = bulk.fetch_by_key
+        looked_up = []
+
+        def missed_by_the_lookup(queryset, key, values):
+            # As if another request created the work load since.
+            if not looked_up:
+                looked_up.append(key)
+                return {}
+            return fetch_by_key(queryset, key, values)
+
+        items = [
+            {
+                'ip': self.ip,
+                'credentials': self.credentials_1.pk,
+                'storage': [self.mount_point_1.pk]
+            },
+            {
+                'ip': '10.0.9.9',
+                'credentials': self.credentials_1.pk,
+                'storage': [self.mount_point_1.pk]
+            }
+        ]
+        for data, status_code in ((items, 200), (items[:1], 400)):
+            looked_up.clear()
+            with mock.patch.object(bulk, 'fetch_by_key', missed_by_the_lookup):
+                response = self.client.post(
+                    '/api/v1/work_loads/bulk/',
+                    data=data,
+                    content_type='application/json',
+                    HTTP_AUTHORIZATION=f'Bearer {self.token}'
+                )
+            self.assertEqual(response.status_code, status_code)
+            self.assertEqual(response.json()['errors'], [{
+                'index': 0,
+                'errors': {
+                    'ip': [f'{self.ip} conflicts with another work load.']
+                }
+            }])
+        self.assertEqual(
+            WorkLoad.objects.get(ip='10.0.9.9').storage.get(),
+            self.mount_point_1
+        )
+        self.assertEqual(
+            list(self.work_load.storage.all()),
+            [self.mount_point_1, self.mount_point_2]
+        )
+
+    def test_bulk_work_loads(self):
+        items = [
+            {
+                'ip': f'10.0.0.{number}',
+                'credentials': self.credentials_1.pk,
+                'storage': [self.mount_point_1.pk, self.mount_point_3.pk]
+            }
+            for number in range(50)
+        ]
+        items.append({
+            'ip': self.ip,
+            'credentials': self.credentials_2.pk,
+            'storage': [self.mount_point_3.pk]
+        })
+        items.append({
+            'ip': '10.0.1.1',
+            'credentials': 100,
+            'storage': [self.mount_point_1.pk, 100]
+        })
+        with self.assertNumQueries(14):
+            response_bulk_work_loads = self.client.post(
+                '/api/v1/work_loads/bulk/',
+                data=items,
+                content_type='application/json',
+                HTTP_AUTHORIZATION=f'Bearer {self.token}'
+            )
+        self.assertEqual(response_bulk_work_loads.status_code, 200)
+        result = response_bulk_work_loads.json()
+        self.assertEqual(result['created'], 50)
+        self.assertEqual(result['updated'], 1)
+        self.assertEqual(result['errors'], [{
+            'index': 51,
+            'errors': {
+                'credentials': ['100 credentials does not exist'],
+                'storage': ['100 storage does not exist']
+            }
+        }])
+        self.work_load.refresh_from_db()
+        self.assertEqual(self.work_load.credentials, self.credentials_2)
+        self.assertEqual(
+            list(self.work_load.storage.all()),
+            [self.mount_point_3]
+        )
+        self.assertEqual(
+            WorkLoad.objects.get(ip='10.0.0.7').storage.count(),
+            2
+        )
+        response_bulk_work_loads = self.client.post(
+            '/api/v1/work_loads/bulk/',
+            data={'ip': '10.0.0.1'},
+            content_type='application/json',
+            HTTP_AUTHORIZATION=f'Bearer {self.token}'
+        )
+        self.assertEqual(response_bulk_work_loads.status_code, 400)
+
+    def test_bulk_malformed_items_are_item_errors(self):
+        response_bulk_work_loads = self.client.post(
+            '/api/v1/work_loads/bulk/',
+            data=[
+                {
+                    'ip': '10.0.2.1',
+                    'credentials': self.credentials_1.pk,
+                    'storage': {'id': self.mount_point_1.pk}
+                },
+                {
+                    'ip': '10.0.2.2',
+                    'credentials': self.credentials_1.pk,
+                    'storage': [[self.mount_point_1.pk]]
+                },
+                {
+                    'ip': '10.0.2.3',
+                    'credentials': 2 ** 70,
+                    'storage': [2 ** 70]
+                },
+                {
+                    'ip': '10.0.2.4',
+                    'credentials': self.credentials_1.pk,
+                    'storage': [self.mount_point_1.pk]
+                }
+            ],
+            content_type='application/json',
+            HTTP_AUTHORIZATION=f'Bearer {self.token}'
+        )
+        self.assertEqual(response_bulk_work_loads.status_code, 200)
+        result = response_bulk_work_loads.json()
+        self.assertEqual(result['created'], 1)
+        self.assertEqual(result['errors'], [
+            {
+                'index': 0,
+                'errors': {'storage': ['Expected a list of mount point ids.']}
+            },
+            {
+                'index': 1,
+                'errors': {'storage': ['Expected a list of mount point ids.']}
+            },
+            {
+                'index': 2,
+                'errors': {
+                    'credentials': [f'{2 ** 70} credentials does not exist'],
+                    'storage': [f'{2 ** 70} storage does not exist']
+                }
+            }
+        ])
+        response_bulk_mount_points = self.client.post(
+            '/api/v1/mount_points/bulk/',
+            data=[
+                {
+                    'id': 2 ** 70,
+                    'mount_point_name': 'huge',
+                    'total_size_of_the_volume': 10
+                },
+                {
+                    'id': {'pk': self.mount_point_1.pk},
+                    'mount_point_name': 'object',
+                    'total_size_of_the_volume': 10
+                }
+            ],
+            content_type='application/json',
+            HTTP_AUTHORIZATION=f'Bearer {self.token}'
+        )
+        self.assertEqual(response_bulk_mount_points.status_code, 400)
+        self.assertEqual(
+            [
+                error['errors']['id']
+                for error in response_bulk_mount_points.json()['errors']
+            ],
+            [
+                [f'{2 ** 70} mount point does not exist'],
+                [f"{{'pk': {self.mount_point_1.pk}}} mount point does not "
+                 'exist']
+            ]
+        )
+
+
+class WorkLoadIpTestCase(SetUpTestCase, TestCase):
+
+    def setUp(self):
+        super().setUp()
+        for ip in ('10.0.0.1', '10.0.200.7', '10.1.0.1', '10.10.0.1',
+                   '192.168.1.1', '::1', '12345-host'):
+            WorkLoad.objects.create(ip=ip)
+
+    def get_ips(self, query):
+        response = self.client.get(
+            f'/api/v1/work_loads/?{query}',
+            HTTP_AUTHORIZATION=f'Bearer {self.token}'
+        )
+        self.assertEqual(response.status_code, 200)
+        return [
+            work_load['ip'] for work_load in response.json()['results']
+        ]
+
+    def test_cidr(self):
+        self.assertEqual(
+            self.get_ips('cidr=10.0.0.0/16'),
+            ['10.0.0.1', '10.0.200.7']
+        )
+        self.assertEqual(self.get_ips('cidr=::/120'), ['::1'])
+        response = self.client.get(
+            '/api/v1/work_loads/?cidr=10.0.0.0/33',
+            HTTP_AUTHORIZATION=f'Bearer {self.token}'
+        )
+        self.assertEqual(response.status_code, 400)
+
+    def test_ip_prefix(self):
+        self.assertEqual(
+            self.get_ips('ip_prefix=10.1'),
+            ['10.1.0.1', '10.10.0.1']
+        )
+        self.assertEqual(
+            self.get_ips('ip_prefix=10.0.2'),
+            ['10.0.200.7']
+        )
+        self.assertEqual(self.get_ips(f'ip_prefix={self.ip[:5]}'), [self.ip])
+        self.assertEqual(self.get_ips('ip_prefix=12345'), ['12345-host'])
+
+    def test_unique_source_ip(self):
+        with self.assertRaises(IntegrityError), transaction.atomic():
+            WorkLoad.objects.create(ip='10.0.0.1')
+        WorkLoad.objects.create(
+            ip='10.0.0.1',
+            migrated_from=WorkLoad.objects.get(ip='10.0.0.1')
+        )
+        self.assertEqual(WorkLoad.objects.filter(ip='10.0.0.1').count(), 2)
+
+    def test_ip_is_normalized(self):
+        for ip in (' 10.0.0.1 ', '::ffff:10.0.0.1', '0:0::1'):
+            with self.assertRaises(IntegrityError), transaction.atomic():
+                WorkLoad.objects.create(ip=ip)
+        work_load = WorkLoad.objects.create(ip='2001:DB8::0001')
+        self.assertEqual(work_load.ip, '2001:db8::1')
+        self.assertEqual(work_load.ip_key, ip_key('2001:db8::1'))
+        response = self.client.post(
+            '/api/v1/work_loads/',
+            {
+                'ip': '::FFFF:192.168.1.1',
+                'credentials': self.credentials_1.pk,
+                'storage': [self.mount_point_1.pk]
+            },
+            HTTP_AUTHORIZATION=f'Bearer {self.token}'
+        )
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(response.json(), {'ip': ['This field is unique.']})
+        response = self.client.post(
+            '/api/v1/work_loads/bulk/',
+            data=[{
+                'ip': ' 12345-host ',
+                'credentials': self.credentials_1.pk,
+                'storage': [self.mount_point_1.pk]
+            }],
+            content_type='application/json',
+            HTTP_AUTHORIZATION=f'Bearer {self.token}'
+        )
+        self.assertEqual(response.json()['updated'], 1)
+
+
+class PollMigrationStatesTestCase(SetUpTestCase, TestCase):
+
+    def poll(self, query):
+        return self.client.get(
+            f'/api/v1/migrations/state/poll/?{query}',
+            HTTP_AUTHORIZATION=f'Bearer {self.token}'
+        )
+
+    def test_poll_migration_states(self):
+        response = self.poll(f'ids={self.migration.pk}')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(
+            response.json()['migrations'],
+            [{'id': self.migration.pk, 'migration state': 'not_started'}]
+        )
+        since = response.json()['since']
+        response = self.poll(f'ids={self.migration.pk}&since={since}'
+                             '&timeout=0.01')
+        self.assertEqual(response.json()['since'], since)
+        Migration.transition(
+            self.migration.pk,
+            RUNNABLE_STATES,
+            MigrationState.QUEUED
+        )
+        response = self.poll(f'ids={self.migration.pk}&since={since}')
+        self.assertNotEqual(response.json()['since'], since)
+        self.assertEqual(
+            response.json()['migrations'][0]['migration state'],
+            'queued'
+        )
+
+    def test_poll_sees_changes_of_other_processes(self):
+        state_cache.get_states([self.migration.pk])
+        # Another process changes the state, this one is not told.
+        Migration.objects.filter(pk=self.migration.pk).update(
+            migration_state=MigrationState.ERROR
+        )
+        response = self.poll(f'ids={self.migration.pk}&timeout=0.01')
+        self.assertEqual(
+            response.json()['migrations'][0]['migration state'],
+            'error'
+        )
+
+    def test_poll_migration_states_errors(self):
+        self.assertEqual(self.poll('').status_code, 400)
+        self.assertEqual(self.poll('ids=x').status_code, 400)
+        for query in (f'ids={2 ** 70}', f'batch={2 ** 70}'):
+            response = self.poll(query)
+            self.assertEqual(response.status_code, 400)
+            self.assertIn('ids', response.json())
+        for timeout in ('nan', 'inf', '-1', '0', 'x'):
+            response = self.poll(f'ids={self.migration.pk}&timeout={timeout}')
+            self.assertEqual(response.status_code, 400)
+            self.assertIn('timeout', response.json())
+
+
+class MigrationStateStreamTestCase(TransactionTestCase):
+
+    def setUp(self):
+        self.user = User.objects.create_user(username='stream')
+        self.token = str(AccessToken.for_user(self.user))
+        self.migration = Migration.objects.create()
+        self.application = MigrationStateStream(mock.Mock())
+
+    def communicator(self, query):
+        return ApplicationCommunicator(self.application, {
+            'type': 'http',
+            'path': STREAM_PATH,
+            'query_string': query.encode(),
+            'headers': []
+        })
+
+    def test_stream(self):
+        async def stream():
+            communicator = self.communicator(
+                f'ids={self.migration.pk}&token={self.token}'
+            )
+            await communicator.send_input({'type': 'http.request'})
+            start = await communicator.receive_output(timeout=5)
+            self.assertEqual(start['status'], 200)
+            body = await communicator.receive_output(timeout=5)
+            self.assertIn(b'not_started', body['body'])
+            await sync_to_async(Migration.transition)(
+                self.migration.pk,
+                RUNNABLE_STATES,
+                MigrationState.QUEUED
+            )
+            body = await communicator.receive_output(timeout=5)
+            self.assertIn(b'"migration state": "queued"', body['body'])
+            await communicator.send_input({'type': 'http.disconnect'})
+            body = await communicator.receive_output(timeout=5)
+            self.assertFalse(body.get('more_body'))
+
+        async_to_sync(stream)()
+
+    def test_stream_without_token(self):
+        async def stream():
+            communicator = self.communicator(f'ids={self.migration.pk}')
+            await communicator.send_input({'type': 'http.request'})
+            start = await communicator.receive_output(timeout=5)
+            self.assertEqual(start['status'], 401)
+
+        async_to_sync(stream)()
+
+
+class MigrationStatesTestCase(SetUpTestCase, TestCase):
+
+    def setUp(self):
+        super().setUp()
+        state_cache.get_cache().clear()
+        state_cache.reset_stats()
+
+    def get_states(self, query):
+        response = self.client.get(
+            f'/api/v1/migrations/state/?{query}',
+            HTTP_AUTHORIZATION=f'Bearer {self.token}'
+        )
+        self.assertEqual(response.status_code, 200)
+        return response.json()
+
+    def test_migration_states_are_cached(self):
+        migration = Migration.objects.create()
+        query = f'ids={self.migration.pk},{migration.pk},100'
+        self.assertEqual(self.get_states(query), {
+            'migrations': [
+                {'id': self.migration.pk, 'migration state': 'not_started'},
+                {'id': migration.pk, 'migration state': 'not_started'}
+            ],
+            'missing': [100]
+        })
+        with self.assertNumQueries(2):
+            self.get_states(query)
+        Migration.transition(
+            migration.pk,
+            RUNNABLE_STATES,
+            MigrationState.QUEUED
+        )
+        self.assertEqual(
+            self.get_states(query)['migrations'][1]['migration state'],
+            'queued'
+        )
+        response = self.client.get(
+            '/api/v1/migrations/state/cache/',
+            HTTP_AUTHORIZATION=f'Bearer {self.token}'
+        )
+        self.assertEqual(response.json()['hits'], 3)
+        self.assertEqual(response.json()['misses'], 6)
+
+    def test_invalid_ids_are_refused(self):
+        for query, error in (
+            (f'ids={2 ** 70}', f'{2 ** 70} is not a valid id'),
+            ('ids=1,x', 'x is not a valid id'),
+            (f'batch={2 ** 70}', f'{2 ** 70} is not a valid batch id'),
+            ('batch=0', '0 is not a valid batch id')
+        ):
+            response = self.client.get(
+                f'/api/v1/migrations/state/?{query}',
+                HTTP_AUTHORIZATION=f'Bearer {self.token}'
+            )
+            self.assertEqual(response.status_code, 400)
+            self.assertEqual(response.json(), {'ids': [error]})
+
+    def test_active_states_are_not_cached(self):
+        Migration.transition(
+            self.migration.pk,
+            RUNNABLE_STATES,
+            MigrationState.QUEUED
+        )
+        self.get_states(f'ids={self.migration.pk}')
+        Migration.objects.filter(pk=self.migration.pk).update(
+            migration_state=MigrationState.RUNNING
+        )
+        self.assertEqual(
+            self.get_states(f'ids={self.migration.pk}')['migrations'],
+            [{'id': self.migration.pk, 'migration state': 'running'}]
+        )
+
+    def test_invalidation_during_load_is_not_overwritten(self):
+        load_states = state_cache.load_states
+
+        def load_then_transition(migration_ids):
+            states = load_states(migration_ids)
+            Migration.transition(
+                self.migration.pk,
+                RUNNABLE_STATES,
+                MigrationState.QUEUED
+            )
+            Migration.transition(
+                self.migration.pk,
+                [MigrationState.QUEUED],
+                MigrationState.ERROR
+            )
+            return states
+
+        with mock.patch.object(state_cache, 'load_states',
+                               load_then_transition):
+            self.assertEqual(
+                state_cache.get_states([self.migration.pk]),
+                {self.migration.pk: 'not_started'}
+            )
+        self.assertEqual(
+            state_cache.get_states([self.migration.pk]),
+            {self.migration.pk: 'error'}
+        )
+
+    def test_save_invalidates_state(self):
+        self.get_states(f'ids={self.migration.pk}')
+        Migration.objects.filter(pk=self.migration.pk).update(
+            migration_state=MigrationState.ERROR
+        )
+        self.migration.save()
+        self.assertEqual(
+            self.get_states(f'batch=&ids={self.migration.pk}'),
+            {
+                'migrations': [
+                    {'id': self.migration.pk, 'migration state': 'error'}
+                ],
+                'missing': []
+            }
+        )
+
+
+class VersionsTestCase(TransactionTestCase):
+
+    def test_bump_waits_for_the_commit(self):
+        with transaction.atomic():
+            versions.bump(Credentials)
+            self.assertEqual(versions.get_versions([Credentials]), ('',))
+        self.assertNotEqual(versions.get_versions([Credentials]), ('',))
+
+    def test_lost_lease_keeps_the_version(self):
+        migration = Migration.objects.create()
+        version = versions.get_versions([Migration])
+        self.assertEqual(Migration.heartbeat(migration.pk, 'worker', 60), 0)
+        self.assertEqual(Migration.release_lease(migration.pk, 'worker'), 0)
+        self.assertEqual(versions.get_versions([Migration]), version)
+
+
+class ConditionalGetTestCase(SetUpTestCase, TestCase):
+
+    def setUp(self):
+        super().setUp()
+        caching.responses.clear()
+
+    def get(self, url, **headers):
+        return self.client.get(
+            url,
+            HTTP_AUTHORIZATION=f'Bearer {self.token}',
+            **headers
+        )
+
+    def test_not_modified(self):
+        response = self.get('/api/v1/migrations/')
+        etag = response['ETag']
+        with self.assertNumQueries(2):
+            response = self.get(
+                '/api/v1/migrations/',
+                HTTP_IF_NONE_MATCH=etag
+            )
+        self.assertEqual(response.status_code, 304)
+        self.assertEqual(response['ETag'], etag)
+        self.assertEqual(response.content, b'')
+
+    def test_cached_payload(self):
+        content = self.get('/api/v1/work_loads/1/').content
+        with self.assertNumQueries(2):
+            response = self.get('/api/v1/work_loads/1/')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.content, content)
+
+    def test_related_change_changes_etag(self):
+        etag = self.get('/api/v1/migrations/')['ETag']
+        self.credentials_1.domain = uuid.uuid4().hex
+        self.credentials_1.save()
+        response = self.get('/api/v1/migrations/', HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertNotEqual(response['ETag'], etag)
+        self.assertIn(self.credentials_1.domain.encode(), response.content)
+        self.assertEqual(
+            self.get('/api/v1/mount_points/', HTTP_IF_NONE_MATCH=etag)
+            .status_code,
+            200
+        )
+
+    def test_state_transition_changes_etag(self):
+        etag = self.get('/api/v1/migrations/1/')['ETag']
+        Migration.transition(
+            self.migration.pk,
+            RUNNABLE_STATES,
+            MigrationState.QUEUED
+        )
+        response = self.get('/api/v1/migrations/1/', HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json()['migration_state'], 'queued')
+
+    def test_errors_are_not_cached(self):
+        self.assertEqual(self.get('/api/v1/migrations/100/').status_code, 404)
+        self.assertEqual(len(caching.responses), 0)
+
+    @override_settings(API_RESPONSE_CACHE_SIZE=2)
+    def test_cache_is_bounded(self):
+        for url in ['/api/v1/credentials/', '/api/v1/mount_points/',
+                    '/api/v1/credentials/1/', '/api/v1/mount_points/1/']:
+            self.get(url)
+        self.assertEqual(len(caching.responses), 2)
+
+
+class ExportTestCase(SetUpTestCase, TestCase):
+
+    def export(self, resource, **headers):
+        response = self.client.get(
+            f'/api/v1/{resource}/export.ndjson',
+            HTTP_AUTHORIZATION=f'Bearer {self.token}',
+            **headers
+        )
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(response.streaming)
+        self.assertEqual(response['Content-Type'], 'application/x-ndjson')
+        return response
+
+    def rows(self, response):
+        return [
+            json.loads(line)
+            for line in b''.join(response.streaming_content).splitlines()
+        ]
+
+    def test_export_migrations(self):
+        rows = self.rows(self.export('migrations'))
+        self.assertEqual(len(rows), 1)
+        self.assertEqual(rows[0]['id'], self.migration.pk)
+        self.assertEqual(
+            rows[0]['source_of_type']['credentials']['username'],
+            self.username_1
+        )
+        self.assertEqual(
+            [mount_point['id'] for mount_point in
+             rows[0]['selected_mount_points']],
+            [self.mount_point_2.pk]
+        )
+
+    def test_slow_export_does_not_block_sync_views(self):
+        started = threading.Event()
+        released = threading.Event()
+
+        def slow_export(environ, start_response):
+            started.set()
+            start_response('200 OK', [('Content-Type', 'application/json')])
+            released.wait(5)
+            return [b'{}\n']
+
+        async def export():
+            communicator = ApplicationCommunicator(
+                ExportApplication(slow_export),
+                {
+                    'type': 'http',
+                    'http_version': '1.1',
+                    'method': 'GET',
+                    'path': '/api/v1/migrations/export.ndjson',
+                    'query_string': b'',
+                    'headers': []
+                }
+            )
+            await communicator.send_input({'type': 'http.request'})
+            for _ in range(500):
+                if started.is_set():
+                    break
+                await asyncio.sleep(0.01)
+            # Another sync view runs on the shared thread meanwhile.
+            view = asyncio.ensure_future(sync_to_async(lambda: 'view')())
+            done, pending = await asyncio.wait([view], timeout=1)
+            released.set()
+            start = await communicator.receive_output(timeout=5)
+            self.assertEqual(start['status'], 200)
+            body = await communicator.receive_output(timeout=5)
+            self.assertEqual(body['body'], b'{}\n')
+            await communicator.wait(timeout=5)
+            self.assertFalse(pending)
+
+        async_to_sync(export)()
+
+    @override_settings(API_EXPORT_CHUNK_SIZE=2)
+    def test_export_in_chunks(self):
+        for number in range(5):
+            MountPoint.objects.create(
+                mount_point_name=uuid.uuid4().hex,
+                total_size_of_the_volume=number
+            )
+        response = self.export(
+            'mount_points',
+            HTTP_ACCEPT='application/x-ndjson'
+        )
+        with self.assertNumQueries(5):
+            rows = self.rows(response)
+        self.assertEqual(
+            [row['id'] for row in rows],
+            list(MountPoint.objects.values_list('pk', flat=True))
+        )
+
+    def test_export_is_filtered(self):
+        WorkLoad.objects.create(ip='10.0.0.1', credentials=self.credentials_1)
+        rows = self.rows(
+            self.client.get(
+                '/api/v1/work_loads/export.ndjson?cidr=10.0.0.0/24',
+                HTTP_AUTHORIZATION=f'Bearer {self.token}'
+            )
+        )
+        self.assertEqual([row['ip'] for row in rows], ['10.0.0.1'])
+
+    def test_export_requires_authentication(self):
+        response = self.client.get('/api/v1/credentials/export.ndjson')
+        self.assertEqual(response.status_code, 401)
+
+
+class ImportInventoryTestCase(TestCase):
+    records = [
+        {'type': 'credentials', 'id': 'c1', 'username': 'user',
+         'password': 'password', 'domain': 'domain'},
+        {'type': 'mount_point', 'id': 'm1', 'mount_point_name': 'c:',
+         'total_size_of_the_volume': 10},
+        {'type': 'mount_point', 'id': 'm2', 'mount_point_name': 'd:',
+         'total_size_of_the_volume': 20},
+        {'type': 'work_load', 'id': 'w1', 'ip': '10.0.0.1',
+         'credentials': 'c1', 'storage': ['m1', 'm2']},
+        {'type': 'migration_target', 'id': 't1', 'cloud_type': 'azure',
+         'cloud_credentials': 'c1'},
+        {'type': 'migration', 'source_of_type': 'w1',
+         'migration_target': 't1', 'selected_mount_points': ['m2']},
+    ]
+
+    def import_inventory(self, content, suffix='.ndjson', **options):
+        with tempfile.NamedTemporaryFile('w', suffix=suffix) as file:
+            file.write(content)
+            file.flush()
+            stdout, stderr = io.StringIO(), io.StringIO()
+            call_command(
+                'import_inventory',
+                file.name,
+                stdout=stdout,
+                stderr=stderr,
+                **options
+            )
+        return stdout.getvalue(), stderr.getvalue()
+
+    def ndjson(self, records):
+        return ''.join(f'{json.dumps(record)}\n' for record in records)
+
+    def assert_imported(self):
+        migration = Migration.objects.get()
+        self.assertEqual(migration.source_of_type.ip, '10.0.0.1')
+        self.assertEqual(
+            migration.source_of_type.ip_key,
+            ip_key('10.0.0.1')
+        )
+        self.assertEqual(
+            sorted(migration.source_of_type.storage.values_list(
+                'mount_point_name', flat=True
+            )),
+            ['c:', 'd:']
+        )
+        self.assertEqual(
+            list(migration.selected_mount_points.values_list(
+                'mount_point_name', flat=True
+            )),
+            ['d:']
+        )
+        self.assertEqual(migration.migration_target.cloud_type, 'azure')
+        self.assertEqual(
+            migration.migration_target.cloud_credentials.domain,
+            'domain'
+        )
+
+    def test_import_ndjson(self):
+        stdout, stderr = self.import_inventory(
+            self.ndjson(self.records),
+            batch_size=2
+        )
+        self.assert_imported()
+        self.assertIn('imported 6 rows', stdout)
+        self.assertEqual(stderr, '')
+
+    def test_import_csv(self):
+        content = (
+            'type,id,username,password,domain,mount_point_name,'
+            'total_size_of_the_volume,ip,credentials,storage,cloud_type,'
+            'cloud_credentials,source_of_type,migration_target,'
+            'selected_mount_points\n'
+            'credentials,c1,user,password,domain,,,,,,,,,,\n'
+            'mount_point,m1,,,,c:,10,,,,,,,,\n'
+            'mount_point,m2,,,,d:,20,,,,,,,,\n'
+            'work_load,w1,,,,,,10.0.0.1,c1,m1;m2,,,,,\n'
+            'migration_target,t1,,,,,,,,,azure,c1,,,\n'
+            'migration,,,,,,,,,,,,w1,t1,m2\n'
+        )
+        self.import_inventory(content, suffix='.csv')
+        self.assert_imported()
+
+    def test_errors_are_reported(self):
+        stdout, stderr = self.import_inventory(self.ndjson([
+            *self.records[:4],
+            {'type': 'work_load', 'id': 'w2', 'ip': '10.0.0.1',
+             'credentials': 'c1', 'storage': ['m1']},
+            {'type': 'work_load', 'id': 'w3', 'ip': '10.0.0.3',
+             'credentials': 'c2', 'storage': ['m1']},
+            {'type': 'mount_point', 'mount_point_name': 'e:'},
+            {'type': 'unknown'},
+            {'type': 'mount_point', 'mount_point_name': 'f:',
+             'total_size_of_the_volume': 2 ** 63},
+        ]) + '{\n')
+        self.assertIn('line 5: duplicate ip 10.0.0.1', stderr)
+        self.assertIn('line 6: credentials c2 was not imported', stderr)
+        self.assertIn('line 7: total_size_of_the_volume is required', stderr)
+        self.assertIn('line 8: unknown record type unknown', stderr)
+        self.assertIn(
+            f'line 9: {2 ** 63} is not a valid size',
+            stderr
+        )
+        self.assertIn('line 10: invalid json', stderr)
+        self.assertIn('6 errors', stdout)
+        self.assertEqual(WorkLoad.objects.count(), 1)
+
+    def test_existing_work_loads_are_reused(self):
+        self.import_inventory(self.ndjson(self.records[:4]))
+        self.import_inventory(self.ndjson(self.records))
+        self.assertEqual(WorkLoad.objects.count(), 1)
+        self.assertEqual(
+            Migration.objects.get().source_of_type,
+            WorkLoad.objects.get()
+        )
+
+    def test_run_again_duplicates_other_records(self):
+        self.import_inventory(self.ndjson(self.records))
+        self.import_inventory(self.ndjson(self.records))
+        self.assertEqual(WorkLoad.objects.count(), 1)
+        self.assertEqual(Credentials.objects.count(), 2)
+        self.assertEqual(MountPoint.objects.count(), 4)
+        self.assertEqual(Migration.objects.count(), 2)
+
+
+class BenchApiTestCase(TransactionTestCase):
+
+    def test_percentile(self):
+        self.assertEqual(percentile(list(range(1, 101)), 50), 50)
+        self.assertEqual(percentile(list(range(1, 101)), 99), 99)
+        self.assertEqual(percentile([3, 1, 2], 95), 3)
+        self.assertIsNone(percentile([], 50))
+
+    def test_failed_requests_are_errors(self):
+        transport = mock.Mock()
+        transport.request.side_effect = ConnectionRefusedError
+        result = run_route(
+            transport,
+            Route('credentials:list', 'GET', lambda number: (
+                '/api/v1/credentials/', {}
+            )),
+            mock.Mock(token=''),
+            requests=5,
+            concurrency=2
+        )
+        self.assertEqual(result['errors'], 5)
+        self.assertEqual(result['requests'], 0)
+        self.assertIsNone(result['p99'])
+        stdout = io.StringIO()
+        bench_api.Command(stdout=stdout).write_route(result)
+        self.assertEqual(
+            stdout.getvalue().split(),
+            ['credentials:list', '-', '-', '-', '0.0', '-', '5']
+        )
+
+    def test_bench_api(self):
+        with tempfile.NamedTemporaryFile('r', suffix='.json') as output:
+            call_command(
+                'bench_api',
+                requests=3,
+                concurrency=1,
+                routes='credentials:list,work_loads:create,migrations:run',
+                output=output.name,
+                stdout=io.StringIO()
+            )
+            results = json.load(output)
+        self.assertEqual(
+            [route['route'] for route in results['routes']],
+            ['credentials:list', 'work_loads:create', 'migrations:run']
+        )
+        for route in results['routes']:
+            self.assertEqual(route['requests'], 3)
+            self.assertEqual(route['errors'], 0)
+            self.assertGreater(route['queries'], 0)
+            self.assertLessEqual(route['p50'], route['p99'])
+        self.assertEqual(Migration.objects.count(), 0)
+        self.assertEqual(WorkLoad.objects.count(), 0)
+
+
+class GenerateInventoryTestCase(TestCase):
+
+    def test_generate_inventory(self):
+        call_command(
+            'generate_inventory',
+            workloads=3,
+            mount_points_per_workload=4,
+            migrations=5,
+            stdout=io.StringIO()
+        )
+        self.assertEqual(Credentials.objects.count(), 3)
+        self.assertEqual(MountPoint.objects.count(), 12)
+        self.assertEqual(
+            list(WorkLoad.objects.values_list('ip', flat=True)),
+            ['10.0.0.1', '10.0.0.2', '10.0.0.3']
+        )
+        self.assertEqual(MigrationTarget.objects.count(), 5)
+        migration = Migration.objects.last()
+        self.assertEqual(migration.source_of_type.ip, '10.0.0.2')
+        self.assertEqual(migration.source_of_type.storage.count(), 4)
+        self.assertEqual(migration.selected_mount_points.count(), 2)
+
+    def test_existing_work_loads_are_refused(self):
+        generate_inventory(3, 2, 3)
+        with self.assertRaisesMessage(
+            CommandError,
+            'work loads from 10.0.0.2 to 10.0.0.4 already exist'
+        ):
+            call_command(
+                'generate_inventory',
+                workloads=3,
+                mount_points_per_workload=2,
+                migrations=3,
+                start_ip='10.0.0.2',
+                stdout=io.StringIO()
+            )
+        generate_inventory(3, 2, 3, start_ip='10.0.0.4')
+        self.assertEqual(WorkLoad.objects.count(), 6)
+        for migration in Migration.objects.all():
+            self.assertTrue(set(migration.selected_mount_points.all()) <= set(
+                migration.source_of_type.storage.all()
+            ))
+
+    def test_bench_hot_paths(self):
+        with tempfile.TemporaryDirectory() as directory:
+            baseline = f'{directory}/hot_paths.json'
+            options = {
+                'workloads': 2,
+                'migrations': 2,
+                'repeat': 2,
+                'baseline': baseline,
+                'stdout': io.StringIO()
+            }
+            call_command('bench_hot_paths', save_baseline=True, **options)
+            with open(baseline) as file:
+                self.assertEqual(
+                    set(json.load(file)['hot paths']),
+                    {'check_mount_point', 'check_object',
+                     'Migration.check_mount_point', 'WorkLoadSerializer',
+                     'MigrationSerializer', 'run_migration'}
+                )
+            call_command('bench_hot_paths', threshold=10 ** 6, **options)
+        self.assertEqual(WorkLoad.objects.count(), 0)
+
+    def test_find_regressions(self):
+        self.assertEqual(
+            find_regressions(
+                {'fast': {'min': 100}, 'slow': {'min': 150},
+                 'new': {'min': 1}},
+                {'fast': {'min': 100}, 'slow': {'min': 100}},
+                20
+            ),
+            {'slow': 50.0}
+        )
+
+
+class RequestTimingTestCase(SetUpTestCase, TestCase):
+
+    def setUp(self):
+        super().setUp()
+        caching.responses.clear()
+
+    def get(self, url):
+        return self.client.get(
+            url,
+            HTTP_AUTHORIZATION=f'Bearer {self.token}'
+        )
+
+    def test_server_timing(self):
+        with self.assertLogs('api.timing', 'INFO') as logs:
+            response = self.get('/api/v1/migrations/')
+        metrics = {
+            metric.split(';')[0]: metric
+            for metric in response['Server-Timing'].split(', ')
+        }
+        self.assertEqual(
+            set(metrics),
+            {'total', 'db', 'serializer'}
+        )
+        self.assertIn('desc="5 queries"', metrics['db'])
+        record = logs.records[0]
+        self.assertEqual(record.view, 'MigrationViewSet.list')
+        self.assertEqual(record.queries, 5)
+        self.assertEqual(record.status, 200)
+        self.assertGreater(record.serializer_ms, 0)
+        self.assertIn('view=MigrationViewSet.list', record.getMessage())
+
+    def test_serializer_is_timed_once(self):
+        for number in range(3):
+            Migration.objects.create(
+                source_of_type=self.work_load,
+                migration_target=self.migration_target
+            )
+        with mock.patch.object(timing, 'span', wraps=timing.span) as span:
+            response = self.get('/api/v1/migrations/')
+        self.assertEqual(len(response.json()['results']), 4)
+        self.assertEqual(span.call_args_list, [mock.call('serializer')])
+
+    def test_function_view_name(self):
+        with self.assertLogs('api.timing', 'INFO') as logs:
+            self.get(f'/api/v1/migrations/{self.migration.pk}/state/')
+        self.assertEqual(logs.records[0].view, 'get_migration_state')
+
+
+class SlowQueryTestCase(SetUpTestCase, TestCase):
+
+    def setUp(self):
+        super().setUp()
+        caching.responses.clear()
+        self.log = tempfile.NamedTemporaryFile('r', suffix='.log')
+        self.addCleanup(self.log.close)
+
+    def test_normalize(self):
+        self.assertEqual(
+            normalize(
+                "SELECT * FROM api_workload WHERE ip = '10.0.0.1' AND "
+                "id IN (%s, %s,\n %s) LIMIT 21"
+            ),
+            'SELECT * FROM api_workload WHERE ip = ? AND id IN (...) LIMIT ?'
+        )
+
+    def test_slow_queries_are_logged(self):
+        with override_settings(
+            SLOW_QUERY_THRESHOLD_MS=1e-9,
+            SLOW_QUERY_LOG=self.log.name
+        ), self.assertLogs('api.slow_queries', 'WARNING'):
+            response = self.client.get(
+                f'/api/v1/work_loads/?ip_prefix={self.ip[:5]}',
+                HTTP_AUTHORIZATION=f'Bearer {self.token}'
+            )
+        self.assertEqual(response.status_code, 200)
+        entries = [json.loads(line) for line in self.log]
+        work_load_queries = [
+            entry for entry in entries
+            if entry['sql'].startswith('SELECT')
+            and 'FROM "api_workload"' in entry['sql']
+        ]
+        self.assertEqual(
+            work_load_queries[0]['view'],
+            'WorkLoadViewSet.list'
+        )
+        self.assertIn('api_workload', work_load_queries[0]['plan'])
+        stdout = io.StringIO()
+        call_command(
+            'slow_queries',
+            log=self.log.name,
+            top=3,
+            plans=True,
+            stdout=stdout
+        )
+        self.assertEqual(stdout.getvalue().count(' count='), 3)
+        self.assertIn('WorkLoadViewSet.list', stdout.getvalue())
+        self.assertIn('plan: ', stdout.getvalue())
+
+    def test_slow_queries_need_no_file(self):
+        with override_settings(SLOW_QUERY_THRESHOLD_MS=1e-9), \
+                mock.patch('api.slow_queries.open', create=True) as open_log, \
+                self.assertLogs('api.slow_queries', 'WARNING'):
+            self.client.get(
+                '/api/v1/work_loads/',
+                HTTP_AUTHORIZATION=f'Bearer {self.token}'
+            )
+        open_log.assert_not_called()
+        with self.assertRaisesMessage(CommandError, 'SLOW_QUERY_LOG'):
+            call_command('slow_queries', stdout=io.StringIO())
+
+
+class MetricsTestCase(SetUpTestCase, TestCase):
+
+    def setUp(self):
+        super().setUp()
+        caching.responses.clear()
+        for metric in metrics.REGISTRY:
+            metric.clear()
+
+    def assertCountsMatch(self):
+        self.assertEqual(
+            {
+                key: count
+                for key, count in migration_counts.get_counts().items()
+                if count
+            },
+            migration_counts.grouped(Migration.objects.all())
+        )
+
+    def test_request_metrics(self):
+        self.client.get(
+            '/api/v1/migrations/',
+            HTTP_AUTHORIZATION=f'Bearer {self.token}'
+        )
+        response = self.client.get(
+            '/metrics',
+            HTTP_AUTHORIZATION=f'Bearer {self.token}'
+        )
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response['Content-Type'], metrics.CONTENT_TYPE)
+        content = response.content.decode()
+        self.assertIn(
+            'api_requests_total{route="/api/v1/migrations/",'
+            'method="GET",status="200"} 1',
+            content
+        )
+        self.assertIn(
+            'api_request_db_queries_bucket{route="/api/v1/migrations/",'
+            'method="GET",le="5"} 1',
+            content
+        )
+        self.assertIn(
+            'api_request_duration_seconds_count'
+            '{route="/api/v1/migrations/",method="GET"} 1',
+            content
+        )
+        self.assertIn('api_executor_pending_jobs 0', content)
+
+    @override_settings(
+        METRICS_TOKEN='scraper-token',
+        METRICS_ALLOWED_IPS=['10.0.0.9']
+    )
+    def test_metrics_require_access(self):
+        self.assertEqual(self.client.get('/metrics').status_code, 401)
+        self.assertEqual(self.client.get(
+            '/metrics',
+            HTTP_AUTHORIZATION='Bearer wrong-token'
+        ).status_code, 401)
+        self.assertEqual(self.client.get(
+            '/metrics',
+            HTTP_AUTHORIZATION='Bearer scraper-token'
+        ).status_code, 200)
+        self.assertEqual(self.client.get(
+            '/metrics',
+            REMOTE_ADDR='10.0.0.9'
+        ).status_code, 200)
+
+    def test_migration_counts_are_incremental(self):
+        self.assertCountsMatch()
+        Migration.transition(
+            self.migration.pk,
+            RUNNABLE_STATES,
+            MigrationState.QUEUED
+        )
+        self.assertCountsMatch()
+        Migration.transition(
+            self.migration.pk,
+            (MigrationState.QUEUED,),
+            MigrationState.ERROR
+        )
+        self.assertCountsMatch()
+        self.migration.refresh_from_db()
+        self.migration.migration_target = None
+        self.migration.save()
+        self.assertCountsMatch()
+        self.migration.migration_target = self.migration_target
+        self.migration.save()
+        self.assertCountsMatch()
+        self.migration_target.cloud_type = 'azure'
+        self.migration_target.save()
+        self.assertCountsMatch()
+        generate_inventory(2, 1, 3, start_ip='100.64.0.1')
+        self.assertCountsMatch()
+        self.migration_target.delete()
+        self.assertCountsMatch()
+        Migration.objects.filter(pk=self.migration.pk).delete()
+        self.assertCountsMatch()
+        with self.assertNumQueries(1):
+            content = metrics.exposition()
+        self.assertIn(
+            'api_migrations{state="error",cloud_type="azure"} 0',
+            content
+        )
+        self.assertEqual(
+            sum(
+                int(line.split()[-1]) for line in content.splitlines()
+                if line.startswith('api_migrations{')
+            ),
+            3
+        )
+
+    def test_rebuild_migration_counts(self):
+        MigrationCount.objects.all().delete()
+        out = io.StringIO()
+        call_command('rebuild_migration_counts', stdout=out)
+        self.assertEqual(
+            out.getvalue().split()[:3],
+            ['not_started', 'aws', '1']
+        )
+        self.assertCountsMatch()
+
+    @override_settings(MIGRATION_RUN_DELAY=0)
+    def test_run_duration(self):
+        Migration(pk=self.migration.pk).run_migration()
+        content = metrics.exposition()
+        self.assertIn(
+            'api_migration_run_duration_seconds_count{outcome="success"} 1',
+            content
+        )
+
+
+@override_settings(MIGRATION_RUN_DELAY=0)
+class RunProfileTestCase(SetUpTestCase, TestCase):
+
+    def run_with_profile(self, profile):
+        Migration.objects.filter(pk=self.migration.pk).update(profile=profile)
+        Migration(pk=self.migration.pk).run_migration()
+        return MigrationRunProfile.objects.filter(
+            migration=self.migration
+        ).last()
+
+    def test_not_profiled_by_default(self):
+        self.assertIsNone(self.run_with_profile(''))
+
+    def test_phases(self):
+        profile = self.run_with_profile(ProfileMode.PHASES)
+        self.assertEqual(profile.outcome, 'success')
+        self.assertEqual(
+            [phase['name'] for phase in profile.phases],
+            [
+                'mark_running',
+                'fetch',
+                'compare_storage',
+                'transfer',
+                'mark_success',
+                'create_destination',
+                'set_storage',
+                'save_target'
+            ]
+        )
+        self.assertEqual(profile.phases[1]['calls'], 2)
+        self.assertGreaterEqual(
+            profile.duration,
+            sum(phase['duration'] for phase in profile.phases)
+        )
+        self.assertEqual(profile.stats, '')
+
+    def test_tracemalloc(self):
+        profile = self.run_with_profile(ProfileMode.TRACEMALLOC)
+        self.assertTrue(all(
+            'allocated' in phase and 'peak' in phase
+            for phase in profile.phases
+            if phase['name'] not in ('mark_running', 'fetch')
+        ))
+
+    def test_overlapping_tracemalloc_runs(self):
+        first = profiling.RunProfiler(self.migration, ProfileMode.TRACEMALLOC)
+        second = profiling.RunProfiler(self.migration, ProfileMode.TRACEMALLOC)
+        with first:
+            with first.phase('alone'):
+                pass
+            second.__enter__()
+            with first.phase('overlapped'), second.phase('overlapped'):
+                pass
+            with first.phase('overlapped_at_start'):
+                second.__exit__(None, None, None)
+            self.assertTrue(tracemalloc.is_tracing())
+            with first.phase('overlapped_in_between'):
+                with second:
+                    pass
+            with first.phase('alone_again'):
+                pass
+        self.assertFalse(tracemalloc.is_tracing())
+        self.assertEqual(
+            {
+                name: 'allocated' in phase
+                for name, phase in first.phases.items()
+            },
+            {
+                'alone': True,
+                'overlapped': False,
+                'overlapped_at_start': False,
+                'overlapped_in_between': False,
+                'alone_again': True
+            }
+        )
+        self.assertNotIn('allocated', second.phases['overlapped'])
+
+    def test_cprofile(self):
+        profile = self.run_with_profile(ProfileMode.CPROFILE)
+        self.assertIn('migrate', profile.stats)
+
+    @override_settings(MIGRATION_PROFILE_SAMPLE_RATE=1)
+    def test_sampling(self):
+        profile = self.run_with_profile('')
+        self.assertEqual(profile.mode, ProfileMode.PHASES)
+
+    @override_settings(MIGRATION_PHASE_HOOKS=['api.tests.trace_phase'])
+    def test_phase_hooks(self):
+        traced_phases.clear()
+        self.assertIsNone(self.run_with_profile(''))
+        self.assertIn((self.migration.pk, 'transfer'), traced_phases)
+        self.assertIn((self.migration.pk, 'save_target'), traced_phases)
+
+    def test_profiles_api(self):
+        self.run_with_profile(ProfileMode.PHASES)
+        response = self.client.get(
+            f'/api/v1/migrations/{self.migration.pk}/profiles/',
+            HTTP_AUTHORIZATION=f'Bearer {self.token}'
+        )
+        self.assertEqual(response.status_code, 200)
+        results = response.json()['results']
+        self.assertEqual(len(results), 1)
+        self.assertEqual(results[0]['migration'], self.migration.pk)
+        self.assertEqual(results[0]['mode'], 'phases')
+
+
+@override_settings(
+    MIGRATION_TRANSFER_DRIVER='api.transfer.LocalFilesystemDriver',
+    MIGRATION_TRANSFER_CHUNK_SIZE=1024 * 1024
+)
+class LocalTransferTestCase(SetUpTestCase, TestCase):
+
+    def setUp(self):
+        super().setUp()
+        source = tempfile.TemporaryDirectory()
+        destination = tempfile.TemporaryDirectory()
+        self.addCleanup(source.cleanup)
+        self.addCleanup(destination.cleanup)
+        self.source_root = source.name
+        self.destination_root = destination.name
+        settings = override_settings(
+            MIGRATION_TRANSFER_SOURCE_ROOT=self.source_root,
+            MIGRATION_TRANSFER_DESTINATION_ROOT=self.destination_root
+        )
+        settings.enable()
+        self.addCleanup(settings.disable)
+        self.data = os.urandom(3 * 1024 * 1024 + 17)
+
+    def write(self, path, data):
+        path = os.path.join(self.source_root, path)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path, 'wb') as file:
+            file.write(data)
+        return path
+
+    def read(self, path):
+        with open(path, 'rb') as file:
+            return file.read()
+
+    @override_settings(MIGRATION_EXECUTOR_EAGER=True)
+    def resync(self):
+        response = self.client.get(
+            f'/api/v1/migrations/{self.migration.pk}/resync/',
+            HTTP_AUTHORIZATION=f'Bearer {self.token}'
+        )
+        self.assertEqual(response.status_code, 202)
+        self.migration.refresh_from_db()
+        self.assertEqual(self.migration.migration_state, 'success')
+
+    def chunk(self):
+        source = self.write('file', self.data)
+        destination = os.path.join(self.destination_root, 'file')
+        with open(destination, 'wb') as file:
+            file.truncate(len(self.data))
+        return transfer.Chunk(source, destination, 0, len(self.data))
+
+    def test_copy_fallbacks(self):
+        chunk = self.chunk()
+        unsupported = OSError(errno.EXDEV, 'cross device')
+        unsupported_methods = (
+            (),
+            ('copy_file_range',),
+            ('copy_file_range', 'sendfile')
+        )
+        for patched in unsupported_methods:
+            with ExitStack() as stack:
+                for name in patched:
+                    stack.enter_context(mock.patch.object(
+                        os,
+                        name,
+                        side_effect=unsupported
+                    ))
+                self.assertEqual(
+                    transfer.copy_chunk(chunk)[0],
+                    len(self.data)
+                )
+            self.assertEqual(self.read(chunk.destination), self.data)
+
+    def test_checksum_mismatch_is_retried(self):
+        chunk = self.chunk()
+        with mock.patch.object(
+            transfer,
+            'digest',
+            side_effect=['source', 'broken', 'source', 'source']
+        ), self.assertLogs('api.transfer', 'WARNING'):
+            self.assertEqual(
+                transfer.copy_chunk(chunk),
+                (len(self.data), 'source')
+            )
+        with mock.patch.object(transfer, 'digest', side_effect=[
+            'source', 'broken'
+        ] * 2), self.assertLogs('api.transfer', 'WARNING'):
+            with self.assertRaises(transfer.TransferError):
+                transfer.copy_chunk(chunk, retries=1)
+
+    def test_files_are_split_into_chunks(self):
+        self.write(os.path.join('tree', 'disk.img'), self.data)
+        self.write(os.path.join('tree', 'empty'), b'')
+        chunks, files, entries = transfer.plan_tree(
+            os.path.join(self.source_root, 'tree'),
+            os.path.join(self.destination_root, 'tree'),
+            transfer.chunk_size(1024 * 1024 + 1)
+        )
+        self.assertEqual(len(files), 2)
+        self.assertEqual(
+            [(chunk.offset, chunk.length) for chunk in chunks],
+            [
+                (0, 1024 * 1024),
+                (1024 * 1024, 1024 * 1024),
+                (2 * 1024 * 1024, 1024 * 1024),
+                (3 * 1024 * 1024, 17)
+            ]
+        )
+        self.assertEqual(
+            sum(
+                copied
+                for copied, block in transfer.copy_chunks(chunks, workers=4)
+            ),
+            len(self.data)
+        )
+        self.assertEqual(
+            self.read(os.path.join(self.destination_root, 'tree', 'disk.img')),
+            self.data
+        )
+
+    def test_mount_point_outside_of_root(self):
+        with self.assertRaises(transfer.TransferError):
+            transfer.mount_point_path(self.source_root, '../etc')
+
+    def test_run_migration_copies_mount_points(self):
+        name = self.mount_point_name_2
+        self.write(os.path.join(name, 'disk.img'), self.data)
+        self.write(os.path.join(name, 'etc', 'hosts'), b'127.0.0.1 host\n')
+        os.symlink('etc/hosts', os.path.join(self.source_root, name, 'link'))
+        self.write(os.path.join(self.mount_point_name_1, 'skipped'), b'x')
+        metrics.migration_transfer_bytes.clear()
+        Migration(pk=self.migration.pk).run_migration()
+        self.migration.refresh_from_db()
+        self.assertEqual(self.migration.migration_state, 'success')
+        destination = os.path.join(
+            self.destination_root,
+            str(self.migration_target.pk)
+        )
+        self.assertEqual(os.listdir(destination), [name])
+        self.assertEqual(
+            self.read(os.path.join(destination, name, 'disk.img')),
+            self.data
+        )
+        self.assertEqual(
+            os.readlink(os.path.join(destination, name, 'link')),
+            'etc/hosts'
+        )
+        self.assertIn(
+            'api_migration_transfer_bytes_total'
+            f'{{driver="LocalFilesystemDriver"}} {len(self.data) + 15}',
+            metrics.exposition()
+        )
+
+    def test_chunk_matching_the_manifest_is_not_copied(self):
+        chunk = self.chunk()
+        with open(chunk.source, 'rb') as file:
+            block = transfer.digest(file.fileno(), 0, len(self.data))
+        self.assertEqual(
+            transfer.copy_chunk(chunk._replace(digest=block)),
+            (0, block)
+        )
+        self.assertEqual(self.read(chunk.destination), bytes(len(self.data)))
+
+    def test_run_again_copies_changed_blocks(self):
+        name = self.mount_point_name_2
+        source = self.write(os.path.join(name, 'disk.img'), self.data)
+        self.write(os.path.join(name, 'stale'), b'stale')
+        self.write(os.path.join(name, 'same'), b'same')
+        Migration(pk=self.migration.pk).run_migration()
+        destination = os.path.join(
+            self.destination_root,
+            str(self.migration_target.pk),
+            name
+        )
+        manifest = TransferManifest.objects.get(
+            migration=self.migration,
+            mount_point_name=name
+        )
+        files = {file.path: file for file in manifest.entries.all()}
+        self.assertEqual(len(files['disk.img'].blocks), 4)
+        self.assertEqual(sorted(files), ['disk.img', 'same', 'stale'])
+
+        data = bytearray(self.data)
+        data[1024 * 1024 + 5] ^= 0xff
+        with open(source, 'r+b') as file:
+            file.seek(1024 * 1024 + 5)
+            file.write(data[1024 * 1024 + 5:1024 * 1024 + 6])
+        os.utime(source, ns=(0, 0))
+        os.unlink(os.path.join(self.source_root, name, 'stale'))
+        metrics.migration_transfer_bytes.clear()
+        self.resync()
+        self.assertIn(
+            'api_migration_transfer_bytes_total'
+            f'{{driver="LocalFilesystemDriver"}} {1024 * 1024}',
+            metrics.exposition()
+        )
+        self.assertEqual(
+            self.read(os.path.join(destination, 'disk.img')),
+            bytes(data)
+        )
+        self.assertEqual(sorted(os.listdir(destination)), ['disk.img', 'same'])
+        self.assertEqual(
+            sorted(manifest.entries.values_list('path', flat=True)),
+            ['disk.img', 'same']
+        )
+        # Checkpoints write only the files that changed.
+        self.assertEqual(
+            manifest.entries.get(path='same').pk,
+            files['same'].pk
+        )
+        self.assertNotEqual(
+            manifest.entries.get(path='disk.img').pk,
+            files['disk.img'].pk
+        )
+
+    def test_removed_destination_is_copied_again(self):
+        name = self.mount_point_name_2
+        self.write(os.path.join(name, 'disk.img'), self.data)
+        Migration(pk=self.migration.pk).run_migration()
+        path = os.path.join(
+            self.destination_root,
+            str(self.migration_target.pk),
+            name,
+            'disk.img'
+        )
+        os.unlink(path)
+        self.resync()
+        self.assertEqual(self.read(path), self.data)
+
+    def test_resync_reuses_the_destination(self):
+        name = self.mount_point_name_2
+        self.write(os.path.join(name, 'disk.img'), self.data)
+        Migration(pk=self.migration.pk).run_migration()
+        self.migration_target.refresh_from_db()
+        destination = self.migration_target.target_vm
+        self.assertEqual(destination.migrated_from, self.work_load)
+        work_loads = WorkLoad.objects.count()
+        self.resync()
+        self.migration_target.refresh_from_db()
+        self.assertEqual(self.migration_target.target_vm, destination)
+        self.assertEqual(WorkLoad.objects.count(), work_loads)
+        self.assertEqual(
+            list(destination.storage.values_list(
+                'mount_point_name',
+                flat=True
+            )),
+            [name]
+        )
+
+    def test_only_successful_migrations_resync(self):
+        response = self.client.get(
+            f'/api/v1/migrations/{self.migration.pk}/resync/',
+            HTTP_AUTHORIZATION=f'Bearer {self.token}'
+        )
+        self.assertEqual(response.status_code, 400)
+        self.migration.refresh_from_db()
+        self.assertEqual(self.migration.migration_state, 'not_started')
+
+    @override_settings(MIGRATION_TRANSFER_WORKERS=1)
+    def test_failed_run_is_resumed_from_checkpoints(self):
+        name = self.mount_point_name_2
+        self.write(os.path.join(name, 'disk.img'), self.data)
+        copy_range = transfer.copy_range
+
+        def fail_third_chunk(source, destination, offset, length, throttle):
+            if offset == 2 * 1024 * 1024:
+                raise OSError(errno.EIO, 'I/O error')
+            return copy_range(source, destination, offset, length, throttle)
+
+        with mock.patch.object(
+            transfer,
+            'copy_range',
+            side_effect=fail_third_chunk
+        ):
+            Migration(pk=self.migration.pk).run_migration()
+        self.migration.refresh_from_db()
+        self.assertEqual(self.migration.migration_state, 'error')
+        checkpoint = TransferCheckpoint.objects.get(migration=self.migration)
+        self.assertEqual(
+            (checkpoint.mount_point_name, checkpoint.total_bytes),
+            (name, len(self.data))
+        )
+        self.assertEqual(checkpoint.done_bytes, 2 * 1024 * 1024)
+        self.assertFalse(checkpoint.completed)
+        response = self.client.get(
+            f'/api/v1/migrations/{self.migration.pk}/state/',
+            HTTP_AUTHORIZATION=f'Bearer {self.token}'
+        ).json()
+        self.assertEqual(
+            response['progress'],
+            round(2 * 1024 * 1024 / len(self.data) * 100, 2)
+        )
+        self.assertEqual(response['bytes transferred'], 2 * 1024 * 1024)
+
+        metrics.migration_transfer_bytes.clear()
+        Migration(pk=self.migration.pk).run_migration()
+        self.migration.refresh_from_db()
+        self.assertEqual(self.migration.migration_state, 'success')
+        self.assertIn(
+            'api_migration_transfer_bytes_total'
+            f'{{driver="LocalFilesystemDriver"}} {1024 * 1024 + 17}',
+            metrics.exposition()
+        )
+        self.assertEqual(
+            self.read(os.path.join(
+                self.destination_root,
+                str(self.migration_target.pk),
+                name,
+                'disk.img'
+            )),
+            self.data
+        )
+        checkpoint.refresh_from_db()
+        self.assertTrue(checkpoint.completed)
+        self.assertEqual(self.migration.progress(), (100.0, 1024 * 1024 + 17))
+
+    def test_run_is_throttled_by_the_target(self):
+        self.write(os.path.join(self.mount_point_name_2, 'disk'), self.data)
+        MigrationTarget.objects.filter(pk=self.migration_target.pk).update(
+            bandwidth_limit=1024 * 1024
+        )
+        # The clock stands still, so no tokens come back while copying.
+        with mock.patch.object(throttling, 'sleep') as sleep, \
+                mock.patch.object(throttling, 'monotonic', return_value=0):
+            Migration(pk=self.migration.pk).run_migration()
+        self.migration.refresh_from_db()
+        self.assertEqual(self.migration.migration_state, 'success')
+        # One second of the rate is free, the rest is waited for.
+        self.assertAlmostEqual(
+            max(call.args[0] for call in sleep.call_args_list),
+            (len(self.data) - 1024 * 1024) / (1024 * 1024)
+        )
+
+    def test_missing_mount_point_fails_the_migration(self):
+        Migration(pk=self.migration.pk).run_migration()
+        self.migration.refresh_from_db()
+        self.assertEqual(self.migration.migration_state, 'error')
+        self.assertIn('is not a directory', self.migration.migration_error)
+
+
+class ThrottlingTestCase(SetUpTestCase, TestCase):
+
+    def setUp(self):
+        super().setUp()
+        throttling.reset_runs()
+        self.addCleanup(throttling.global_bucket.set_rate, None)
+        self.addCleanup(
+            throttling.cloud_bucket(self.migration_target.cloud_type).set_rate,
+            None
+        )
+
+    def test_token_bucket(self):
+        with mock.patch.object(throttling, 'monotonic', return_value=0):
+            bucket = throttling.TokenBucket(1000)
+            self.assertEqual(bucket.take(1000), 0)
+            self.assertEqual(bucket.take(500), 0.5)
+            bucket.set_rate(500)
+            self.assertEqual(bucket.take(500), 2)
+            bucket.set_rate(None)
+            self.assertEqual(bucket.take(10 ** 9), 0)
+        with mock.patch.object(throttling, 'monotonic', return_value=4):
+            bucket.set_rate(500)
+            self.assertEqual(bucket.take(500), 0)
+
+    def test_throttle_takes_from_every_bucket(self):
+        self.migration_target.bandwidth_limit = 4000
+        self.migration_target.save()
+        BandwidthLimit.objects.create(
+            cloud_type=self.migration_target.cloud_type,
+            rate=2000
+        )
+        BandwidthLimit.objects.create(cloud_type='', rate=1000)
+        throttle = throttling.Throttle(self.migration)
+        with mock.patch.object(throttling, 'sleep') as sleep:
+            throttle.refresh()
+            throttle(3000)
+        sleep.assert_called_once()
+        self.assertAlmostEqual(sleep.call_args.args[0], 2, places=2)
+
+    def test_shared_rates_are_split_between_processes(self):
+        BandwidthLimit.objects.create(
+            cloud_type=self.migration_target.cloud_type,
+            rate=2000
+        )
+        BandwidthLimit.objects.create(cloud_type='', rate=1200)
+        lease_expires_at = timezone.now() + timedelta(minutes=1)
+        azure = MigrationTarget.objects.create(
+            cloud_type='azure',
+            cloud_credentials=self.credentials_2
+        )
+        for lease_owner, migration_target in [
+            ('worker-b:1', self.migration_target),
+            ('worker-a:2', azure),
+            ('worker-a:3', azure)
+        ]:
+            Migration.objects.create(
+                migration_target=migration_target,
+                migration_state=MigrationState.RUNNING,
+                lease_owner=lease_owner,
+                lease_expires_at=lease_expires_at
+            )
+        Migration.objects.filter(pk=self.migration.pk).update(
+            migration_state=MigrationState.RUNNING,
+            lease_owner='worker-a:1',
+            lease_expires_at=lease_expires_at
+        )
+        self.migration.refresh_from_db()
+        throttle = throttling.Throttle(self.migration)
+        throttle.refresh()
+        # worker-a runs 3 of the 4 migrations, 1 of the 2 on its cloud.
+        self.assertEqual(throttling.global_bucket.rate, 900)
+        self.assertEqual(throttle.cloud.rate, 1000)
+        # The other runs of the process reuse the runs read by the first.
+        with self.assertNumQueries(2):
+            throttling.Throttle(self.migration).refresh()
+        self.assertEqual(throttling.global_bucket.rate, 900)
+
+    def test_bandwidth_api(self):
+        url = (
+            f'/api/v1/migration_targets/{self.migration_target.pk}/bandwidth/'
+        )
+        throttle = throttling.Throttle(self.migration)
+        response = self.client.patch(
+            url,
+            {
+                'migration_limit': 4000,
+                'cloud_type_limit': '2000',
+                'global_limit': 1000
+            },
+            content_type='application/json',
+            HTTP_AUTHORIZATION=f'Bearer {self.token}'
+        )
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json(), {
+            'cloud_type': self.migration_target.cloud_type,
+            'migration_limit': 4000,
+            'cloud_type_limit': 2000,
+            'global_limit': 1000
+        })
+        self.assertEqual(throttle.bucket.rate, 4000)
+        self.assertTrue(throttle.due())
+        throttle.refresh()
+        self.assertEqual(throttling.global_bucket.rate, 1000)
+        self.assertEqual(
+            throttling.cloud_bucket(self.migration_target.cloud_type).rate,
+            2000
+        )
+        self.migration_target.refresh_from_db()
+        self.assertEqual(self.migration_target.bandwidth_limit, 4000)
+
+        response = self.client.patch(
+            url,
+            {'migration_limit': None, 'global_limit': 0},
+            content_type='application/json',
+            HTTP_AUTHORIZATION=f'Bearer {self.token}'
+        )
+        self.assertEqual(response.status_code, 400)
+        for name in ('migration_limit', 'cloud_type_limit', 'global_limit'):
+            response = self.client.patch(
+                url,
+                {name: 2 ** 70},
+                content_type='application/json',
+                HTTP_AUTHORIZATION=f'Bearer {self.token}'
+            )
+            self.assertEqual(response.status_code, 400)
+            self.assertEqual(response.json(), {name: [
+                f'Ensure this value is less than or equal to {2 ** 63 - 1}.'
+            ]})
+        response = self.client.patch(
+            url,
+            {'migration_limit': None},
+            content_type='application/json',
+            HTTP_AUTHORIZATION=f'Bearer {self.token}'
+        )
+        self.assertEqual(response.json()['migration_limit'], None)
+        self.assertIsNone(throttle.bucket.rate)
+        response = self.client.get(
+            url,
+            HTTP_AUTHORIZATION=f'Bearer {self.token}'
+        )
+        self.assertEqual(response.json()['global_limit'], 1000)
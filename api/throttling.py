@@ -0,0 +1,225 @@
+import threading
+import weakref
+from time import monotonic, sleep
+
+from django.conf import settings
+from django.utils import timezone
+
+_lock = threading.Lock()
+_throttles = weakref.WeakSet()
+_runs = None
+_runs_read = None
+
+
+class TokenBucket:
+    """Limits a rate in bytes per second, no rate is no limit.
+
+    The bucket holds MIGRATION_BANDWIDTH_BURST seconds of the rate. A take
+    may leave it in debt; the taker waits until the debt is paid back, so
+    takes larger than the bucket are spread over time instead of failing.
+    """
+
+    def __init__(self, rate=None):
+        self.lock = threading.Lock()
+        self.rate = rate or None
+        self.tokens = self.capacity()
+        self.updated = monotonic()
+
+    def capacity(self):
+        if not self.rate:
+            return 0.0
+        return self.rate * settings.MIGRATION_BANDWIDTH_BURST
+
+    def refill(self):
+        now = monotonic()
+        if self.rate:
+            self.tokens = min(
+                self.capacity(),
+                self.tokens + (now - self.updated) * self.rate
+            )
+        self.updated = now
+
+    def set_rate(self, rate):
+        with self.lock:
+            if (rate or None) == self.rate:
+                return
+            self.refill()
+            unlimited = self.rate is None
+            self.rate = rate or None
+            if unlimited:
+                self.tokens = self.capacity()
+            else:
+                self.tokens = min(self.tokens, self.capacity())
+
+    def take(self, amount):
+        """Takes amount bytes, returns the seconds to wait for them."""
+        with self.lock:
+            if not self.rate:
+                return 0.0
+            self.refill()
+            self.tokens -= amount
+            return max(0.0, -self.tokens / self.rate)
+
+
+global_bucket = TokenBucket()
+cloud_buckets = {}
+
+
+def cloud_bucket(cloud_type):
+    with _lock:
+        return cloud_buckets.setdefault(cloud_type, TokenBucket())
+
+
+def limits(migration_target):
+    """The (migration, cloud type, global) rates of a target.
+
+    BandwidthLimit rows override MIGRATION_BANDWIDTH_LIMIT, None is no limit.
+    """
+    from .models import BandwidthLimit
+
+    cloud_type = migration_target.cloud_type if migration_target else None
+    rates = dict(
+        BandwidthLimit.objects.filter(
+            cloud_type__in=['', cloud_type or '']
+        ).values_list('cloud_type', 'rate')
+    )
+    return (
+        migration_target.bandwidth_limit if migration_target else None,
+        rates.get(cloud_type) if cloud_type else None,
+        rates.get('', settings.MIGRATION_BANDWIDTH_LIMIT)
+    )
+
+
+def worker_process(lease_owner):
+    """The worker of a lease owner, which is "<worker name>:<thread>"."""
+    return lease_owner.rsplit(':', 1)[0]
+
+
+def fraction(processes, process):
+    """The part of the runs, given by their processes, run by process."""
+    mine = processes.count(process)
+    if not mine:
+        # An unleased run, or one whose lease just expired.
+        return 1 / (len(processes) + 1)
+    return mine / len(processes)
+
+
+def running():
+    """The (process, cloud type) of the running migrations with a lease.
+
+    Read at most once every MIGRATION_BANDWIDTH_REFRESH seconds and shared
+    by the throttles of this process, so refreshing every run doesn't read
+    every other run.
+    """
+    global _runs, _runs_read
+    from .models import Migration, MigrationState
+
+    with _lock:
+        if _runs is not None and (
+            monotonic() - _runs_read < settings.MIGRATION_BANDWIDTH_REFRESH
+        ):
+            return _runs
+    runs = [
+        (worker_process(owner), run_cloud_type)
+        for owner, run_cloud_type in Migration.objects.filter(
+            migration_state=MigrationState.RUNNING,
+            lease_expires_at__gt=timezone.now()
+        ).values_list('lease_owner', 'migration_target__cloud_type')
+    ]
+    with _lock:
+        _runs, _runs_read = runs, monotonic()
+    return runs
+
+
+def reset_runs():
+    global _runs, _runs_read
+    with _lock:
+        _runs = _runs_read = None
+
+
+def shares(lease_owner, cloud_type):
+    """The parts of the global and cloud type rates a run's process gets.
+
+    The buckets are kept in each process, so the shared rates are split
+    between the worker processes by their part of the running migrations
+    that hold a lease.
+    """
+    runs = running()
+    process = worker_process(lease_owner) if lease_owner else None
+    return (
+        fraction([run_process for run_process, _ in runs], process),
+        fraction([
+            run_process for run_process, run_cloud_type in runs
+            if run_cloud_type == cloud_type
+        ], process)
+    )
+
+
+def scale(rate, share):
+    return rate * share if rate else None
+
+
+def apply(migration_target):
+    """Applies the limits of a target to the runs of this process.
+
+    The bucket of every run of the target is set at once, the shared ones
+    at the next refresh of the runs.
+    """
+    migration_rate = limits(migration_target)[0]
+    for throttle in list(_throttles):
+        if throttle.migration_target_id == migration_target.pk:
+            throttle.bucket.set_rate(migration_rate)
+        throttle.refreshed = None
+
+
+class Throttle:
+    """Token buckets a run takes the bytes it copies from.
+
+    The bucket of the run, the one of the cloud type of its target and the
+    global one are shared by the runs of this process, which get the share
+    of the cloud type and global rates given by shares. Called with a
+    number of bytes from any thread, it sleeps until all of them allow the
+    bytes. refresh reads the limits again and is called from the thread of
+    the run.
+    """
+
+    def __init__(self, migration):
+        self.migration_target_id = migration.migration_target_id
+        self.lease_owner = migration.lease_owner
+        self.bucket = TokenBucket()
+        self.cloud = None
+        self.refreshed = None
+        _throttles.add(self)
+
+    def due(self):
+        return (
+            self.refreshed is None
+            or monotonic() - self.refreshed
+            >= settings.MIGRATION_BANDWIDTH_REFRESH
+        )
+
+    def refresh(self):
+        from .models import MigrationTarget
+
+        migration_target = MigrationTarget.objects.filter(
+            pk=self.migration_target_id
+        ).first()
+        migration_rate, cloud_rate, global_rate = limits(migration_target)
+        cloud_type = migration_target.cloud_type if migration_target else None
+        global_share, cloud_share = shares(self.lease_owner, cloud_type)
+        self.bucket.set_rate(migration_rate)
+        global_bucket.set_rate(scale(global_rate, global_share))
+        if migration_target is None:
+            self.cloud = None
+        else:
+            self.cloud = cloud_bucket(cloud_type)
+            self.cloud.set_rate(scale(cloud_rate, cloud_share))
+        self.refreshed = monotonic()
+
+    def __call__(self, amount):
+        buckets = [self.bucket, global_bucket]
+        if self.cloud is not None:
+            buckets.append(self.cloud)
+        wait = max(bucket.take(amount) for bucket in buckets)
+        if wait:
+            sleep(wait)
@@ -0,0 +1,157 @@
+import logging
+from contextlib import ExitStack, contextmanager
+from contextvars import ContextVar
+from functools import wraps
+from time import perf_counter
+
+from django.db import connections
+
+from . import metrics
+
+logger = logging.getLogger(__name__)
+
+_current = ContextVar('request_timer', default=None)
+
+
+class RequestTimer:
+
+    def __init__(self, request=None):
+        self.request = request
+        self.started = perf_counter()
+        self.queries = 0
+        self.db_time = 0.0
+        self.spans = {}
+        self.depth = {}
+
+    def total(self):
+        return perf_counter() - self.started
+
+    def execute(self, execute, sql, params, many, context):
+        started = perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            self.db_time += perf_counter() - started
+            self.queries += 1
+
+
+def current_timer():
+    return _current.get()
+
+
+@contextmanager
+def span(name):
+    """Adds the time of the block to the span, nested blocks count once."""
+    timer = _current.get()
+    if timer is None or timer.depth.get(name):
+        yield
+        return
+    timer.depth[name] = 1
+    started = perf_counter()
+    try:
+        yield
+    finally:
+        timer.depth[name] = 0
+        timer.spans[name] = (
+            timer.spans.get(name, 0.0) + perf_counter() - started
+        )
+
+
+def timed(name, function):
+    """function, adding the time of its calls to the span."""
+    @wraps(function)
+    def wrapper(*args, **kwargs):
+        with span(name):
+            return function(*args, **kwargs)
+    return wrapper
+
+
+class TimedSerializerMixin:
+    """Times the serializer of a view in the serializer span.
+
+    Only the top-level serializer is timed, once for a whole list, so the
+    nested serializers of every row cost nothing more.
+    """
+
+    def get_serializer(self, *args, **kwargs):
+        serializer = super().get_serializer(*args, **kwargs)
+        serializer.to_representation = timed(
+            'serializer',
+            serializer.to_representation
+        )
+        return serializer
+
+
+def view_name(request):
+    match = getattr(request, 'resolver_match', None)
+    if match is None:
+        return None
+    cls = getattr(match.func, 'cls', None)
+    if cls is None:
+        return match.view_name
+    actions = getattr(match.func, 'actions', None)
+    if actions and request.method.lower() in actions:
+        return f'{cls.__name__}.{actions[request.method.lower()]}'
+    return cls.__name__
+
+
+def server_timing(timer, total):
+    metrics = [
+        f'total;dur={total * 1000:.2f}',
+        f'db;dur={timer.db_time * 1000:.2f};desc="{timer.queries} queries"'
+    ]
+    metrics += [
+        f'{name};dur={duration * 1000:.2f}'
+        for name, duration in sorted(timer.spans.items())
+    ]
+    return ', '.join(metrics)
+
+
+class RequestTimingMiddleware:
+    """Reports wall, database and serializer time of every request.
+
+    The times go to the Server-Timing header and to the api.timing log.
+    """
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        timer = RequestTimer(request)
+        token = _current.set(timer)
+        try:
+            with ExitStack() as stack:
+                for connection in connections.all():
+                    stack.enter_context(
+                        connection.execute_wrapper(timer.execute)
+                    )
+                response = self.get_response(request)
+        finally:
+            _current.reset(token)
+        total = timer.total()
+        response['Server-Timing'] = server_timing(timer, total)
+        metrics.observe_request(request, response, timer, total)
+        name = view_name(request)
+        logger.info(
+            'view=%s method=%s path=%s status=%s total_ms=%.2f db_ms=%.2f '
+            'queries=%s serializer_ms=%.2f',
+            name,
+            request.method,
+            request.path,
+            response.status_code,
+            total * 1000,
+            timer.db_time * 1000,
+            timer.queries,
+            timer.spans.get('serializer', 0.0) * 1000,
+            extra={
+                'view': name,
+                'method': request.method,
+                'path': request.path,
+                'status': response.status_code,
+                'total_ms': total * 1000,
+                'db_ms': timer.db_time * 1000,
+                'queries': timer.queries,
+                'serializer_ms': timer.spans.get('serializer', 0.0) * 1000
+            }
+        )
+        return response
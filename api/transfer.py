@@ -0,0 +1,625 @@
+import errno
+import hashlib
+import logging
+import mmap
+import os
+import shutil
+from collections import namedtuple
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from time import monotonic, sleep
+
+from django.conf import settings
+from django.db import transaction
+from django.utils.module_loading import import_string
+
+from . import throttling
+
+logger = logging.getLogger(__name__)
+
+# Bytes moved by one system call and hashed in one update.
+COPY_SIZE = 8 * 1024 * 1024
+HASH_SIZE = 1024 * 1024
+# Errors after which the next copy method is tried for the range.
+UNSUPPORTED = (
+    errno.EXDEV,
+    errno.ENOSYS,
+    errno.EINVAL,
+    errno.EOPNOTSUPP,
+    errno.ENOTSUP,
+    errno.EBADF,
+)
+
+
+class TransferError(Exception):
+    pass
+
+
+Chunk = namedtuple(
+    'Chunk',
+    ['source', 'destination', 'offset', 'length', 'digest'],
+    defaults=[None]
+)
+
+
+def take(throttle, amount):
+    # Charged after the call, so a method that turns out unsupported
+    # doesn't count against the limits.
+    if throttle is not None:
+        throttle(amount)
+
+
+def copy_file_range(source, destination, offset, length, throttle=None):
+    copied = 0
+    while copied < length:
+        sent = os.copy_file_range(
+            source,
+            destination,
+            min(COPY_SIZE, length - copied),
+            offset + copied,
+            offset + copied
+        )
+        if not sent:
+            break
+        take(throttle, sent)
+        copied += sent
+    return copied
+
+
+def sendfile(source, destination, offset, length, throttle=None):
+    os.lseek(destination, offset, os.SEEK_SET)
+    copied = 0
+    while copied < length:
+        sent = os.sendfile(
+            destination,
+            source,
+            offset + copied,
+            min(COPY_SIZE, length - copied)
+        )
+        if not sent:
+            break
+        take(throttle, sent)
+        copied += sent
+    return copied
+
+
+def read_write(source, destination, offset, length, throttle=None):
+    copied = 0
+    while copied < length:
+        data = os.pread(
+            source,
+            min(COPY_SIZE, length - copied),
+            offset + copied
+        )
+        if not data:
+            break
+        take(throttle, len(data))
+        view = memoryview(data)
+        while view:
+            written = os.pwrite(destination, view, offset + copied)
+            view = view[written:]
+            copied += written
+    return copied
+
+
+def copy_methods():
+    methods = []
+    if hasattr(os, 'copy_file_range'):
+        methods.append(copy_file_range)
+    if hasattr(os, 'sendfile'):
+        methods.append(sendfile)
+    return methods + [read_write]
+
+
+def copy_range(source, destination, offset, length, throttle=None):
+    """Copies a range of a file in the kernel where possible.
+
+    copy_file_range and sendfile don't move the data through user space;
+    read_write is the fallback for file systems and platforms without them.
+    throttle is called with the bytes of every system call after it.
+    Returns the bytes copied, fewer if the source got shorter.
+    """
+    for method in copy_methods():
+        try:
+            return method(source, destination, offset, length, throttle)
+        except OSError as e:
+            if e.errno not in UNSUPPORTED or method is read_write:
+                raise
+
+
+def digest(fd, offset, length):
+    """Hashes a range of a file through a memory map, a block at a time."""
+    checksum = hashlib.blake2b()
+    if length:
+        with mmap.mmap(
+            fd,
+            length,
+            access=mmap.ACCESS_READ,
+            offset=offset
+        ) as mapped:
+            with memoryview(mapped) as view:
+                for start in range(0, length, HASH_SIZE):
+                    checksum.update(view[start:start + HASH_SIZE])
+    return checksum.hexdigest()
+
+
+def copy_chunk(chunk, verify=True, retries=3, throttle=None):
+    """Copies a chunk unless its digest matches the one of the manifest.
+
+    Returns the bytes copied and the digest of the source chunk.
+    """
+    with open(chunk.source, 'rb') as source, \
+            open(chunk.destination, 'r+b') as destination:
+        source_digest = digest(source.fileno(), chunk.offset, chunk.length)
+        if source_digest == chunk.digest:
+            return 0, source_digest
+        for attempt in range(retries + 1):
+            if attempt:
+                source_digest = digest(
+                    source.fileno(),
+                    chunk.offset,
+                    chunk.length
+                )
+            copied = copy_range(
+                source.fileno(),
+                destination.fileno(),
+                chunk.offset,
+                chunk.length,
+                throttle
+            )
+            if copied != chunk.length:
+                raise TransferError(f'{chunk.source} changed during the copy')
+            if not verify or source_digest == digest(
+                destination.fileno(),
+                chunk.offset,
+                chunk.length
+            ):
+                return copied, source_digest
+            logger.warning(
+                'checksum mismatch in %s at %s, attempt %s',
+                chunk.destination,
+                chunk.offset,
+                attempt + 1
+            )
+    raise TransferError(
+        f'{chunk.destination} at {chunk.offset} differs from the source'
+    )
+
+
+def chunk_size(size):
+    """Rounds the chunk size to whole memory map pages."""
+    granularity = mmap.ALLOCATIONGRANULARITY
+    return max(granularity, size // granularity * granularity)
+
+
+def link(path, destination):
+    if os.path.lexists(destination):
+        os.unlink(destination)
+    os.symlink(os.readlink(path), destination)
+
+
+def unchanged(entry, stat, destination):
+    """Whether a file is as the manifest recorded it on both sides."""
+    return (
+        entry is not None
+        and entry['size'] == stat.st_size
+        and entry['mtime_ns'] == stat.st_mtime_ns
+        and not os.path.islink(destination)
+        and os.path.isfile(destination)
+        and os.path.getsize(destination) == stat.st_size
+    )
+
+
+def resize(destination, length):
+    """Creates or resizes a file, keeping the blocks it already has."""
+    if os.path.islink(destination):
+        os.unlink(destination)
+    with open(destination, 'ab') as file:
+        file.truncate(length)
+
+
+def plan_tree(source_root, destination_root, size, manifest=None):
+    """Creates the directories, links and files of a tree.
+
+    manifest maps the relative paths of the files to their entries from
+    the last transfer. Files unchanged since are left alone, the chunks of
+    the others carry the digests recorded for them, so only the blocks that
+    differ are copied. Returns the chunks, the (relative path, source,
+    destination, stat) of the files they belong to and the entries of the
+    unchanged files.
+    """
+    if not os.path.isdir(source_root):
+        raise TransferError(f'{source_root} is not a directory')
+    manifest = manifest or {}
+    chunks, files, entries = [], [], {}
+    for directory, directories, names in os.walk(source_root):
+        relative = os.path.relpath(directory, source_root)
+        target = os.path.normpath(os.path.join(destination_root, relative))
+        os.makedirs(target, exist_ok=True)
+        for name in directories:
+            if os.path.islink(os.path.join(directory, name)):
+                link(os.path.join(directory, name), os.path.join(target, name))
+        for name in names:
+            path = os.path.join(directory, name)
+            destination = os.path.join(target, name)
+            if os.path.islink(path):
+                link(path, destination)
+            elif os.path.isfile(path):
+                key = os.path.normpath(os.path.join(relative, name))
+                stat = os.stat(path)
+                entry = manifest.get(key)
+                if unchanged(entry, stat, destination):
+                    entries[key] = entry
+                    continue
+                # Blocks of a destination that was removed since are gone.
+                blocks = entry['blocks'] if entry and os.path.isfile(
+                    destination
+                ) else []
+                resize(destination, stat.st_size)
+                files.append((key, path, destination, stat))
+                chunks += [
+                    Chunk(
+                        path,
+                        destination,
+                        offset,
+                        min(size, stat.st_size - offset),
+                        blocks[index] if index < len(blocks) else None
+                    )
+                    for index, offset in enumerate(
+                        range(0, stat.st_size, size)
+                    )
+                ]
+    return chunks, files, entries
+
+
+def remove_stale(destination_root, manifest, entries):
+    """Removes the files transferred before that left the source."""
+    for key in manifest.keys() - entries.keys():
+        path = os.path.join(destination_root, key)
+        if os.path.isfile(path) and not os.path.islink(path):
+            os.unlink(path)
+
+
+def copy_chunks(chunks, workers, verify=True, retries=3, done=None,
+                throttle=None):
+    """Copies the chunks on a thread pool.
+
+    done is called in the calling thread with the index and the result of
+    every chunk as it is copied; so is the refresh of the throttle, every
+    MIGRATION_BANDWIDTH_REFRESH seconds. Returns the (bytes copied, digest)
+    of every chunk, in order.
+    """
+    results = [None] * len(chunks)
+    timeout = None if throttle is None else (
+        settings.MIGRATION_BANDWIDTH_REFRESH
+    )
+    with ThreadPoolExecutor(
+        max_workers=workers,
+        thread_name_prefix='transfer'
+    ) as executor:
+        futures = {
+            executor.submit(copy_chunk, chunk, verify, retries, throttle):
+            index
+            for index, chunk in enumerate(chunks)
+        }
+        pending = set(futures)
+        try:
+            while pending:
+                finished, pending = wait(
+                    pending,
+                    timeout,
+                    return_when=FIRST_COMPLETED
+                )
+                for future in sorted(finished, key=futures.get):
+                    index = futures[future]
+                    results[index] = future.result()
+                    if done is not None:
+                        done(index, results[index])
+                if throttle is not None and throttle.due():
+                    throttle.refresh()
+            return results
+        finally:
+            for future in futures:
+                future.cancel()
+
+
+class TreeTransfer:
+    """Progress of the transfer of one mount point.
+
+    entries is the manifest being built: a file gets its modification time
+    once all of its chunks are copied, until then it can't be taken for
+    unchanged and the blocks still carry the digests of the last transfer
+    where they weren't copied yet. changed and removed are the files to
+    write to the stored manifest at the next checkpoint.
+    """
+
+    def __init__(self, name, destination, manifest, chunks, files, entries):
+        self.name = name
+        self.destination = destination
+        self.manifest = manifest
+        self.entries = entries
+        self.files = {}
+        self.pending = {}
+        self.blocks = []
+        self.done = sum(entry['size'] for entry in entries.values())
+        self.total = self.done
+        self.copied = 0
+        self.completed = False
+        self.manifest_id = None
+        self.changed = set()
+        self.removed = set()
+        keys = {}
+        for key, path, destination_path, stat in files:
+            keys[destination_path] = key
+            self.files[key] = (path, destination_path, stat)
+            self.pending[key] = 0
+            self.entries[key] = {
+                'size': stat.st_size,
+                'mtime_ns': None,
+                'blocks': []
+            }
+            self.changed.add(key)
+            self.total += stat.st_size
+        for chunk in chunks:
+            key = keys[chunk.destination]
+            blocks = self.entries[key]['blocks']
+            self.blocks.append((key, len(blocks)))
+            blocks.append(chunk.digest)
+            self.pending[key] += 1
+        for key, count in self.pending.items():
+            if not count:
+                self.finish(key)
+
+    def finish(self, key):
+        path, destination, stat = self.files[key]
+        shutil.copymode(path, destination)
+        self.entries[key]['mtime_ns'] = stat.st_mtime_ns
+
+    def chunk_done(self, index, length, result):
+        key, block = self.blocks[index]
+        copied, self.entries[key]['blocks'][block] = result
+        self.changed.add(key)
+        self.done += length
+        self.copied += copied
+        self.pending[key] -= 1
+        if not self.pending[key]:
+            self.finish(key)
+
+    def complete(self):
+        remove_stale(self.destination, self.manifest, self.entries)
+        # Files of the last transfer stay listed until they are removed.
+        self.removed |= self.manifest.keys() - self.entries.keys()
+        self.manifest = {}
+        self.completed = True
+
+    def saved(self, manifest_id):
+        self.manifest_id = manifest_id
+        self.changed = set()
+        self.removed = set()
+
+
+def mount_point_path(root, mount_point_name):
+    path = os.path.normpath(
+        os.path.join(root, mount_point_name.lstrip('/'))
+    )
+    if os.path.commonpath([root, path]) != os.path.normpath(root):
+        raise TransferError(f'{mount_point_name} is outside of {root}')
+    return path
+
+
+class TransferDriver:
+    """Moves the data of the selected mount points of a migration.
+
+    transfer returns the number of bytes moved.
+    """
+
+    def transfer(self, migration, mount_points):
+        raise NotImplementedError
+
+
+class SleepDriver(TransferDriver):
+    """Stands in for a transfer by sleeping MIGRATION_RUN_DELAY seconds."""
+
+    def transfer(self, migration, mount_points):
+        sleep(settings.MIGRATION_RUN_DELAY)
+        return 0
+
+
+class LocalFilesystemDriver(TransferDriver):
+    """Copies mount points between two directories of the local host.
+
+    A mount point is the directory mount_point_name under
+    MIGRATION_TRANSFER_SOURCE_ROOT and is copied to
+    MIGRATION_TRANSFER_DESTINATION_ROOT/<migration target id>/. Files are
+    split into MIGRATION_TRANSFER_CHUNK_SIZE chunks copied and verified by
+    MIGRATION_TRANSFER_WORKERS threads. The digests of the chunks are kept
+    in a TransferManifest per mount point, a TransferFile per file, so
+    running the migration again copies only the chunks that changed. The
+    files changed since the last checkpoint and a TransferCheckpoint with
+    the progress of every mount point are saved every
+    MIGRATION_CHECKPOINT_INTERVAL seconds and when the copy fails, so a run
+    resumed after a crash or an error skips the chunks already copied.
+    The copy is throttled by the bandwidth limits of the migration target.
+    """
+
+    def __init__(self, source_root=None, destination_root=None):
+        self.source_root = os.path.abspath(
+            source_root or settings.MIGRATION_TRANSFER_SOURCE_ROOT
+        )
+        self.destination_root = os.path.abspath(
+            destination_root or settings.MIGRATION_TRANSFER_DESTINATION_ROOT
+        )
+        self.chunk_size = chunk_size(settings.MIGRATION_TRANSFER_CHUNK_SIZE)
+
+    def destination(self, migration):
+        return os.path.join(
+            self.destination_root,
+            str(migration.migration_target_id)
+        )
+
+    def manifests(self, migration, destination):
+        """The files of the last transfers, by mount point name.
+
+        Manifests of another destination or block size don't apply.
+        """
+        from .models import TransferFile
+
+        manifests = {}
+        for file in TransferFile.objects.filter(
+            manifest__migration_id=migration.pk,
+            manifest__destination=destination,
+            manifest__block_size=self.chunk_size
+        ).select_related('manifest'):
+            manifests.setdefault(
+                file.manifest.mount_point_name,
+                {}
+            )[file.path] = file.entry()
+        return manifests
+
+    def save_manifest(self, migration, destination, tree):
+        """The id of the manifest of a tree, emptied if it doesn't apply."""
+        from .models import TransferManifest
+
+        manifest, created = TransferManifest.objects.get_or_create(
+            migration_id=migration.pk,
+            mount_point_name=tree.name,
+            defaults={
+                'destination': destination,
+                'block_size': self.chunk_size
+            }
+        )
+        if not created and (
+            manifest.destination,
+            manifest.block_size
+        ) != (destination, self.chunk_size):
+            manifest.entries.all().delete()
+            manifest.destination = destination
+            manifest.block_size = self.chunk_size
+            manifest.save()
+        return manifest.pk
+
+    def save_files(self, manifest_id, tree):
+        """Writes the files of a tree changed since the last checkpoint."""
+        from .bulk import BATCH_SIZE, chunks
+        from .models import TransferFile
+
+        files = TransferFile.objects.filter(manifest_id=manifest_id)
+        for paths in chunks(sorted(tree.changed | tree.removed)):
+            files.filter(path__in=paths).delete()
+        TransferFile.objects.bulk_create(
+            [
+                TransferFile(
+                    manifest_id=manifest_id,
+                    path=path,
+                    size=tree.entries[path]['size'],
+                    mtime_ns=tree.entries[path]['mtime_ns'],
+                    blocks=tree.entries[path]['blocks']
+                )
+                for path in sorted(tree.changed)
+            ],
+            batch_size=BATCH_SIZE
+        )
+
+    def checkpoint(self, migration, destination, trees):
+        """Saves the changes to the manifests and the progress."""
+        from .models import TransferCheckpoint
+
+        manifest_ids = []
+        with transaction.atomic():
+            for tree in trees:
+                manifest_ids.append(
+                    tree.manifest_id
+                    or self.save_manifest(migration, destination, tree)
+                )
+                self.save_files(manifest_ids[-1], tree)
+                TransferCheckpoint.objects.update_or_create(
+                    migration_id=migration.pk,
+                    mount_point_name=tree.name,
+                    defaults={
+                        'total_bytes': tree.total,
+                        'done_bytes': tree.done,
+                        'transferred_bytes': tree.copied,
+                        'completed': tree.completed
+                    }
+                )
+            TransferCheckpoint.objects.filter(
+                migration_id=migration.pk
+            ).exclude(
+                mount_point_name__in=[tree.name for tree in trees]
+            ).delete()
+        # The changes are forgotten once committed, so the next checkpoint
+        # writes those of a failed one again.
+        for tree, manifest_id in zip(trees, manifest_ids):
+            tree.saved(manifest_id)
+
+    def transfer(self, migration, mount_points):
+        destination = self.destination(migration)
+        manifests = self.manifests(migration, destination)
+        chunks, trees, owners = [], [], []
+        for mount_point in mount_points:
+            name = mount_point.mount_point_name
+            tree_destination = mount_point_path(destination, name)
+            manifest = manifests.get(name, {})
+            tree_chunks, files, entries = plan_tree(
+                mount_point_path(self.source_root, name),
+                tree_destination,
+                self.chunk_size,
+                manifest
+            )
+            tree = TreeTransfer(
+                name,
+                tree_destination,
+                manifest,
+                tree_chunks,
+                files,
+                entries
+            )
+            trees.append(tree)
+            owners += [(tree, index) for index in range(len(tree_chunks))]
+            chunks += tree_chunks
+        self.checkpoint(migration, destination, trees)
+        checkpointed = monotonic()
+        throttle = throttling.Throttle(migration)
+        throttle.refresh()
+
+        def done(index, result):
+            nonlocal checkpointed
+            tree, tree_index = owners[index]
+            tree.chunk_done(tree_index, chunks[index].length, result)
+            if (
+                monotonic() - checkpointed
+                >= settings.MIGRATION_CHECKPOINT_INTERVAL
+            ):
+                self.checkpoint(migration, destination, trees)
+                checkpointed = monotonic()
+
+        try:
+            results = copy_chunks(
+                chunks,
+                settings.MIGRATION_TRANSFER_WORKERS,
+                settings.MIGRATION_TRANSFER_VERIFY,
+                settings.MIGRATION_TRANSFER_RETRIES,
+                done,
+                throttle
+            )
+        except Exception:
+            # The chunks copied so far are skipped when the run is resumed.
+            self.checkpoint(migration, destination, trees)
+            raise
+        for tree in trees:
+            tree.complete()
+        self.checkpoint(migration, destination, trees)
+        copied = sum(tree.copied for tree in trees)
+        logger.info(
+            'migration %s copied %s bytes in %s chunks to %s, '
+            '%s chunks were unchanged',
+            migration.pk,
+            copied,
+            sum(1 for copied, block in results if copied),
+            destination,
+            sum(1 for copied, block in results if not copied)
+        )
+        return copied
+
+
+def get_driver():
+    return import_string(settings.MIGRATION_TRANSFER_DRIVER)()
@@ -3,23 +3,46 @@ from rest_framework.routers import DefaultRouter
 from rest_framework_simplejwt.views import (TokenObtainPairView,
                                             TokenRefreshView)
 
-
+from .export import EXPORT_SUFFIX
 from .views import (CredentialsViewSet, MountPointViewSet, WorkLoadViewSet,
                     MigrationTargetViewSet, MigrationViewSet, UserViewSet,
-                    run_migration, get_migration_state)
+                    run_migration, resync_migration, get_migration_state,
+                    run_migrations, get_migration_batch_state,
+                    poll_migration_states, get_migration_states,
+                    get_migration_state_cache)
+
 
+resources = {
+    'credentials': CredentialsViewSet,
+    'mount_points': MountPointViewSet,
+    'work_loads': WorkLoadViewSet,
+    'migration_targets': MigrationTargetViewSet,
+    'migrations': MigrationViewSet,
+}
 
 router = DefaultRouter()
-router.register(r'credentials', CredentialsViewSet)
-router.register(r'mount_points', MountPointViewSet)
-router.register(r'work_loads', WorkLoadViewSet)
-router.register(r'migration_targets', MigrationTargetViewSet)
-router.register(r'migrations', MigrationViewSet)
+for prefix, viewset in resources.items():
+    router.register(prefix, viewset)
+
+export_urls = [
+    path(f'v1/{prefix}{EXPORT_SUFFIX}', viewset.as_view({'get': 'export'}))
+    for prefix, viewset in resources.items()
+]
 
 
 urlpatterns = [
+    path('v1/migrations/run/', run_migrations),
+    path('v1/migrations/state/', get_migration_states),
+    path('v1/migrations/state/cache/', get_migration_state_cache),
+    path('v1/migrations/state/poll/', poll_migration_states),
+    path(
+        'v1/migrations/batches/<int:batch_id>/',
+        get_migration_batch_state
+    ),
     path('v1/migrations/<int:migration_id>/run/', run_migration),
+    path('v1/migrations/<int:migration_id>/resync/', resync_migration),
     path('v1/migrations/<int:migration_id>/state/', get_migration_state),
+    *export_urls,
     path('v1/', include(router.urls)),
     path('v1/auth/', UserViewSet.as_view({'post': 'create'})),
     path(
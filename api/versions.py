@@ -0,0 +1,41 @@
+import uuid
+
+from django.db import IntegrityError, transaction
+
+
+def version_name(model):
+    return model._meta.label_lower
+
+
+def bump(*models):
+    """Gives the models new versions once the current transaction commits.
+
+    The version rows are written by every writer, so they are updated after
+    the commit instead of being locked until the end of the transaction.
+    """
+    names = sorted({version_name(model) for model in models})
+    transaction.on_commit(lambda: save_versions(names))
+
+
+def save_versions(names):
+    from .models import ResourceVersion
+
+    for name in names:
+        version = uuid.uuid4().hex
+        if ResourceVersion.objects.filter(name=name).update(version=version):
+            continue
+        try:
+            with transaction.atomic():
+                ResourceVersion.objects.create(name=name, version=version)
+        except IntegrityError:
+            ResourceVersion.objects.filter(name=name).update(version=version)
+
+
+def get_versions(models):
+    from .models import ResourceVersion
+
+    names = [version_name(model) for model in models]
+    versions = dict(ResourceVersion.objects.filter(
+        name__in=names
+    ).values_list('name', 'version'))
+    return tuple(versions.get(name, '') for name in names)
@@ -1,16 +1,60 @@
+from hmac import compare_digest
+from time import monotonic
+
+from django.conf import settings
 from django.contrib.auth.models import User
-from rest_framework import viewsets
-from rest_framework.decorators import api_view, permission_classes
+from django.db import transaction
+from django.db.models import Count
+from django.http import HttpResponse
+from rest_framework import serializers, viewsets
+from rest_framework.decorators import action, api_view, permission_classes
+from rest_framework.exceptions import AuthenticationFailed
 from rest_framework.generics import get_object_or_404
 from rest_framework.permissions import AllowAny, IsAuthenticated
 from rest_framework.response import Response
+from rest_framework_simplejwt.authentication import JWTAuthentication
 
+from . import events, metrics, state_cache, throttling, timing, versions
+from .caching import ConditionalGetMixin
+from .export import ExportMixin
+from .bulk import upsert_mount_points, upsert_work_loads
+from .executor import submit_batch, submit_migration
 from .models import (Credentials, MountPoint, WorkLoad, MigrationTarget,
-                     Migration)
+                     Migration, MigrationBatch, MigrationState,
+                     BandwidthLimit, RUNNABLE_STATES)
 from .serializers import (UserSerializer, CredentialsSerializer,
                           MountPointSerializer, WorkLoadSerializer,
                           MigrationTargetSerializer, MigrationSerializer,
-                          check_mount_point, check_object)
+                          MigrationRunProfileSerializer,
+                          IdentityMap, check_bandwidth_limit,
+                          check_concurrency, check_migration_filters,
+                          check_migrations, check_mount_point, check_object,
+                          check_timeout, filter_work_loads)
+from .timing import TimedSerializerMixin
+
+
+BANDWIDTH_LIMITS = ('migration_limit', 'cloud_type_limit', 'global_limit')
+
+
+def bulk_response(result):
+    if result['errors'] and not result['results']:
+        return Response(result, status=400)
+    return Response(result, status=200)
+
+
+def get_items(request):
+    if not isinstance(request.data, list):
+        raise serializers.ValidationError(
+            {'non_field_errors': ['Expected a list of items.']}
+        )
+    return request.data
+
+
+class IdentityMapMixin:
+
+    def initial(self, request, *args, **kwargs):
+        self.identity_map = IdentityMap()
+        super().initial(request, *args, **kwargs)
 
 
 class UserViewSet(viewsets.ModelViewSet):
@@ -23,34 +67,57 @@ class UserViewSet(viewsets.ModelViewSet):
         serializer.save(is_active=True)
 
 
-class CredentialsViewSet(viewsets.ModelViewSet):
+class CredentialsViewSet(ExportMixin, ConditionalGetMixin,
+                         TimedSerializerMixin, viewsets.ModelViewSet):
     queryset = Credentials.objects.all()
+    version_models = (Credentials,)
     serializer_class = CredentialsSerializer
     permission_classes = [IsAuthenticated]
     http_method_names = ['get', 'post', 'patch', 'delete']
 
 
-class MountPointViewSet(viewsets.ModelViewSet):
+class MountPointViewSet(ExportMixin, ConditionalGetMixin,
+                        TimedSerializerMixin, viewsets.ModelViewSet):
     queryset = MountPoint.objects.all()
+    version_models = (MountPoint,)
     serializer_class = MountPointSerializer
     permission_classes = [IsAuthenticated]
     http_method_names = ['get', 'post', 'patch', 'delete']
 
+    @action(detail=False, methods=['post'])
+    def bulk(self, request):
+        return bulk_response(upsert_mount_points(get_items(request)))
+
 
-class WorkLoadViewSet(viewsets.ModelViewSet):
-    queryset = WorkLoad.objects.all()
+class WorkLoadViewSet(ExportMixin, ConditionalGetMixin, IdentityMapMixin,
+                      TimedSerializerMixin, viewsets.ModelViewSet):
+    queryset = WorkLoad.objects.select_related(
+        'credentials'
+    ).prefetch_related('storage')
+    version_models = (WorkLoad, Credentials, MountPoint)
     serializer_class = WorkLoadSerializer
     permission_classes = [IsAuthenticated]
     http_method_names = ['get', 'post', 'patch', 'delete']
 
+    def get_queryset(self):
+        return filter_work_loads(
+            super().get_queryset(),
+            self.request.query_params.get('cidr'),
+            self.request.query_params.get('ip_prefix')
+        )
+
     def perform_create(self, serializer):
         serializer.check_ip(self.request.data.get('ip'))
         credentials = check_object(
             self.request.data.get('credentials'),
             Credentials,
-            'credentials'
+            'credentials',
+            self.identity_map
+        )
+        storage = check_mount_point(
+            self.request.data.getlist('storage'),
+            self.identity_map
         )
-        storage = check_mount_point(self.request.data.getlist('storage'))
         serializer.save(credentials=credentials, storage=storage)
 
     def perform_update(self, serializer):
@@ -59,16 +126,32 @@ class WorkLoadViewSet(viewsets.ModelViewSet):
             credentials = check_object(
                 self.request.data.get('credentials'),
                 Credentials,
-                'credentials'
+                'credentials',
+                self.identity_map
             )
             serializer.save(credentials=credentials)
         if self.request.data.getlist('storage'):
-            storage = check_mount_point(self.request.data.getlist('storage'))
+            storage = check_mount_point(
+                self.request.data.getlist('storage'),
+                self.identity_map
+            )
             serializer.save(storage=storage)
 
+    @action(detail=False, methods=['post'])
+    def bulk(self, request):
+        return bulk_response(
+            upsert_work_loads(get_items(request), self.identity_map)
+        )
+
 
-class MigrationTargetViewSet(viewsets.ModelViewSet):
-    queryset = MigrationTarget.objects.all()
+class MigrationTargetViewSet(ExportMixin, ConditionalGetMixin,
+                             IdentityMapMixin, TimedSerializerMixin,
+                             viewsets.ModelViewSet):
+    queryset = MigrationTarget.objects.select_related(
+        'cloud_credentials',
+        'target_vm__credentials'
+    ).prefetch_related('target_vm__storage')
+    version_models = (MigrationTarget, WorkLoad, Credentials, MountPoint)
     serializer_class = MigrationTargetSerializer
     permission_classes = [IsAuthenticated]
     http_method_names = ['get', 'post', 'patch', 'delete']
@@ -77,13 +160,15 @@ class MigrationTargetViewSet(viewsets.ModelViewSet):
         cloud_credentials = check_object(
             self.request.data.get('cloud_credentials'),
             Credentials,
-            'cloud_credentials'
+            'cloud_credentials',
+            self.identity_map
         )
         if self.request.data.get('target_vm'):
             target_vm = check_object(
                 self.request.data.get('target_vm'),
                 WorkLoad,
-                'target_vm'
+                'target_vm',
+                self.identity_map
             )
             serializer.save(target_vm=target_vm)
         serializer.save(
@@ -95,38 +180,92 @@ class MigrationTargetViewSet(viewsets.ModelViewSet):
             cloud_credentials = check_object(
                 self.request.data.get('cloud_credentials'),
                 Credentials,
-                'credentials'
+                'credentials',
+                self.identity_map
             )
             serializer.save(cloud_credentials=cloud_credentials)
         if self.request.data.get('target_vm'):
             target_vm = check_object(
                 self.request.data.get('target_vm'),
                 WorkLoad,
-                'work load'
+                'work load',
+                self.identity_map
             )
             serializer.save(target_vm=target_vm)
         serializer.save()
 
+    @action(detail=True, methods=['get', 'patch'])
+    def bandwidth(self, request, pk=None):
+        migration_target = get_object_or_404(MigrationTarget, pk=pk)
+        if request.method == 'PATCH':
+            limits = {
+                name: check_bandwidth_limit(request.data[name], name)
+                for name in BANDWIDTH_LIMITS
+                if name in request.data
+            }
+            with transaction.atomic():
+                if 'migration_limit' in limits:
+                    migration_target.bandwidth_limit = (
+                        limits['migration_limit']
+                    )
+                    migration_target.save(update_fields=['bandwidth_limit'])
+                if 'cloud_type_limit' in limits:
+                    BandwidthLimit.objects.update_or_create(
+                        cloud_type=migration_target.cloud_type,
+                        defaults={'rate': limits['cloud_type_limit']}
+                    )
+                if 'global_limit' in limits:
+                    BandwidthLimit.objects.update_or_create(
+                        cloud_type='',
+                        defaults={'rate': limits['global_limit']}
+                    )
+            throttling.apply(migration_target)
+        migration_limit, cloud_type_limit, global_limit = throttling.limits(
+            migration_target
+        )
+        data = {
+            'cloud_type': migration_target.cloud_type,
+            'migration_limit': migration_limit,
+            'cloud_type_limit': cloud_type_limit,
+            'global_limit': global_limit
+        }
+        return Response(data, status=200)
 
-class MigrationViewSet(viewsets.ModelViewSet):
-    queryset = Migration.objects.all()
+
+class MigrationViewSet(ExportMixin, ConditionalGetMixin, IdentityMapMixin,
+                       TimedSerializerMixin, viewsets.ModelViewSet):
+    queryset = Migration.objects.select_related(
+        'source_of_type__credentials',
+        'migration_target__cloud_credentials',
+        'migration_target__target_vm__credentials'
+    ).prefetch_related(
+        'selected_mount_points',
+        'source_of_type__storage',
+        'migration_target__target_vm__storage'
+    )
+    version_models = (
+        Migration, MigrationTarget, WorkLoad, Credentials, MountPoint
+    )
     serializer_class = MigrationSerializer
     permission_classes = [IsAuthenticated]
     http_method_names = ['get', 'post', 'patch', 'delete']
 
     def perform_create(self, serializer):
         selected_mount_points = check_mount_point(
-            self.request.data.getlist('selected_mount_points')
+            self.request.data.getlist('selected_mount_points'),
+            self.identity_map
         )
         source_of_type = check_object(
             self.request.data.get('source_of_type'),
             WorkLoad,
-            'work load'
+            'work load',
+            self.identity_map
         )
         migration_target = check_object(
             self.request.data.get('migration_target'),
             MigrationTarget,
-            'migration target'
+            'migration target',
+            self.identity_map
         )
         serializer.save(
             selected_mount_points=selected_mount_points,
@@ -137,42 +276,235 @@ class MigrationViewSet(viewsets.ModelViewSet):
     def perform_update(self, serializer):
         if self.request.data.getlist('selected_mount_points'):
             selected_mount_points = check_mount_point(
-                self.request.data.getlist('selected_mount_points')
+                self.request.data.getlist('selected_mount_points'),
+                self.identity_map
             )
             serializer.save(selected_mount_points=selected_mount_points)
         if self.request.data.get('source_of_type'):
             source_of_type = check_object(
                 self.request.data.get('source_of_type'),
                 WorkLoad,
-                'work load'
+                'work load',
+                self.identity_map
             )
             serializer.save(source_of_type=source_of_type)
         if self.request.data.get('migration_target'):
             migration_target = check_object(
                 self.request.data.get('migration_target'),
                 MigrationTarget,
-                'migration target'
+                'migration target',
+                self.identity_map
             )
             serializer.save(migration_target=migration_target)
+        serializer.save()
+
+    @action(detail=True, methods=['get'])
+    def profiles(self, request, pk=None):
+        migration = get_object_or_404(Migration, pk=pk)
+        page = self.paginate_queryset(migration.run_profiles.all())
+        serializer = MigrationRunProfileSerializer(page, many=True)
+        with timing.span('serializer'):
+            data = serializer.data
+        return self.get_paginated_response(data)
 
 
 @api_view(['GET'])
 @permission_classes((IsAuthenticated,))
 def run_migration(request, migration_id):
     migration = get_object_or_404(Migration, pk=migration_id)
-    if migration.migration_state not in ('not_started', 'error'):
+    if not Migration.resume(migration.pk):
         return Response({'''migration can't run'''}, status=400)
-    error = migration.run_migration()
-    if error:
-        return Response(error, status=400)
-    return Response('migration successfully', status=200)
+    submit_migration(migration.pk)
+    data = {
+        'migration id': migration.pk,
+        'state url': request.build_absolute_uri(
+            f'/api/v1/migrations/{migration.pk}/state/'
+        )
+    }
+    return Response(data, status=202)
+
+
+@api_view(['GET'])
+@permission_classes((IsAuthenticated,))
+def resync_migration(request, migration_id):
+    migration = get_object_or_404(Migration, pk=migration_id)
+    if not Migration.resync(migration.pk):
+        return Response({'''migration can't resync'''}, status=400)
+    submit_migration(migration.pk)
+    data = {
+        'migration id': migration.pk,
+        'state url': request.build_absolute_uri(
+            f'/api/v1/migrations/{migration.pk}/state/'
+        )
+    }
+    return Response(data, status=202)
 
 
 @api_view(['GET'])
 @permission_classes((IsAuthenticated,))
 def get_migration_state(request, migration_id):
     migration = get_object_or_404(Migration, pk=migration_id)
+    progress, transferred = migration.progress()
+    data = {
+        'migration state': migration.migration_state,
+        'progress': progress,
+        'bytes transferred': transferred
+    }
+    if migration.migration_error:
+        data['migration error'] = migration.migration_error
+    return Response(data, status=200)
+
+
+@api_view(['POST'])
+@permission_classes((IsAuthenticated,))
+def run_migrations(request):
+    concurrency = check_concurrency(request.data.get('concurrency'))
+    if hasattr(request.data, 'getlist'):
+        migration_list = request.data.getlist('ids')
+    else:
+        migration_list = request.data.get('ids')
+    filters = check_migration_filters(request.data)
+    if migration_list:
+        migration_ids = check_migrations(migration_list)
+        migrations = Migration.objects.filter(pk__in=migration_ids)
+    elif filters:
+        migration_ids = None
+        migrations = Migration.objects.filter(**filters)
+    else:
+        raise serializers.ValidationError(
+            {'ids': ['This field is required.']}
+        )
+    with transaction.atomic():
+        batch = MigrationBatch.objects.create(concurrency=concurrency)
+        count = migrations.filter(
+            migration_state__in=RUNNABLE_STATES
+        ).update(batch=batch)
+        versions.bump(Migration)
+        if migration_ids is not None and count != len(migration_ids):
+            raise serializers.ValidationError(
+                {'ids': ['''migrations can't run''']}
+            )
+        if not count:
+            raise serializers.ValidationError(
+                {'ids': ['No migrations can run.']}
+            )
+    submit_batch(batch.pk)
     data = {
-        'migration state': migration.migration_state
+        'batch id': batch.pk,
+        'migrations': count,
+        'batch url': request.build_absolute_uri(
+            f'/api/v1/migrations/batches/{batch.pk}/'
+        )
+    }
+    return Response(data, status=202)
+
+
+@api_view(['GET'])
+@permission_classes((IsAuthenticated,))
+def get_migration_batch_state(request, batch_id):
+    batch = get_object_or_404(MigrationBatch, pk=batch_id)
+    states = dict(
+        batch.migrations.order_by().values_list(
+            'migration_state'
+        ).annotate(count=Count('pk'))
+    )
+    total = sum(states.values())
+    finished = (
+        states.get(MigrationState.SUCCESS, 0)
+        + states.get(MigrationState.ERROR, 0)
+    )
+    data = {
+        'batch id': batch.pk,
+        'concurrency': batch.concurrency,
+        'migrations': total,
+        'migration states': {
+            state: states.get(state, 0) for state in MigrationState.values
+        },
+        'progress': round(finished / total * 100, 2) if total else 100.0
     }
     return Response(data, status=200)
+
+
+@api_view(['GET'])
+@permission_classes((IsAuthenticated,))
+def poll_migration_states(request):
+    try:
+        migration_ids = events.parse_ids(
+            request.query_params.getlist('ids'),
+            request.query_params.get('batch')
+        )
+    except ValueError as e:
+        raise serializers.ValidationError({'ids': [str(e)]})
+    timeout = check_timeout(request.query_params.get('timeout'))
+    since = request.query_params.get('since')
+    deadline = monotonic() + timeout
+    seen_version = events.version()
+    states = events.get_states(migration_ids)
+    while events.states_token(states) == since:
+        remaining = deadline - monotonic()
+        if remaining <= 0:
+            break
+        seen_version = events.wait(
+            seen_version,
+            min(remaining, settings.MIGRATION_STREAM_POLL_INTERVAL)
+        )
+        states = events.get_states(migration_ids)
+    data = {
+        'migrations': [
+            {'id': pk, 'migration state': state}
+            for pk, state in sorted(states.items())
+        ],
+        'since': events.states_token(states)
+    }
+    return Response(data, status=200)
+
+
+@api_view(['GET'])
+@permission_classes((IsAuthenticated,))
+def get_migration_states(request):
+    try:
+        migration_ids = events.parse_ids(
+            request.query_params.getlist('ids'),
+            request.query_params.get('batch')
+        )
+    except ValueError as e:
+        raise serializers.ValidationError({'ids': [str(e)]})
+    states = state_cache.get_states(migration_ids)
+    data = {
+        'migrations': [
+            {'id': pk, 'migration state': state}
+            for pk, state in sorted(states.items())
+        ],
+        'missing': [pk for pk in migration_ids if pk not in states]
+    }
+    return Response(data, status=200)
+
+
+@api_view(['GET'])
+@permission_classes((IsAuthenticated,))
+def get_migration_state_cache(request):
+    return Response(state_cache.stats(), status=200)
+
+
+def metrics_allowed(request):
+    if request.META.get('REMOTE_ADDR') in settings.METRICS_ALLOWED_IPS:
+        return True
+    authorization = request.META.get('HTTP_AUTHORIZATION', '')
+    if settings.METRICS_TOKEN and compare_digest(
+        authorization.encode(),
+        f'Bearer {settings.METRICS_TOKEN}'.encode()
+    ):
+        return True
+    try:
+        return JWTAuthentication().authenticate(request) is not None
+    except AuthenticationFailed:
+        return False
+
+
+def get_metrics(request):
+    if not metrics_allowed(request):
+        return HttpResponse(status=401)
+    return HttpResponse(
+        metrics.exposition(),
+        content_type=metrics.CONTENT_TYPE
+    )
@@ -0,0 +1,105 @@
+import logging
+import os
+import socket
+import threading
+
+from django.conf import settings
+from django.db import connection
+from django.db.models import Q
+
+from .models import Migration
+from .scheduler import advance_batches
+
+logger = logging.getLogger(__name__)
+
+
+def default_worker_name():
+    return f'{socket.gethostname()}:{os.getpid()}'
+
+
+class Heartbeat(threading.Thread):
+
+    def __init__(self, migration_id, owner, lease_seconds):
+        super().__init__(name=f'heartbeat-{migration_id}', daemon=True)
+        self.migration_id = migration_id
+        self.owner = owner
+        self.lease_seconds = lease_seconds
+        self.stopped = threading.Event()
+
+    def run(self):
+        try:
+            while not self.stopped.wait(self.lease_seconds / 3):
+                if not Migration.heartbeat(
+                    self.migration_id,
+                    self.owner,
+                    self.lease_seconds
+                ):
+                    logger.warning(
+                        'lost lease on migration %s', self.migration_id
+                    )
+                    return
+        finally:
+            connection.close()
+
+    def stop(self):
+        self.stopped.set()
+        self.join()
+
+
+class MigrationWorker:
+
+    def __init__(self, name=None, lease_seconds=None):
+        self.name = name or default_worker_name()
+        self.lease_seconds = (
+            lease_seconds or settings.MIGRATION_LEASE_SECONDS
+        )
+
+    def owner(self):
+        return f'{self.name}:{threading.get_ident()}'
+
+    def run(self, migration_id=None):
+        owner = self.owner()
+        migration_id = Migration.claim(
+            owner,
+            self.lease_seconds,
+            pk=migration_id
+        )
+        if migration_id is None:
+            return None
+        logger.info('%s claimed migration %s', owner, migration_id)
+        heartbeat = Heartbeat(migration_id, owner, self.lease_seconds)
+        heartbeat.start()
+        try:
+            Migration(pk=migration_id).run_migration(lease_owner=owner)
+        except Exception as e:
+            Migration(pk=migration_id).fail(e, Q(lease_owner=owner))
+            raise
+        finally:
+            heartbeat.stop()
+            Migration.release_lease(migration_id, owner)
+        return migration_id
+
+    def run_forever(self, stopped, poll_interval, burst=False):
+        """Runs queued migrations, queues the next waves of batches if none.
+
+        Advancing the batches here carries on the batches of a web process
+        that stopped before their last wave.
+        """
+        try:
+            while not stopped.is_set():
+                try:
+                    busy = (
+                        self.run() is not None
+                        or advance_batches() > 0
+                    )
+                except Exception:
+                    logger.exception(
+                        '%s failed to run a migration', self.name
+                    )
+                    busy = False
+                if not busy:
+                    if burst:
+                        return
+                    stopped.wait(poll_interval)
+        finally:
+            connection.close()
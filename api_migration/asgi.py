@@ -10,7 +10,23 @@ https://docs.djangoproject.com/en/3.0/howto/deployment/asgi/
 import os
 
 from django.core.asgi import get_asgi_application
+from django.core.wsgi import get_wsgi_application
 
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'api_migration.settings')
 
-application = get_asgi_application()
+django_application = get_asgi_application()
+
+from api.export import EXPORT_SUFFIX, ExportApplication  # noqa: E402
+from api.streams import MigrationStateStream  # noqa: E402
+
+stream_application = MigrationStateStream(django_application)
+# Django 3.1 iterates streaming responses inside the event loop, where the
+# database can't be used, so exports run through the WSGI handler, each in a
+# thread of its own.
+export_application = ExportApplication(get_wsgi_application())
+
+
+async def application(scope, receive, send):
+    if scope['type'] == 'http' and scope['path'].endswith(EXPORT_SUFFIX):
+        return await export_application(scope, receive, send)
+    return await stream_application(scope, receive, send)
@@ -24,6 +24,7 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    'api.timing.RequestTimingMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
@@ -33,6 +34,22 @@ MIDDLEWARE = [
     'django.middleware.clickjacking.XFrameOptionsMiddleware',
 ]
 
+LOGGING = {
+    'version': 1,
+    'disable_existing_loggers': False,
+    'handlers': {
+        'console': {
+            'class': 'logging.StreamHandler',
+        },
+    },
+    'loggers': {
+        'api': {
+            'handlers': ['console'],
+            'level': os.getenv('API_LOG_LEVEL', 'WARNING'),
+        },
+    },
+}
+
 ROOT_URLCONF = 'api_migration.urls'
 
 TEMPLATES = [
@@ -61,6 +78,17 @@ DATABASES = {
     }
 }
 
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+    },
+    'migration_states': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+        'LOCATION': 'migration_states',
+        'OPTIONS': {'MAX_ENTRIES': 100000},
+    },
+}
+
 
 AUTH_PASSWORD_VALIDATORS = [
     {
@@ -100,9 +128,25 @@ REST_FRAMEWORK = {
     ],
     'DEFAULT_FILTER_BACKENDS': [
         'django_filters.rest_framework.DjangoFilterBackend'
-    ]
+    ],
+    'DEFAULT_PAGINATION_CLASS': 'api.pagination.PkCursorPagination',
+    'PAGE_SIZE': 100,
 }
 
+API_MAX_PAGE_SIZE = 1000
+API_RESPONSE_CACHE_SIZE = 256
+API_EXPORT_CHUNK_SIZE = 1000
+SLOW_QUERY_THRESHOLD_MS = float(os.getenv('SLOW_QUERY_THRESHOLD_MS', 200))
+# Slow queries always go to the api.slow_queries logger, a path also
+# appends them to that file for manage.py slow_queries.
+SLOW_QUERY_LOG = os.getenv('SLOW_QUERY_LOG', '')
+BENCHMARK_BASELINE = os.path.join(BASE_DIR, 'benchmarks', 'hot_paths.json')
+METRICS_ENABLED = os.getenv('METRICS_ENABLED', '1') == '1'
+METRICS_TOKEN = os.getenv('METRICS_TOKEN', '')
+METRICS_ALLOWED_IPS = [
+    ip for ip in os.getenv('METRICS_ALLOWED_IPS', '').split(',') if ip
+]
+
 SIMPLE_JWT = {
     'ACCESS_TOKEN_LIFETIME': timedelta(days=2),
     'REFRESH_TOKEN_LIFETIME': timedelta(days=1),
@@ -110,6 +154,59 @@ SIMPLE_JWT = {
     'SLIDING_TOKEN_REFRESH_LIFETIME': timedelta(days=1),
 }
 
+MIGRATION_EXECUTOR_WORKERS = int(
+    os.environ.get('MIGRATION_EXECUTOR_WORKERS', 4)
+)
+MIGRATION_EXECUTOR_EAGER = False
+MIGRATION_RUN_DELAY = 10
+MIGRATION_TRANSFER_DRIVER = os.environ.get(
+    'MIGRATION_TRANSFER_DRIVER',
+    'api.transfer.SleepDriver'
+)
+MIGRATION_TRANSFER_SOURCE_ROOT = os.environ.get(
+    'MIGRATION_TRANSFER_SOURCE_ROOT',
+    os.path.join(BASE_DIR, 'transfer', 'source')
+)
+MIGRATION_TRANSFER_DESTINATION_ROOT = os.environ.get(
+    'MIGRATION_TRANSFER_DESTINATION_ROOT',
+    os.path.join(BASE_DIR, 'transfer', 'destination')
+)
+MIGRATION_TRANSFER_CHUNK_SIZE = int(
+    os.environ.get('MIGRATION_TRANSFER_CHUNK_SIZE', 64 * 1024 * 1024)
+)
+MIGRATION_TRANSFER_WORKERS = int(
+    os.environ.get('MIGRATION_TRANSFER_WORKERS', 4)
+)
+MIGRATION_TRANSFER_VERIFY = True
+MIGRATION_TRANSFER_RETRIES = 3
+MIGRATION_CHECKPOINT_INTERVAL = float(
+    os.environ.get('MIGRATION_CHECKPOINT_INTERVAL', 5)
+)
+MIGRATION_BANDWIDTH_LIMIT = int(
+    os.environ.get('MIGRATION_BANDWIDTH_LIMIT', 0)
+) or None
+MIGRATION_BANDWIDTH_BURST = 1.0
+MIGRATION_BANDWIDTH_REFRESH = 1.0
+MIGRATION_PROFILE_SAMPLE_RATE = float(
+    os.environ.get('MIGRATION_PROFILE_SAMPLE_RATE', 0)
+)
+MIGRATION_PROFILE_SAMPLE_MODE = 'phases'
+MIGRATION_PROFILE_STATS_LIMIT = 30
+MIGRATION_PHASE_HOOKS = []
+MIGRATION_LEASE_SECONDS = 60
+MIGRATION_WORKER_POLL_INTERVAL = 5
+MIGRATION_BATCH_SCHEDULERS = 2
+MIGRATION_BATCH_CONCURRENCY = 10
+MIGRATION_BATCH_MAX_CONCURRENCY = 100
+MIGRATION_BATCH_POLL_INTERVAL = 1
+MIGRATION_STREAM_MAX_IDS = 1000
+MIGRATION_STREAM_POLL_INTERVAL = 2
+MIGRATION_STREAM_EVENT_INTERVAL = 0.2
+MIGRATION_STREAM_PING_INTERVAL = 15
+MIGRATION_LONG_POLL_TIMEOUT = 30
+MIGRATION_STATE_CACHE = 'migration_states'
+MIGRATION_STATE_CACHE_TIMEOUT = 10
+
 CORS_ORIGIN_ALLOW_ALL = True
 CORS_URLS_REGEX = r'^/api/.*$'
 
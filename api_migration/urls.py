@@ -5,6 +5,8 @@ from rest_framework import permissions
 from drf_yasg.views import get_schema_view
 from drf_yasg import openapi
 
+from api.views import get_metrics
+
 
 schema_view = get_schema_view(
    openapi.Info(
@@ -19,6 +21,7 @@ schema_view = get_schema_view(
 urlpatterns = [
     path('admin/', admin.site.urls),
     path('api/', include('api.urls')),
+    path('metrics', get_metrics, name='metrics'),
     path('swagger/', schema_view.with_ui(
         'swagger', cache_timeout=0),
          name='schema-swagger-ui'